@@ -1,7 +1,10 @@
 import requests
+import httpx
 import os
 from dotenv import load_dotenv
 import json
+from singleflight import SingleFlight, AsyncSingleFlight, flight_key
+from metrics import timer, inc, LLM_CALLS, LLM_TOKENS
 
 load_dotenv()
 
@@ -77,8 +80,14 @@ def format_citations(sources):
 
 OLLAMA_URL = "http://localhost:11434/api/generate"
 
-def rewrite_with_llm(context: str, query: str) -> str:
-    prompt = f"""
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+LLM_MODEL = "liquid/lfm-2.5-1.2b-instruct:free"
+LLM_TIMEOUT = 300
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+
+
+def build_prompt(context: str, query: str) -> str:
+    return f"""
 You are a careful and knowledgeable assistant answering questions using retrieved document excerpts.
 
 Your goal is to produce a complete, well-structured answer that:
@@ -101,29 +110,166 @@ Context:
 {context}
 """
 
-    response = requests.post(
-        url="https://openrouter.ai/api/v1/chat/completions",
-        headers={
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-        },
-        data=json.dumps({
-            "model": "liquid/lfm-2.5-1.2b-instruct:free",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.0,
-            "max_tokens": 350
-        }),
-        timeout=300
-    )
 
-    response.raise_for_status()
-    data = response.json()
+def llm_payload(context: str, query: str) -> dict:
+    return {
+        "model": LLM_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": build_prompt(context, query)
+            }
+        ],
+        "temperature": 0.0,
+        "max_tokens": 350
+    }
+
+
+def llm_headers() -> dict:
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+    }
+
+
+def parse_llm_response(data: dict) -> str:
     try:
         return data["choices"][0]["message"]["content"].strip()
     except (KeyError, IndexError):
-        raise RuntimeError(f"Malformed LLM response: {data}")
\ No newline at end of file
+        raise RuntimeError(f"Malformed LLM response: {data}")
+
+
+def record_llm_usage(payload: dict, mode: str, data: dict | None = None, completion: str | None = None):
+    """
+    Counts one LLM call and its tokens, from the provider's usage block when
+    present, else whitespace tokens of the prompt and completion.
+    """
+    usage = (data or {}).get("usage") or {}
+    prompt_tokens = usage.get("prompt_tokens") or len(payload["messages"][0]["content"].split())
+    completion_tokens = usage.get("completion_tokens") or len((completion or "").split())
+    inc(LLM_CALLS, mode=mode)
+    inc(LLM_TOKENS, prompt_tokens, kind="prompt")
+    inc(LLM_TOKENS, completion_tokens, kind="completion")
+
+
+# identical prompts in flight at the same time share one generation
+_llm_flight = SingleFlight()
+_async_llm_flight = AsyncSingleFlight()
+
+
+def _post_llm(payload: dict) -> str:
+    with timer("llm"):
+        response = requests.post(
+            url=OPENROUTER_URL,
+            headers=llm_headers(),
+            data=json.dumps(payload),
+            timeout=LLM_TIMEOUT
+        )
+
+        response.raise_for_status()
+        data = response.json()
+        answer = parse_llm_response(data)
+    record_llm_usage(payload, "sync", data, answer)
+    return answer
+
+
+def rewrite_with_llm(context: str, query: str) -> str:
+    payload = llm_payload(context, query)
+    return _llm_flight.do(flight_key("llm", payload), _post_llm, payload)
+
+
+# =========================
+# ASYNC CLIENT (POOLED KEEP-ALIVE)
+# =========================
+
+_async_client = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Shared AsyncClient so every request reuses pooled keep-alive connections
+    to OpenRouter. Created lazily inside the running event loop.
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=LLM_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS
+            )
+        )
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def _post_llm_async(payload: dict) -> str:
+    with timer("llm"):
+        response = await get_async_client().post(
+            OPENROUTER_URL,
+            headers=llm_headers(),
+            json=payload
+        )
+
+        response.raise_for_status()
+        data = response.json()
+        answer = parse_llm_response(data)
+    record_llm_usage(payload, "async", data, answer)
+    return answer
+
+
+async def rewrite_with_llm_async(context: str, query: str) -> str:
+    payload = llm_payload(context, query)
+    return await _async_llm_flight.do(
+        flight_key("llm", payload),
+        lambda: _post_llm_async(payload)
+    )
+
+
+async def stream_llm(context: str, query: str):
+    """
+    Yields completion text as it arrives, using the provider's streaming
+    mode. Closing the generator closes the response, which cancels the
+    upstream generation.
+    """
+    payload = {**llm_payload(context, query), "stream": True}
+    parts = []
+    usage = None
+
+    try:
+        with timer("llm"):
+            async with get_async_client().stream(
+                "POST",
+                OPENROUTER_URL,
+                headers=llm_headers(),
+                json=payload
+            ) as response:
+                response.raise_for_status()
+
+                async for line in response.aiter_lines():
+                    # SSE comments (": OPENROUTER PROCESSING") and blank separators
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+
+                    chunk = json.loads(data)
+                    if "error" in chunk:
+                        raise RuntimeError(f"LLM stream error: {chunk['error']}")
+                    usage = chunk.get("usage") or usage
+                    try:
+                        delta = chunk["choices"][0].get("delta", {}).get("content")
+                    except (KeyError, IndexError):
+                        raise RuntimeError(f"Malformed LLM stream chunk: {chunk}")
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+    finally:
+        record_llm_usage(payload, "stream", {"usage": usage}, "".join(parts))
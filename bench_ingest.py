@@ -0,0 +1,369 @@
+"""
+Ingest throughput benchmark over a synthetic PDF corpus.
+
+Generates reproducible PDFs (numbered chapters and sections, repeated
+headers and footers, figure and table captions) and runs them through the
+parser, semantic chunking and index_chunks against a stub embedder and a
+null index. Reports pages/s, chunks/s, peak memory and per-function time
+as JSON.
+
+    python bench_ingest.py --sizes 5,50,200,1000 --embed-ms 30 --out ingest.json
+    python bench_ingest.py --sizes 1000 --page-workers 0,2,4 --no-memory --no-profile
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import random
+import resource
+import time
+import tracemalloc
+
+import bench_stubs
+
+VOCAB = (
+    "network packet protocol layer server client peer routing latency "
+    "bandwidth model system design process storage cache index query "
+    "document section policy control signal buffer thread queue memory "
+    "request response interface module service update review security"
+).split()
+
+# functions reported by name in every run, when they show up in the profile
+TRACKED = (
+    "detect_boilerplate_lines",
+    "process_page",
+    "iter_paragraph_blocks",
+    "paragraph_blocks_from_pages",
+    "iter_fixed_size_blocks",
+    "fixed_size_blocks",
+    "iter_semantic_chunks",
+    "semantic_chunk_blocks",
+    "build_chunk",
+    "embed_texts",
+    "build_records",
+    "index_chunks",
+    "extract_text",
+)
+
+
+# =========================
+# SYNTHETIC PDF
+# =========================
+
+def _escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages):
+    """
+    pages: list of pages, each a list of text lines
+    Writes a minimal PDF with one Helvetica text stream per page.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        (
+            "<< /Type /Pages /Kids [" + " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages)))
+            + f"] /Count {len(pages)} >>"
+        ).encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, lines in enumerate(pages):
+        ops = ["BT /F1 10 Tf 12 TL 50 780 Td"]
+        ops.extend(f"({_escape(line)}) Tj T*" for line in lines)
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        objects.append((
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792]"
+            f" /Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        ).encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for n, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for off in offsets:
+        out += f"{off:010d} 00000 n \n".encode()
+    out += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    ).encode()
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def synthetic_pages(n_pages: int, seed: int = 0, sections: bool = True, pages_per_chapter: int = 10):
+    """
+    Page line lists with a running header and footer, chapter openers,
+    numbered section headings (unless sections=False), body paragraphs and
+    figure/table captions.
+    """
+    rng = random.Random(seed)
+    pages = []
+    section = 0
+
+    for p in range(n_pages):
+        chapter = p // pages_per_chapter + 1
+        lines = ["Synthetic Systems Handbook", "Internal Use Only"]
+        if p % pages_per_chapter == 0:
+            lines.append(f"CHAPTER {chapter}")
+            section = 0
+
+        for _ in range(3):
+            if sections and rng.random() < 0.5:
+                section += 1
+                lines.append(f"{chapter}.{section} {rng.choice(VOCAB).title()} {rng.choice(VOCAB)}")
+            for _ in range(rng.randint(3, 6)):
+                lines.append(" ".join(rng.choice(VOCAB) for _ in range(rng.randint(9, 14))) + ".")
+            r = rng.random()
+            if r < 0.15:
+                lines.append(f"Figure {p + 1} {rng.choice(VOCAB)} overview")
+            elif r < 0.25:
+                lines.append(f"Table {p + 1} {rng.choice(VOCAB)} summary")
+
+        lines.append(f"Page {p + 1}")
+        lines.append("Synthetic Corp")
+        pages.append(lines)
+    return pages
+
+
+def build_corpus(directory: str, sizes, seed: int = 0, sections: bool = True):
+    paths = {}
+    for size in sizes:
+        path = os.path.join(directory, f"synthetic_{size}p.pdf")
+        write_pdf(path, synthetic_pages(size, seed=seed + size, sections=sections))
+        paths[size] = path
+    return paths
+
+
+# =========================
+# MEASUREMENT
+# =========================
+
+def parse_and_chunk(path: str):
+    from pdfreader import iter_document_blocks, iter_semantic_chunks
+
+    counts = {"blocks": 0}
+
+    def counted(blocks):
+        for b in blocks:
+            counts["blocks"] += 1
+            yield b
+
+    chunks = list(iter_semantic_chunks(counted(iter_document_blocks(path))))
+    return counts["blocks"], chunks
+
+
+def run_stages(path: str):
+    """
+    Sequential parse -> chunk -> index in this thread, timed per stage.
+    """
+    from embeddings import index_chunks
+
+    start = time.perf_counter()
+    blocks, chunks = parse_and_chunk(path)
+    parsed = time.perf_counter()
+    indexed = index_chunks(iter(chunks))["upserted"]
+    done = time.perf_counter()
+    return {
+        "blocks": blocks,
+        "chunks": len(chunks),
+        "indexed": indexed,
+        "parse_chunk_s": parsed - start,
+        "index_s": done - parsed,
+        "total_s": done - start,
+    }
+
+
+def run_pipelined(path: str, page_workers=None):
+    """
+    The production path: bounded page / chunk stages feeding index_chunks.
+
+    page_workers: page-extraction processes (defaults to INGEST_PAGE_WORKERS)
+    """
+    from embeddings import index_chunks
+    from ingest import iter_document_chunks, iter_parsed_blocks, CHUNK_QUEUE_SIZE
+    from pipeline import bounded
+
+    stats = {"chunks": 0}
+    start = time.perf_counter()
+    blocks = iter_parsed_blocks(path, page_workers=page_workers)
+    chunks = bounded(
+        iter_document_chunks(path, "bench", os.path.basename(path), stats=stats, blocks=blocks),
+        maxsize=CHUNK_QUEUE_SIZE,
+        name="chunks"
+    )
+    indexed = index_chunks(chunks)["upserted"]
+    return {"chunks": stats["chunks"], "indexed": indexed, "total_s": time.perf_counter() - start}
+
+
+def compare_page_workers(path: str, pages: int, workers, repeat: int):
+    """
+    Pipelined pages/s for each page-worker count; "gain" is the best
+    parallel rate over the sequential one (0 workers).
+    """
+    rates = {}
+    for w in workers:
+        # starts the pool's processes outside the timed runs
+        run_pipelined(path, page_workers=w)
+        best = min(run_pipelined(path, page_workers=w)["total_s"] for _ in range(repeat))
+        rates[str(w)] = pages / best if best else None
+    parallel = [r for w, r in rates.items() if int(w) > 1 and r]
+    sequential = rates.get("0") or rates.get("1")
+    return {
+        "pages_per_s": rates,
+        "gain": max(parallel) / sequential if parallel and sequential else None,
+        "cpus": os.cpu_count(),
+    }
+
+
+def profile_functions(path: str, top: int):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    run_stages(path)
+    profiler.disable()
+
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append({
+            "function": name,
+            "file": os.path.basename(filename),
+            "line": line,
+            "calls": nc,
+            "self_s": tt,
+            "cumulative_s": ct,
+        })
+
+    own = {os.path.basename(p) for p in os.listdir(os.path.dirname(os.path.abspath(__file__))) if p.endswith(".py")}
+    tracked = [r for r in rows if r["function"] in TRACKED and (r["file"] in own or r["function"] == "extract_text")]
+    hottest = sorted(rows, key=lambda r: r["self_s"], reverse=True)[:top]
+    return {
+        "tracked": sorted(tracked, key=lambda r: r["cumulative_s"], reverse=True),
+        "top_self": hottest,
+    }
+
+
+def peak_memory(path: str):
+    tracemalloc.start()
+    try:
+        run_stages(path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if os.uname().sysname == "Darwin" else rss * 1024
+
+
+def run(args):
+    inference = bench_stubs.StubInference(args.embed_ms, 0.0, args.per_item_ms)
+    index = bench_stubs.NullIndex(args.upsert_ms)
+    bench_stubs.install(inference, index=index)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    corpus_dir = os.path.join(bench_stubs.BENCH_DIR, "corpus")
+    os.makedirs(corpus_dir, exist_ok=True)
+    paths = build_corpus(corpus_dir, sizes, seed=args.seed, sections=not args.no_sections)
+
+    report = {
+        "config": {
+            "sizes": sizes,
+            "seed": args.seed,
+            "sections": not args.no_sections,
+            "repeat": args.repeat,
+            "embed_ms": args.embed_ms,
+            "per_item_ms": args.per_item_ms,
+            "upsert_ms": args.upsert_ms,
+            "page_workers": args.page_workers,
+        },
+        "runs": [],
+    }
+
+    # imports, regex compilation and first-call overheads
+    run_stages(paths[min(sizes)])
+
+    for size in sizes:
+        path = paths[size]
+        staged = [run_stages(path) for _ in range(args.repeat)]
+        pipelined = [run_pipelined(path) for _ in range(args.repeat)]
+        best = min(staged, key=lambda r: r["total_s"])
+        best_pipe = min(pipelined, key=lambda r: r["total_s"])
+
+        entry = {
+            "pages": size,
+            "file_bytes": os.path.getsize(path),
+            "blocks": best["blocks"],
+            "chunks": best["chunks"],
+            "parse_chunk_s": best["parse_chunk_s"],
+            "index_s": best["index_s"],
+            "pages_per_s": size / best["parse_chunk_s"] if best["parse_chunk_s"] else None,
+            "chunks_per_s_index": best["chunks"] / best["index_s"] if best["index_s"] else None,
+            "pipelined_s": best_pipe["total_s"],
+            "pipelined_pages_per_s": size / best_pipe["total_s"] if best_pipe["total_s"] else None,
+        }
+        if args.page_workers:
+            workers = [int(w) for w in args.page_workers.split(",") if w]
+            entry["page_workers"] = compare_page_workers(path, size, workers, args.repeat)
+            print(
+                f"{size:>5} pages: page workers "
+                + ", ".join(f"{w}: {r:.1f} pages/s" for w, r in entry["page_workers"]["pages_per_s"].items())
+                + f" on {os.cpu_count()} CPUs",
+                flush=True
+            )
+        if not args.no_memory:
+            entry["peak_traced_bytes"] = peak_memory(path)
+        if not args.no_profile:
+            entry["functions"] = profile_functions(path, args.top)
+        entry["max_rss_bytes"] = max_rss_bytes()
+        report["runs"].append(entry)
+
+        print(
+            f"{size:>5} pages: {entry['pages_per_s']:8.1f} pages/s parse+chunk, "
+            f"{entry['chunks_per_s_index'] or 0:8.1f} chunks/s index, "
+            f"{entry['pipelined_pages_per_s']:8.1f} pages/s pipelined"
+            + (f", peak {entry['peak_traced_bytes'] / 2**20:.1f} MiB" if "peak_traced_bytes" in entry else ""),
+            flush=True
+        )
+
+    report["calls"] = {"inference": inference.stats.to_dict(), "index": index.stats.to_dict()}
+    from pdfreader import shutdown_page_pool
+    shutdown_page_pool()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="5,50,200,1000", help="comma-separated page counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-sections", action="store_true", help="no numbered headings (paragraph / fixed-size path)")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per size; the best is reported")
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="latency per embed call")
+    parser.add_argument("--per-item-ms", type=float, default=0.0, help="extra latency per embedded text")
+    parser.add_argument("--upsert-ms", type=float, default=0.0, help="latency per upsert call")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--no-profile", action="store_true", help="skip the cProfile pass")
+    parser.add_argument("--top", type=int, default=15, help="hottest functions listed per size")
+    parser.add_argument(
+        "--page-workers",
+        help="comma-separated page-worker counts to compare on the pipelined path, e.g. 0,2,4"
+    )
+    parser.add_argument("--out", default="bench_ingest.json")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
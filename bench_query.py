@@ -0,0 +1,279 @@
+"""
+Offline query benchmark.
+
+Replays a question set through hybrid_search, context selection and
+rewrite_with_llm against stub (or recorded) backends and writes per-stage
+timings, percentiles and retrieval hit rate as JSON. The rerank is timed
+as its own stage, and a run that never reranks fails.
+
+    python bench_query.py --repeat 20 --embed-ms 40 --rerank-ms 120 --llm-ms 800
+    python bench_query.py --questions golden.json --corpus chunks.jsonl --out before.json
+    python bench_query.py --record inference.json --repeat 1   # live inference (pc_key)
+    python bench_query.py --recorded inference.json
+"""
+import argparse
+import json
+import random
+import time
+
+import bench_stubs
+
+import numpy as np
+
+FILLER = (
+    "overview system design process result method analysis table figure "
+    "value input output level support service control policy review update "
+    "performance security storage access user interface module report"
+).split()
+
+
+def percentiles(samples_ms):
+    a = np.asarray(samples_ms, dtype=np.float64)
+    if not len(a):
+        return {"count": 0}
+    return {
+        "count": int(len(a)),
+        "mean_ms": float(a.mean()),
+        "p50_ms": float(np.percentile(a, 50)),
+        "p95_ms": float(np.percentile(a, 95)),
+        "p99_ms": float(np.percentile(a, 99)),
+        "max_ms": float(a.max()),
+    }
+
+
+def load_questions(path):
+    if path:
+        with open(path) as f:
+            return json.load(f)
+    from app import gsq
+    return gsq
+
+
+def synthetic_corpus(questions, docs=4, sections_per_doc=12, chunks_per_section=3, seed=0):
+    """
+    Chunks for a few documents. Every question gets a section named after
+    its first expected section whose text shares the question's words; the
+    rest is filler and partial overlaps so retrieval has something to miss.
+    """
+    rng = random.Random(seed)
+    chunks = []
+    gid = 0
+    targets = {
+        q["expected_sections"][0]: bench_stubs.words(q["question"])
+        for q in questions if q.get("expected_sections")
+    }
+
+    for d in range(docs):
+        doc_id = f"bench-doc-{d}"
+        names = [f"{d + 1}.{s + 1} Section {s + 1}" for s in range(sections_per_doc)]
+        if d == 0:
+            names[:len(targets)] = list(targets)
+
+        for page, section in enumerate(names, 1):
+            topic = targets.get(section)
+            for _ in range(chunks_per_section):
+                if topic:
+                    words = topic + rng.sample(FILLER, 10)
+                else:
+                    # distractors reuse a few question words
+                    stray = rng.sample(sum(targets.values(), []) or FILLER, 3)
+                    words = rng.sample(FILLER, 20) + stray
+                rng.shuffle(words)
+                text = " ".join(words * 4) + "."
+                chunks.append({
+                    "text": text,
+                    "metadata": {
+                        "source": f"{doc_id}.pdf",
+                        "doc_id": doc_id,
+                        "page": page,
+                        "chapter": f"Chapter {d + 1}",
+                        "section": section,
+                        "global_chunk_id": gid,
+                        "pages": [str(page)],
+                        "sections": [section],
+                        "chunk_confidence": "high",
+                    },
+                })
+                gid += 1
+    return chunks
+
+
+def load_corpus(path):
+    """
+    JSONL of chunk dicts ({"text", "metadata"}) as produced by pdfreader.
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class StageTimer:
+    def __init__(self):
+        self.current = None
+
+    def wrap(self, module, name, stage):
+        fn = getattr(module, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if self.current is not None:
+                    self.current[stage] = self.current.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+        setattr(module, name, timed)
+
+    def stage(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.current[name] = self.current.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def rerank_calls(inference):
+    return sum(n for op, n in inference.stats.to_dict()["calls"].items() if op.startswith("rerank:"))
+
+
+def run(args):
+    if args.record:
+        # the live client, before install() replaces it
+        import pinecone_client
+        inference = bench_stubs.RecordingInference(pinecone_client.get_client().inference, args.record)
+    elif args.recorded:
+        inference = bench_stubs.RecordedInference(
+            args.recorded, args.embed_ms, args.rerank_ms, args.per_item_ms
+        )
+    else:
+        inference = bench_stubs.StubInference(args.embed_ms, args.rerank_ms, args.per_item_ms)
+    llm = bench_stubs.StubLLM(args.llm_ms, args.llm_ms_per_token)
+    bench_stubs.install(inference, llm)
+
+    import answering
+    import retrieval
+    from embeddings import index_chunks
+
+    questions = load_questions(args.questions)
+    chunks = load_corpus(args.corpus) if args.corpus else synthetic_corpus(questions)
+    indexed = index_chunks(iter(chunks))["upserted"]
+
+    timer = StageTimer()
+    timer.wrap(retrieval, "embed_query", "query_embed")
+    timer.wrap(retrieval, "search_index", "index_query")
+    timer.wrap(retrieval, "rerank_matches", "rerank")
+
+    stage_samples = {}
+    per_question = []
+    hits = 0
+    runs = 0
+
+    for it in range(args.warmup + args.repeat):
+        measured = it >= args.warmup
+        for q in questions:
+            timer.current = {}
+            start = time.perf_counter()
+
+            stats = {}
+            results = timer.stage(
+                "hybrid_search", retrieval.hybrid_search,
+                query=q["question"], doc_ids=q.get("doc_ids"), final_k=args.final_k, stats=stats
+            )
+            context, sources = timer.stage(
+                "assemble", retrieval.select_chunks,
+                results, retrieval.needs_global_context(q["question"]), stats
+            )
+            answer = timer.stage("llm", answering.rewrite_with_llm, context, q["question"]) if context else ""
+
+            timer.current["total"] = (time.perf_counter() - start) * 1000
+            # index_query covers the rerank it triggers; report them apart
+            if "index_query" in timer.current:
+                timer.current["index_query"] -= timer.current.get("rerank", 0.0)
+            if not measured:
+                continue
+
+            expected = set(q.get("expected_sections", []))
+            retrieved = [meta.get("section") for _, _, meta in results]
+            hit = bool(expected & set(retrieved))
+            hits += hit
+            runs += 1
+            for stage, ms in timer.current.items():
+                stage_samples.setdefault(stage, []).append(ms)
+            per_question.append({
+                "id": q.get("id"),
+                "iteration": it - args.warmup,
+                "hit": hit,
+                "retrieved_sections": retrieved,
+                "cited_sections": [m.get("section") for m in sources],
+                "answer_chars": len(answer),
+                "rerank_depth": stats.get("rerank_depth"),
+                "rerank_calls": stats.get("rerank_calls"),
+                "timings_ms": dict(timer.current),
+            })
+
+    if args.record:
+        inference.save()
+    if not rerank_calls(inference):
+        raise RuntimeError("benchmark made no rerank calls; the rerank stage was not exercised")
+
+    return {
+        "config": {
+            "questions": len(questions),
+            "corpus_chunks": len(chunks),
+            "indexed": indexed,
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "final_k": args.final_k,
+            "backend": "recording" if args.record else "recorded" if args.recorded else "stub",
+            "embed_ms": args.embed_ms,
+            "rerank_ms": args.rerank_ms,
+            "per_item_ms": args.per_item_ms,
+            "llm_ms": args.llm_ms,
+            "llm_ms_per_token": args.llm_ms_per_token,
+            "rerank_mode": retrieval.RERANK_MODE,
+            "context_mode": retrieval.CONTEXT_MODE,
+            "context_compression": retrieval.CONTEXT_COMPRESSION,
+        },
+        "hit_rate": hits / runs if runs else None,
+        "stages": {stage: percentiles(ms) for stage, ms in stage_samples.items()},
+        "calls": {
+            "inference": inference.stats.to_dict(),
+            "llm": llm.stats.to_dict(),
+        },
+        "questions": per_question,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", help="JSON list of {id, question, expected_sections}; defaults to app.gsq")
+    parser.add_argument("--corpus", help="JSONL of chunks to index; defaults to a synthetic corpus")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--record", help="call live inference and save its responses to this file")
+    source.add_argument("--recorded", help="replay inference responses saved by --record")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--final-k", type=int, default=5)
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="latency per embed call")
+    parser.add_argument("--rerank-ms", type=float, default=0.0, help="latency per rerank call")
+    parser.add_argument("--per-item-ms", type=float, default=0.0, help="extra latency per embedded/reranked item")
+    parser.add_argument("--llm-ms", type=float, default=0.0, help="latency per LLM call")
+    parser.add_argument("--llm-ms-per-token", type=float, default=0.0, help="extra LLM latency per prompt token")
+    parser.add_argument("--out", default="bench_query.json")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"hit rate: {report['hit_rate']}")
+    for stage, s in report["stages"].items():
+        if s["count"]:
+            print(
+                f"{stage:>14}: p50 {s['p50_ms']:8.2f} ms  p95 {s['p95_ms']:8.2f} ms  "
+                f"p99 {s['p99_ms']:8.2f} ms"
+            )
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Offline stand-ins for Pinecone inference, the vector index and the LLM,
+shared by the benchmark scripts.
+
+Import this module before pinecone_client: it points the index at a
+throwaway LocalIndex. install() swaps the shared client and index through
+pinecone_client.set_client / set_index.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+BENCH_DIR = tempfile.mkdtemp(prefix="contextforge_bench_")
+os.environ["INDEX_BACKEND"] = "local"
+os.environ["LOCAL_INDEX_PATH"] = os.path.join(BENCH_DIR, "index")
+os.environ.setdefault("EMBED_CACHE", "0")
+os.environ.setdefault("QUERY_CACHE", "0")
+os.environ.setdefault("BM25_INDEX_PATH", os.path.join(BENCH_DIR, "bm25_index.npz"))
+
+DIMENSION = 1024
+SPARSE_VOCAB = 2 ** 20
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _word_hash(word: str, salt: str = "") -> int:
+    return int.from_bytes(hashlib.blake2b((salt + word).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def words(text: str):
+    return WORD_RE.findall(text.lower())
+
+
+def hashed_dense(text: str, dim: int = DIMENSION):
+    """
+    Normalized bag-of-words vector from feature hashing: texts sharing
+    words get similar vectors, so retrieval over it behaves sensibly.
+    """
+    v = np.zeros(dim, dtype=np.float32)
+    for w in words(text):
+        h = _word_hash(w)
+        v[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(v)
+    return (v / norm if norm else v).tolist()
+
+
+def hashed_sparse(text: str):
+    counts = {}
+    for w in words(text):
+        i = _word_hash(w, "s") % SPARSE_VOCAB
+        counts[i] = counts.get(i, 0) + 1
+    return {
+        "sparse_indices": list(counts),
+        "sparse_values": [float(1 + np.log(c)) for c in counts.values()],
+    }
+
+
+class CallStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.items = {}
+
+    def add(self, op, n):
+        with self._lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+            self.items[op] = self.items.get(op, 0) + n
+
+    def to_dict(self):
+        with self._lock:
+            return {"calls": dict(self.calls), "items": dict(self.items)}
+
+
+class StubInference:
+    """
+    Drop-in for pc.inference: deterministic embeddings and a word-overlap
+    reranker, with artificial latency per call plus per item.
+    """
+
+    def __init__(self, embed_ms=0.0, rerank_ms=0.0, per_item_ms=0.0):
+        self.embed_ms = embed_ms
+        self.rerank_ms = rerank_ms
+        self.per_item_ms = per_item_ms
+        self.stats = CallStats()
+
+    def _sleep(self, base_ms, n):
+        delay = base_ms + self.per_item_ms * n
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def embed(self, model, inputs, parameters=None):
+        self.stats.add(f"embed:{model}", len(inputs))
+        self._sleep(self.embed_ms, len(inputs))
+        if "sparse" in model:
+            return [hashed_sparse(t) for t in inputs]
+        return [{"values": hashed_dense(t)} for t in inputs]
+
+    def rerank(self, model, query, documents, rank_fields=("text",), return_documents=True, top_n=None, parameters=None):
+        self.stats.add(f"rerank:{model}", len(documents))
+        self._sleep(self.rerank_ms, len(documents))
+        q = set(words(query))
+        scored = []
+        for i, doc in enumerate(documents):
+            text = " ".join(str(doc[f]) for f in rank_fields) if isinstance(doc, dict) else doc
+            d = set(words(text))
+            scored.append((len(q & d) / (len(q) or 1), i))
+        scored.sort(key=lambda s: (-s[0], s[1]))
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, score=score, document=documents[i] if return_documents else None)
+            for score, i in scored[:top_n or len(scored)]
+        ])
+
+
+class RecordingInference:
+    """
+    Wraps a live pc.inference and saves every embed/rerank response to a
+    JSON file that RecordedInference can replay offline.
+    """
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self.records = {}
+        self.stats = CallStats()
+        self._lock = threading.Lock()
+
+    def embed(self, model, inputs, parameters=None):
+        self.stats.add(f"embed:{model}", len(inputs))
+        res = self.inner.embed(model=model, inputs=inputs, parameters=parameters)
+        plain = [
+            {"sparse_indices": list(r["sparse_indices"]), "sparse_values": list(r["sparse_values"])}
+            if "sparse" in model else {"values": list(r["values"])}
+            for r in res
+        ]
+        with self._lock:
+            for text, r in zip(inputs, plain):
+                self.records[_record_key("embed", model, parameters, text)] = r
+        return plain
+
+    def rerank(self, model, query, documents, rank_fields=("text",), return_documents=True, top_n=None, parameters=None):
+        self.stats.add(f"rerank:{model}", len(documents))
+        res = self.inner.rerank(
+            model=model, query=query, documents=documents, rank_fields=rank_fields,
+            return_documents=False, top_n=len(documents)
+        )
+        texts = [_rank_text(d, rank_fields) for d in documents]
+        with self._lock:
+            for r in res.data:
+                self.records[_record_key("rerank", model, query, texts[r.index])] = r.score
+        scored = sorted(((r.score, r.index) for r in res.data), key=lambda s: (-s[0], s[1]))
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, score=score, document=None)
+            for score, i in scored[:top_n or len(scored)]
+        ])
+
+    def save(self):
+        with self._lock, open(self.path, "w") as f:
+            json.dump(self.records, f)
+
+
+class RecordedInference(StubInference):
+    """
+    Replays a RecordingInference file; inputs that were never recorded fall
+    back to the stub embeddings and reranker.
+    """
+
+    def __init__(self, path, embed_ms=0.0, rerank_ms=0.0, per_item_ms=0.0):
+        super().__init__(embed_ms, rerank_ms, per_item_ms)
+        with open(path) as f:
+            self.records = json.load(f)
+        self.misses = 0
+
+    def embed(self, model, inputs, parameters=None):
+        fallback = super().embed(model, inputs, parameters)
+        out = []
+        for text, fb in zip(inputs, fallback):
+            r = self.records.get(_record_key("embed", model, parameters, text))
+            if r is None:
+                self.misses += 1
+            out.append(r if r is not None else fb)
+        return out
+
+    def rerank(self, model, query, documents, rank_fields=("text",), return_documents=True, top_n=None, parameters=None):
+        fallback = super().rerank(model, query, documents, rank_fields, False, None)
+        scores = {r.index: r.score for r in fallback.data}
+        for i, doc in enumerate(documents):
+            s = self.records.get(_record_key("rerank", model, query, _rank_text(doc, rank_fields)))
+            if s is None:
+                self.misses += 1
+            else:
+                scores[i] = s
+        scored = sorted(((s, i) for i, s in scores.items()), key=lambda s: (-s[0], s[1]))
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, score=score, document=None)
+            for score, i in scored[:top_n or len(scored)]
+        ])
+
+
+def _rank_text(doc, rank_fields):
+    return " ".join(str(doc[f]) for f in rank_fields) if isinstance(doc, dict) else doc
+
+
+def _record_key(*parts):
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class StubLLM:
+    """
+    Stand-in for the OpenRouter call: sleeps base_ms plus ms_per_token for
+    every prompt token, then answers with the first context sentence.
+    """
+
+    def __init__(self, base_ms=0.0, ms_per_token=0.0):
+        self.base_ms = base_ms
+        self.ms_per_token = ms_per_token
+        self.stats = CallStats()
+
+    def __call__(self, payload: dict) -> str:
+        prompt = payload["messages"][0]["content"]
+        tokens = len(prompt.split())
+        self.stats.add("llm", tokens)
+        delay = self.base_ms + self.ms_per_token * tokens
+        if delay > 0:
+            time.sleep(delay / 1000)
+        context = prompt.split("Context:", 1)[-1].strip()
+        return context.split(". ")[0][:300]
+
+
+class NullIndex:
+    """
+    Index that accepts upserts and stores nothing, for measuring the
+    ingest pipeline without index cost.
+    """
+
+    def __init__(self, upsert_ms=0.0):
+        self.upsert_ms = upsert_ms
+        self.stats = CallStats()
+
+    def upsert(self, vectors, namespace="", **kwargs):
+        self.stats.add("upsert", len(vectors))
+        if self.upsert_ms > 0:
+            time.sleep(self.upsert_ms / 1000)
+        return {"upserted_count": len(vectors)}
+
+    def list(self, prefix=None, namespace="", **kwargs):
+        return iter(())
+
+    def delete(self, ids=None, namespace="", **kwargs):
+        return {}
+
+    def describe_index_stats(self, **kwargs):
+        return {"dimension": DIMENSION, "namespaces": {}, "total_vector_count": 0}
+
+
+def install(inference, llm=None, index=None):
+    """
+    Routes the service modules to the stubs. index defaults to the
+    throwaway LocalIndex. Returns the index in use.
+    """
+    import answering
+    import pinecone_client
+
+    pinecone_client.set_client(SimpleNamespace(inference=inference))
+    if index is not None:
+        pinecone_client.set_index(index)
+    if llm is not None:
+        answering._post_llm = llm
+    return pinecone_client.get_index()
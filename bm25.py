@@ -0,0 +1,312 @@
+import json
+import math
+import os
+import re
+import threading
+from array import array
+from urllib.parse import quote
+
+import numpy as np
+
+# "sparse" (pinecone-sparse-english-v0 vectors stored in the index) or
+# "bm25" (local inverted index built at ingest time)
+LEXICAL_BACKEND = os.getenv("LEXICAL_BACKEND", "sparse")
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "bm25_index.npz")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# tombstoned share of chunks that triggers a postings rebuild
+COMPACT_RATIO = 0.25
+
+# words joined by - _ . / stay one token ("e-1042", "v2.3"), and their
+# parts are indexed too so "1042" alone still matches
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+PART_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or "
+    "that the this to was were will with".split()
+)
+
+
+def use_bm25() -> bool:
+    return LEXICAL_BACKEND == "bm25"
+
+
+def tokenize(text: str):
+    tokens = []
+    for tok in TOKEN_RE.findall(text.lower()):
+        parts = PART_RE.findall(tok)
+        if len(parts) > 1:
+            tokens.append(tok)
+        tokens.extend(p for p in parts if p not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted index over chunk text with BM25 scoring.
+
+    Postings are per-term arrays of chunk ordinals and term frequencies.
+    Deleting marks chunks dead; postings are rebuilt once enough of them
+    are dead. Chunks are keyed by the same id as their index record and
+    grouped by doc_id for scoping and deletion.
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B, path=BM25_INDEX_PATH):
+        self.k1 = k1
+        self.b = b
+        # where save() writes by default
+        self.path = path
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.terms = {}
+        self.postings = []       # term id -> array("I") of chunk ordinals
+        self.frequencies = []    # term id -> array("I") of term frequencies
+        self.chunk_ids = []
+        self.doc_ids = []
+        self.lengths = array("I")
+        self.alive = bytearray()
+        self.ordinal_of = {}
+        self.by_doc = {}
+        self.live = 0
+        self.total_length = 0
+
+    def __len__(self):
+        return self.live
+
+    # ---- writes ----
+
+    def add(self, chunk_id: str, doc_id: str, text: str):
+        with self._lock:
+            self._remove(chunk_id)
+            tokens = tokenize(text)
+            ordinal = len(self.chunk_ids)
+            self.chunk_ids.append(chunk_id)
+            self.doc_ids.append(doc_id)
+            self.lengths.append(len(tokens))
+            self.alive.append(1)
+            self.ordinal_of[chunk_id] = ordinal
+            self.by_doc.setdefault(doc_id, []).append(ordinal)
+            self.live += 1
+            self.total_length += len(tokens)
+
+            counts = {}
+            for t in tokens:
+                counts[t] = counts.get(t, 0) + 1
+            for t, tf in counts.items():
+                term_id = self.terms.get(t)
+                if term_id is None:
+                    term_id = self.terms[t] = len(self.postings)
+                    self.postings.append(array("I"))
+                    self.frequencies.append(array("I"))
+                self.postings[term_id].append(ordinal)
+                self.frequencies[term_id].append(tf)
+
+    def add_many(self, chunks):
+        """
+        chunks: iterable of (chunk_id, doc_id, text)
+        """
+        with self._lock:
+            for chunk_id, doc_id, text in chunks:
+                self.add(chunk_id, doc_id, text)
+
+    def _remove(self, chunk_id):
+        ordinal = self.ordinal_of.pop(chunk_id, None)
+        if ordinal is None:
+            return False
+        self.alive[ordinal] = 0
+        self.live -= 1
+        self.total_length -= self.lengths[ordinal]
+        ordinals = self.by_doc.get(self.doc_ids[ordinal])
+        if ordinals is not None:
+            ordinals.remove(ordinal)
+            if not ordinals:
+                del self.by_doc[self.doc_ids[ordinal]]
+        return True
+
+    def delete(self, chunk_ids):
+        with self._lock:
+            removed = sum(self._remove(c) for c in chunk_ids)
+            self._maybe_compact()
+        return removed
+
+    def delete_doc(self, doc_id: str) -> int:
+        with self._lock:
+            ordinals = self.by_doc.pop(doc_id, [])
+            removed = sum(self._remove(self.chunk_ids[o]) for o in ordinals)
+            self._maybe_compact()
+        return removed
+
+    def _maybe_compact(self):
+        dead = len(self.chunk_ids) - self.live
+        if dead and dead >= COMPACT_RATIO * len(self.chunk_ids):
+            self._compact()
+
+    def _compact(self):
+        keep = np.flatnonzero(np.frombuffer(bytes(self.alive), dtype=np.uint8))
+        remap = np.full(len(self.chunk_ids), -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+
+        postings, frequencies, terms = [], [], {}
+        for term, term_id in self.terms.items():
+            ords = np.frombuffer(self.postings[term_id], dtype=np.uint32)
+            new = remap[ords]
+            mask = new >= 0
+            if not mask.any():
+                continue
+            terms[term] = len(postings)
+            postings.append(array("I", new[mask].astype(np.uint32).tobytes()))
+            frequencies.append(array(
+                "I", np.frombuffer(self.frequencies[term_id], dtype=np.uint32)[mask].tobytes()
+            ))
+
+        chunk_ids = [self.chunk_ids[o] for o in keep]
+        doc_ids = [self.doc_ids[o] for o in keep]
+        lengths = array("I", (self.lengths[o] for o in keep))
+
+        self._reset()
+        self.terms, self.postings, self.frequencies = terms, postings, frequencies
+        self._load_chunks(chunk_ids, doc_ids, lengths)
+
+    def _load_chunks(self, chunk_ids, doc_ids, lengths):
+        self.chunk_ids = list(chunk_ids)
+        self.doc_ids = list(doc_ids)
+        self.lengths = array("I", lengths)
+        self.alive = bytearray([1]) * len(self.chunk_ids)
+        self.ordinal_of = {c: i for i, c in enumerate(self.chunk_ids)}
+        for i, d in enumerate(self.doc_ids):
+            self.by_doc.setdefault(d, []).append(i)
+        self.live = len(self.chunk_ids)
+        self.total_length = int(sum(self.lengths))
+
+    # ---- search ----
+
+    def search(self, query: str, top_k: int = 50, doc_ids=None):
+        """
+        returns: list of (chunk_id, score), best first
+        """
+        with self._lock:
+            if not self.live:
+                return []
+            n = len(self.chunk_ids)
+            alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+            scope = alive
+            if doc_ids:
+                scope = np.zeros(n, dtype=bool)
+                for d in doc_ids:
+                    scope[self.by_doc.get(d, [])] = True
+
+            lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+            avgdl = self.total_length / self.live or 1.0
+            norm = self.k1 * (1 - self.b + self.b * lengths / avgdl)
+            scores = np.zeros(n, dtype=np.float64)
+
+            for term in set(tokenize(query)):
+                term_id = self.terms.get(term)
+                if term_id is None:
+                    continue
+                ords = np.frombuffer(self.postings[term_id], dtype=np.uint32)
+                df = int(np.count_nonzero(alive[ords]))
+                keep = scope[ords]
+                if not df or not keep.any():
+                    continue
+                idf = math.log(1 + (self.live - df + 0.5) / (df + 0.5))
+                hit = ords[keep]
+                tf = np.frombuffer(self.frequencies[term_id], dtype=np.uint32)[keep]
+                scores[hit] += idf * tf * (self.k1 + 1) / (tf + norm[hit])
+
+            hits = np.flatnonzero(scores > 0)
+            if not len(hits):
+                return []
+            k = min(top_k, len(hits))
+            top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(self.chunk_ids[o], float(scores[o])) for o in top]
+
+    # ---- persistence ----
+
+    def save(self, path: str = None):
+        path = path or self.path
+        with self._lock:
+            if len(self.chunk_ids) != self.live:
+                self._compact()
+            terms = sorted(self.terms, key=self.terms.get)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(self.postings[self.terms[t]]) for t in terms])
+            ordinals = np.concatenate(
+                [np.frombuffer(self.postings[self.terms[t]], dtype=np.uint32) for t in terms]
+            ) if terms else np.zeros(0, dtype=np.uint32)
+            frequencies = np.concatenate(
+                [np.frombuffer(self.frequencies[self.terms[t]], dtype=np.uint32) for t in terms]
+            ) if terms else np.zeros(0, dtype=np.uint32)
+            header = json.dumps({
+                "terms": terms,
+                "chunk_ids": self.chunk_ids,
+                "doc_ids": self.doc_ids,
+            })
+
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                np.savez(
+                    f,
+                    header=np.frombuffer(header.encode("utf-8"), dtype=np.uint8),
+                    offsets=offsets,
+                    ordinals=ordinals,
+                    frequencies=frequencies,
+                    lengths=np.frombuffer(self.lengths, dtype=np.uint32),
+                )
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = BM25_INDEX_PATH):
+        index = cls(path=path)
+        with np.load(path) as data:
+            header = json.loads(data["header"].tobytes().decode("utf-8"))
+            offsets = data["offsets"]
+            ordinals = data["ordinals"].astype(np.uint32)
+            frequencies = data["frequencies"].astype(np.uint32)
+            lengths = data["lengths"].astype(np.uint32)
+
+        for term_id, term in enumerate(header["terms"]):
+            start, stop = offsets[term_id], offsets[term_id + 1]
+            index.terms[term] = term_id
+            index.postings.append(array("I", ordinals[start:stop].tobytes()))
+            index.frequencies.append(array("I", frequencies[start:stop].tobytes()))
+        index._load_chunks(header["chunk_ids"], header["doc_ids"], lengths.tolist())
+        return index
+
+
+# namespace (None for the default file) -> BM25Index
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def lexical_index_path(namespace=None) -> str:
+    """
+    BM25_INDEX_PATH for the default index; every other namespace gets a
+    sibling file named after it.
+    """
+    if not namespace:
+        return BM25_INDEX_PATH
+    root, ext = os.path.splitext(BM25_INDEX_PATH)
+    return f"{root}.{quote(namespace, safe='')}{ext}"
+
+
+def get_lexical_index(namespace=None):
+    """
+    Shared BM25 index of one namespace, loaded from lexical_index_path on
+    first use.
+    """
+    index = _indexes.get(namespace)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(namespace)
+            if index is None:
+                path = lexical_index_path(namespace)
+                index = _indexes[namespace] = (
+                    BM25Index.load(path) if os.path.exists(path) else BM25Index(path=path)
+                )
+    return index
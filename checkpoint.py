@@ -0,0 +1,337 @@
+import fcntl
+import json
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+# per-job ingest checkpoints, so a retry of a failed job resumes where it
+# stopped
+CHECKPOINTS_ENABLED = os.getenv("INGEST_CHECKPOINTS", "1") != "0"
+CHECKPOINT_DIR = os.getenv(
+    "CHECKPOINT_DIR",
+    os.path.join(tempfile.gettempdir(), "rag_ingest", "checkpoints")
+)
+# older checkpoints are discarded instead of resumed
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", str(24 * 3600)))
+
+STATE_FILE = "state.json"
+LOCK_FILE = "owner.lock"
+BLOCKS_FILE = "blocks.jsonl"
+CHUNKS_FILE = "chunks.jsonl"
+
+
+def _plain(value):
+    # numpy arrays / scalars from the embedding cache
+    return value.tolist() if hasattr(value, "tolist") else str(value)
+
+
+def source_identity(signed_url: str) -> str:
+    """
+    The object a signed URL points at, without the signature query, which
+    changes between requests for the same file.
+    """
+    parts = urlsplit(signed_url or "")
+    return f"{parts.scheme}://{parts.netloc}{parts.path}" if parts.netloc else parts.path
+
+
+def valid_job_id(job_id) -> bool:
+    # job ids are uuid4 hex; anything else never names a checkpoint
+    return isinstance(job_id, str) and re.fullmatch(r"[0-9a-f]{32}", job_id) is not None
+
+
+def _owner():
+    return {"host": socket.gethostname(), "pid": os.getpid()}
+
+
+def owner_alive(owner) -> bool:
+    """
+    owner: the "owner" recorded in a checkpoint's state
+    returns: whether another live process may still be running the job;
+             owners on other hosts are assumed alive
+    """
+    if not owner:
+        return False
+    if owner.get("host") != socket.gethostname():
+        return True
+    pid = owner.get("pid")
+    if pid == os.getpid():
+        # this process claims a job only to run it, so an earlier claim is
+        # left from a previous process with the same pid
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (OSError, TypeError):
+        return True
+    return True
+
+
+class CheckpointBusy(Exception):
+    pass
+
+
+class Checkpoint:
+    """
+    Durable progress of one ingest job, in its own directory:
+
+      source file   the download, so a retry does not fetch it again
+      blocks.jsonl  parsed blocks, complete once "blocks" is set
+      chunks.jsonl  semantic chunks with their embeddings, complete once
+                    "chunks" is set
+      state.json    those flags and "committed": input chunks whose upsert
+                    batch has been written to the index, plus the job record
+                    (tenant, signed_url, status, owner) so the job survives
+                    a restart of the server
+
+    state.json is replaced atomically; a JSONL file whose flag is not set
+    is rewritten from scratch on the next attempt.
+
+    The checkpoint belongs to one job, so only a retry of that job resumes
+    it; a new upload of the same document starts clean. It is also dropped
+    when the retry names a different source object than the one recorded.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        doc_id: str,
+        filename: str,
+        source: str = "",
+        root: str = CHECKPOINT_DIR,
+        tenant=None,
+        signed_url: str = ""
+    ):
+        self.job_id = job_id
+        self.doc_id = doc_id
+        self.filename = filename
+        self.source = source
+        self.tenant = tenant
+        self.signed_url = signed_url
+        self.path = os.path.join(root, job_id)
+        self._lock = threading.Lock()
+        self.state = self._load()
+
+    def _new_state(self):
+        return {
+            "job_id": self.job_id,
+            "doc_id": self.doc_id,
+            "filename": self.filename,
+            "source": self.source,
+            "tenant": self.tenant,
+            "signed_url": self.signed_url,
+            "status": "queued",
+            "error": None,
+            "owner": None,
+            "created_at": time.time(),
+            "file": None,
+            "blocks": False,
+            "chunks": False,
+            "committed": 0,
+        }
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.path, STATE_FILE)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return self._new_state()
+        if (
+            time.time() - state.get("created_at", 0) > CHECKPOINT_TTL
+            or state.get("doc_id") != self.doc_id
+            or state.get("filename") != self.filename
+            or state.get("source") != self.source
+            or state.get("tenant") != self.tenant
+        ):
+            self.clear()
+            return self._new_state()
+        return state
+
+    def _save(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = os.path.join(self.path, STATE_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, STATE_FILE))
+
+    def _update(self, **changes):
+        with self._lock:
+            self.state.update(changes)
+            self._save()
+
+    # ---- job record ----
+
+    def start(self):
+        """
+        Claims the job for this process and marks it running.
+        raises: CheckpointBusy while another live process runs the job
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                current = read_state(self.job_id, os.path.dirname(self.path))
+                if (
+                    current is not None
+                    and current.get("status") == "running"
+                    and owner_alive(current.get("owner"))
+                ):
+                    raise CheckpointBusy(f"Job {self.job_id} is running in another process")
+                self._update(
+                    status="running", error=None, owner=_owner(),
+                    signed_url=self.signed_url or self.state.get("signed_url", "")
+                )
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def fail(self, error):
+        self._update(status="failed", error=str(error), owner=None)
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.state["file"] or self.state["blocks"])
+
+    @property
+    def committed(self) -> int:
+        return self.state["committed"] if self.state["chunks"] else 0
+
+    # ---- download ----
+
+    def file_path(self):
+        path = self.state["file"]
+        return path if path and os.path.exists(path) else None
+
+    def keep_file(self, local_path: str) -> str:
+        """
+        Moves the downloaded file into the checkpoint and returns its new path.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, "source_" + os.path.basename(self.filename))
+        shutil.move(local_path, path)
+        self._update(file=path)
+        return path
+
+    # ---- blocks / chunks ----
+
+    def _record(self, items, name, flag):
+        with open(os.path.join(self.path, name), "w") as f:
+            for item in items:
+                f.write(json.dumps(item, default=_plain) + "\n")
+                yield item
+            f.flush()
+            os.fsync(f.fileno())
+        self._update(**{flag: True})
+
+    def _replay(self, name):
+        with open(os.path.join(self.path, name)) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def blocks(self):
+        """
+        returns: iterator over the saved blocks, or None if parsing never
+                 finished
+        """
+        return self._replay(BLOCKS_FILE) if self.state["blocks"] else None
+
+    def chunks(self):
+        return self._replay(CHUNKS_FILE) if self.state["chunks"] else None
+
+    def record_blocks(self, blocks):
+        os.makedirs(self.path, exist_ok=True)
+        return self._record(blocks, BLOCKS_FILE, "blocks")
+
+    def record_chunks(self, chunks):
+        """
+        Passes chunks through, writing each one first; the offsets of a
+        previous attempt no longer apply to a re-chunked document.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._update(committed=0)
+        return self._record(chunks, CHUNKS_FILE, "chunks")
+
+    # ---- index ----
+
+    def commit(self, offset: int):
+        """
+        offset: number of input chunks fully written to the index
+        """
+        if offset > self.state["committed"]:
+            self._update(committed=offset)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def sweep_checkpoints(root: str = CHECKPOINT_DIR):
+    """
+    Removes checkpoints older than CHECKPOINT_TTL, e.g. of failed jobs that
+    were never retried.
+    """
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            expired = time.time() - os.path.getmtime(path) > CHECKPOINT_TTL
+        except OSError:
+            continue
+        if expired:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def read_state(job_id: str, root: str = CHECKPOINT_DIR):
+    """
+    returns: the saved state of a job's checkpoint, or None if there is no
+             live one
+    """
+    if not valid_job_id(job_id):
+        return None
+    try:
+        with open(os.path.join(root, job_id, STATE_FILE)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - state.get("created_at", 0) > CHECKPOINT_TTL:
+        return None
+    return state
+
+
+def checkpoint_states(root: str = CHECKPOINT_DIR):
+    """
+    returns: iterator over the states of all live checkpoints, oldest first
+    """
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    states = filter(None, (read_state(name, root) for name in names))
+    yield from sorted(states, key=lambda state: state.get("created_at", 0))
+
+
+def interrupted(state) -> bool:
+    # left "running" by a process that is gone
+    return state.get("status") == "running" and not owner_alive(state.get("owner"))
+
+
+def open_checkpoint(job_id, doc_id: str, filename: str, signed_url: str = "", tenant=None):
+    """
+    returns: the job's Checkpoint, or None when checkpoints are off or the
+             ingest has no job id
+    """
+    if not CHECKPOINTS_ENABLED or not job_id:
+        return None
+    sweep_checkpoints()
+    return Checkpoint(
+        job_id, doc_id, filename, source_identity(signed_url),
+        tenant=tenant, signed_url=signed_url
+    )
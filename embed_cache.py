@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE", "1") != "0"
+EMBED_CACHE_PATH = os.getenv(
+    "EMBED_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "contextforge_embed_cache.sqlite")
+)
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "512"))
+
+# eviction trims down to this fraction of max_bytes so it does not run on
+# every insert once the cache is full
+EVICT_TARGET = 0.9
+
+
+def cache_key(model: str, input_type: str, text: str) -> str:
+    h = hashlib.sha256()
+    h.update(f"{model}\0{input_type}\0".encode("utf-8"))
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _encode(embedding: dict) -> bytes:
+    if "values" in embedding:
+        return b"D" + np.asarray(embedding["values"], dtype=np.float32).tobytes()
+    return b"S" + json.dumps({
+        "sparse_indices": list(embedding["sparse_indices"]),
+        "sparse_values": list(embedding["sparse_values"]),
+    }).encode("utf-8")
+
+
+def _decode(blob: bytes) -> dict:
+    kind, payload = blob[:1], blob[1:]
+    if kind == b"D":
+        return {"values": np.frombuffer(payload, dtype=np.float32).tolist()}
+    return json.loads(payload.decode("utf-8"))
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed embedding cache.
+
+    Entries are keyed by (model, input_type, sha256(text)) and stored in
+    SQLite; dense vectors as float32 blobs, sparse vectors as JSON. Least
+    recently used entries are evicted once the stored size passes max_bytes.
+    """
+
+    def __init__(self, path=EMBED_CACHE_PATH, max_bytes=EMBED_CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access"
+            " ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        self._total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, model: str, input_type: str, texts):
+        """
+        returns: list aligned with texts; a cached embedding dict or None
+        """
+        keys = [cache_key(model, input_type, t) for t in texts]
+        found = {}
+
+        with self._lock:
+            # stay under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM embeddings WHERE key IN ({marks})",
+                    part
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, k) for k in found]
+                )
+                self._conn.commit()
+
+        return [_decode(found[k]) if k in found else None for k in keys]
+
+    def put_many(self, model: str, input_type: str, texts, embeddings):
+        """
+        returns: the embeddings as they will be read back (dense values are
+                 rounded to float32), so hits and misses look the same
+        """
+        now = time.time()
+        rows = []
+        for text, emb in zip(texts, embeddings):
+            blob = _encode(emb)
+            rows.append((cache_key(model, input_type, text), blob, len(blob), now))
+
+        with self._lock:
+            for key, _, size, _ in rows:
+                old = self._conn.execute(
+                    "SELECT size FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                self._total += size - (old[0] if old else 0)
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, value, size, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                rows
+            )
+            if self._total > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+        return [_decode(blob) for _, blob, _, _ in rows]
+
+    def _evict(self):
+        target = int(self.max_bytes * EVICT_TARGET)
+        cursor = self._conn.execute(
+            "SELECT key, size FROM embeddings ORDER BY last_access ASC"
+        )
+        victims = []
+        for key, size in cursor:
+            if self._total <= target:
+                break
+            victims.append((key,))
+            self._total -= size
+
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._total = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Shared cache instance, or None when EMBED_CACHE=0.
+    """
+    global _cache
+    if not EMBED_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
@@ -1,82 +1,366 @@
 # embeddings.py
+import hashlib
 import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from dotenv import load_dotenv
-from utils import safe_int
-from pinecone_client import get_index,pc
+from utils import embed_texts, with_retry, DENSE_MODEL, SPARSE_MODEL
+from pinecone_client import get_index
+from bm25 import use_bm25
+from namespaces import namespace_for, lexical_index_for, remember_namespace, SHARED_NAMESPACE
+from metrics import timer
 
 load_dotenv()
 
-index_name = get_index()
-def get_indexed_ids(index, namespace="ns1"):#no fixed nampespace
-    stats = index.describe_index_stats(namespace=namespace)
-    count = stats.get("namespaces", {}).get(namespace, {}).get("vector_count", 0)
-    return count
-def index_chunks(chunks, batch_size=96):
+# batches embedded concurrently while earlier batches are upserted
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "4"))
+
+# Pinecone rejects upsert requests over 2 MB; leave headroom for JSON overhead
+MAX_UPSERT_BYTES = int(os.getenv("MAX_UPSERT_BYTES", str(2 * 1024 * 1024 * 3 // 4)))
+# 1024 float values serialized as JSON
+DENSE_RECORD_BYTES = 1024 * 12
+# ids per fetch / delete request when diffing a re-ingested document
+FETCH_BATCH = 100
+DELETE_BATCH = 1000
+
+def content_hash(text: str) -> str:
     """
-    chunks: list of dicts produced by semantic chunking
+    Stable hash of the embedded text; whitespace differences from
+    re-extraction do not count as a change.
     """
-    print("E: entered index_chunks with", len(chunks), "chunks", flush=True)
-    index = get_index()
-    indexed_count = safe_int(get_indexed_ids(index))
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
 
-    # idempotent guard
-    chunks_to_index = [
-        c for c in chunks
-        if safe_int(c["metadata"].get("global_chunk_id")) >= indexed_count
-    ]
 
-    for i in range(0, len(chunks_to_index), batch_size):
-        batch = chunks_to_index[i:i + batch_size]
-        if not batch:
-            continue
-
-        # ---- 1. Texts for embedding ----
-        texts = [c["text"] for c in batch]
-        if not texts:
-            continue
-
-        # ---- 2. Dense embeddings (semantic) ----
-        dense_embeddings = pc.inference.embed(
-            model="llama-text-embed-v2",
-            inputs=texts,
-            parameters={
-                "input_type": "passage",
-                "truncate": "END"
-            }
-        )
+def doc_key(metadata: dict) -> str:
+    return str(metadata.get("doc_id") or metadata.get("source") or "")
 
-        # ---- 3. Sparse embeddings (lexical) ----
-        sparse_embeddings = pc.inference.embed(
-            model="pinecone-sparse-english-v0",
-            inputs=texts,
-            parameters={
-                "input_type": "passage",
-                "truncate": "END"
-            }
-        )
 
-        # ---- 4. Build records ----
-        print("F: building records", flush=True)
-        records = []
+def chunk_id(key: str, digest: str, occurrence: int = 0) -> str:
+    """
+    "<doc>#<hash16>": unchanged text keeps its id across revisions, and
+    ids never collide between documents. Repeated text within a document
+    gets a "-n" suffix.
+    """
+    vid = f"{key}#{digest[:16]}"
+    return f"{vid}-{occurrence}" if occurrence else vid
+
+
+def stored_vector(v):
+    """
+    Dense and sparse values of a fetched vector, kept to re-upsert it with
+    new metadata without embedding it again.
+    """
+    sparse = v.get("sparse_values")
+    if sparse:
+        sparse = {"indices": list(sparse["indices"]), "values": list(sparse["values"])}
+    return {"values": np.asarray(v["values"], dtype=np.float32), "sparse_values": sparse or None}
+
+
+def list_doc_vectors(index, key: str, namespace=SHARED_NAMESPACE):
+    """
+    returns: {id: {"metadata", "vector"}} for every vector already indexed
+             for the document. The id prefix also lists other documents
+             whose id starts with "<key>#", so matches are kept only when
+             their metadata names this document.
+    """
+    ids = []
+    for page in index.list(prefix=f"{key}#", namespace=namespace):
+        ids.extend(v["id"] for v in page["vectors"])
+
+    existing = {}
+    for i in range(0, len(ids), FETCH_BATCH):
+        fetched = with_retry(index.fetch, ids=ids[i:i + FETCH_BATCH], namespace=namespace)
+        for vid, v in fetched["vectors"].items():
+            metadata = v["metadata"] or {}
+            if doc_key(metadata) == key:
+                existing[vid] = {"metadata": metadata, "vector": stored_vector(v)}
+    return existing
+
+
+def delete_ids(index, ids, namespace=SHARED_NAMESPACE):
+    for i in range(0, len(ids), DELETE_BATCH):
+        with_retry(index.delete, ids=ids[i:i + DELETE_BATCH], namespace=namespace)
+    return len(ids)
+
+
+def estimate_record_bytes(chunk) -> int:
+    """
+    Rough JSON size of the upsert record built from a chunk.
+    """
+    text_bytes = len(chunk["text"].encode("utf-8"))
+    meta_bytes = len(json.dumps(chunk["metadata"], default=str))
+    sparse_bytes = 0 if use_bm25() else 24 * len(chunk["text"].split())
+    return DENSE_RECORD_BYTES + text_bytes + meta_bytes + sparse_bytes
+
+
+def plan_batches(chunks, max_items=96, max_bytes=MAX_UPSERT_BYTES):
+    """
+    Groups chunks into batches that stay under both the embed input limit
+    and the upsert payload limit.
+    """
+    batch, size = [], 0
+    for c in chunks:
+        c_bytes = estimate_record_bytes(c)
+        if batch and (len(batch) >= max_items or size + c_bytes > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(c)
+        size += c_bytes
+    if batch:
+        yield batch
+
+
+def build_records(batch, pool):
+    """
+    Embeds one batch (dense on the pool, sparse on this thread, concurrently)
+    and returns its upsert records. With the BM25 backend the lexical side
+    is indexed locally and records carry no sparse values. Chunks carrying
+    a stored "vector" (metadata-only changes) reuse it and are not embedded.
+    """
+    # ---- 1. Texts for embedding ----
+    texts = [c["text"] for c in batch]
+    stored = [c.get("vector") for c in batch]
+    fresh = [j for j, v in enumerate(stored) if v is None]
 
-        for chunk, de, se in zip(batch, dense_embeddings, sparse_embeddings):
-            records.append({
-                "id": str(chunk["metadata"]["global_chunk_id"]),
-                "values": de["values"],
-                "sparse_values": {
+    # ---- 2. Dense embeddings (semantic) ----
+    # chunks that carry an embedding from semantic chunking skip this call
+    missing = [j for j in fresh if batch[j].get("embedding") is None]
+    dense_values = [
+        v["values"].tolist() if v is not None else c.get("embedding")
+        for c, v in zip(batch, stored)
+    ]
+    dense_future = None
+    if missing:
+        dense_future = pool.submit(
+            embed_texts, DENSE_MODEL, [texts[j] for j in missing], "passage"
+        )
+
+    # ---- 3. Sparse embeddings (lexical) ----
+    with timer("chunk_embed"):
+        sparse_values = [v["sparse_values"] if v is not None else None for v in stored]
+        if not use_bm25() and fresh:
+            embedded = embed_texts(SPARSE_MODEL, [texts[j] for j in fresh], "passage")
+            for j, se in zip(fresh, embedded):
+                sparse_values[j] = {
                     "indices": se["sparse_indices"],
                     "values": se["sparse_values"]
-                },
-                "metadata": {
-                    **chunk["metadata"],
-                    "chunk_text": chunk["text"]
                 }
-            })
-        
 
-        index.upsert(
-            vectors=records,
-            namespace="ns1" #no fixed namespace
-        )
+        if dense_future is not None:
+            for j, de in zip(missing, dense_future.result()):
+                dense_values[j] = de["values"]
+
+    # ---- 4. Build records ----
+    records = []
+    for chunk, values, sparse in zip(batch, dense_values, sparse_values):
+        record = {
+            "id": chunk["id"],
+            "values": values,
+            "metadata": {
+                **chunk["metadata"],
+                "chunk_text": chunk["text"]
+            }
+        }
+        if sparse is not None:
+            record["sparse_values"] = sparse
+        records.append(record)
+    return records
+
+
+def is_payload_too_large(e) -> bool:
+    status = getattr(e, "status", None) or getattr(e, "status_code", None)
+    msg = str(e).lower()
+    return status == 413 or "too large" in msg or "message length" in msg
+
+
+def upsert_records(index, records, namespace=SHARED_NAMESPACE):
+    """
+    Upserts with rate-limit retries; a batch rejected as too large is split
+    in half and retried.
+    """
+    try:
+        with_retry(index.upsert, vectors=records, namespace=namespace)
+    except Exception as e:
+        if len(records) < 2 or not is_payload_too_large(e):
+            raise
+        mid = len(records) // 2
+        upsert_records(index, records[:mid], namespace)
+        upsert_records(index, records[mid:], namespace)
+    return len(records)
+
+
+def index_chunks(chunks, batch_size=96, workers=None, progress=None, committed=0, on_commit=None):
+    """
+    chunks: iterable of dicts produced by semantic chunking; a generator is
+            consumed lazily and upserted batch by batch
+    workers: batches embedded concurrently (defaults to INDEX_WORKERS)
+    progress: optional reporter with add(counter, n), e.g. jobs.IngestJob
+    committed: leading chunks already written by an earlier, interrupted
+               run over the same chunk list; they are not diffed or embedded
+    on_commit: optional callback(offset), called after each upsert with the
+               number of leading chunks now in the index
+    returns: {"chunks", "upserted", "updated", "unchanged", "deleted"}
+
+    Each chunk goes to namespace_for(doc_id, tenant) of its metadata.
+    Re-ingesting a document only embeds new or edited chunks: each chunk id
+    is derived from its content hash, chunks already indexed with the same
+    text are skipped (or, when e.g. their page moved, re-upserted in the
+    normal batches with their stored values and the new metadata), and ids
+    of the document that no longer occur are deleted once everything else
+    is upserted.
+
+    Embedding of the next batches overlaps the upsert of the current one;
+    upserts are issued in batch order from a single thread.
+    """
+    print("E: entered index_chunks", flush=True)
+    if workers is None:
+        workers = INDEX_WORKERS
+    workers = max(1, workers)
+
+    index = get_index()
+    # namespace -> BM25 index written by this run
+    lexicals = {}
+    report = {"chunks": 0, "upserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    # (namespace, doc key) -> {id: {"metadata", "vector"}} indexed before
+    # this run / ids produced now
+    existing = {}
+    seen = {}
+    occurrences = {}
+
+    def count(counter, n=1):
+        report[counter] += n
+        if progress is not None:
+            progress.add(f"chunks_{counter}", n)
+
+    def lexical_for(namespace):
+        if namespace not in lexicals:
+            lexicals[namespace] = lexical_index_for(namespace)
+        return lexicals[namespace]
+
+    def changed_chunks(chunks):
+        for offset, c in enumerate(chunks):
+            report["chunks"] += 1
+            meta = c["metadata"]
+            key = doc_key(meta)
+            namespace = namespace_for(key, meta.get("tenant"))
+            scope = (namespace, key)
+            if scope not in existing:
+                existing[scope] = list_doc_vectors(index, key, namespace)
+                seen[scope] = set()
+
+            digest = content_hash(c["text"])
+            n = occurrences.get((scope, digest), 0)
+            occurrences[(scope, digest)] = n + 1
+            c["id"] = vid = chunk_id(key, digest, n)
+            c["offset"] = offset
+            c["namespace"] = namespace
+            meta["content_hash"] = digest
+            seen[scope].add(vid)
+
+            if offset < committed:
+                count("unchanged")
+                continue
+
+            old = existing[scope].get(vid)
+            if old is None:
+                yield c
+                continue
+
+            # same text, so the vector stands; only metadata may have moved
+            if {**meta, "chunk_text": c["text"]} != old["metadata"]:
+                c["vector"] = old["vector"]
+                yield c
+            else:
+                count("unchanged")
+
+    embed_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed")
+    dense_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed-dense")
+    upsert_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upsert")
+    embedding = deque()
+    upserting = deque()
+    # once a batch fails, the batches queued behind it are dropped so the
+    # committed offset never skips past it
+    failed = threading.Event()
+
+    def upsert(records, namespaces, end, reused):
+        if failed.is_set():
+            return 0
+        groups = {}
+        for r, namespace in zip(records, namespaces):
+            groups.setdefault(namespace, []).append(r)
+        n = 0
+        try:
+            for namespace, group in groups.items():
+                with timer("upsert"):
+                    n += upsert_records(index, group, namespace)
+                remember_namespace(namespace)
+                if use_bm25():
+                    lexical_for(namespace).add_many(
+                        (r["id"], r["metadata"].get("doc_id"), r["metadata"]["chunk_text"])
+                        for r in group
+                    )
+        except Exception:
+            failed.set()
+            raise
+        count("upserted", n - reused)
+        if reused:
+            count("updated", reused)
+        # batches are upserted in input order, and chunks between them were
+        # settled before the batch after them was formed
+        if on_commit is not None:
+            on_commit(end)
+        return n
+
+    def hand_off():
+        end, namespaces, reused, future = embedding.popleft()
+        records = future.result()
+        print("F: building records", flush=True)
+        if progress is not None:
+            progress.add("chunks_embedded", len(records) - reused)
+        # at most one upsert queued behind the running one
+        while len(upserting) >= 2:
+            upserting.popleft().result()
+        upserting.append(upsert_pool.submit(upsert, records, namespaces, end, reused))
+
+    try:
+        for batch in plan_batches(changed_chunks(chunks), max_items=batch_size):
+            embedding.append((
+                batch[-1]["offset"] + 1,
+                [c["namespace"] for c in batch],
+                sum(1 for c in batch if c.get("vector") is not None),
+                embed_pool.submit(build_records, batch, dense_pool)
+            ))
+            while len(embedding) >= workers:
+                hand_off()
+
+        while embedding:
+            hand_off()
+        while upserting:
+            upserting.popleft().result()
 
+        # stale chunks go only after the new revision is fully indexed
+        for (namespace, key), ids in existing.items():
+            stale = sorted(set(ids) - seen[(namespace, key)])
+            if stale:
+                with timer("upsert"):
+                    delete_ids(index, stale, namespace)
+                if use_bm25():
+                    lexical_for(namespace).delete(stale)
+                count("deleted", len(stale))
+    finally:
+        for pool in (embed_pool, dense_pool, upsert_pool):
+            pool.shutdown(wait=True, cancel_futures=True)
+        for lexical in lexicals.values():
+            lexical.save()
 
+    print(
+        f"E: {report['chunks']} chunks: {report['upserted']} upserted, "
+        f"{report['updated']} metadata-only, {report['unchanged']} unchanged, "
+        f"{report['deleted']} deleted",
+        flush=True
+    )
+    return report
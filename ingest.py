@@ -1,22 +1,183 @@
-from pdfreader import chunk_multiple_pdfs
+import os
+
+from pdfreader import (
+    iter_page_texts,
+    iter_page_texts_parallel,
+    iter_document_blocks,
+    iter_semantic_chunks,
+    auto_page_workers,
+)
+from pipeline import bounded
 
 from embeddings import index_chunks
 from storage import download_file
-def ingest_document(doc_id: str, signed_url: str, filename: str):
-    print("B: entered ingest_document", flush=True)
-    local_path = download_file(signed_url, filename)
-    print("C: downloaded file:", local_path, flush=True)
-    assert local_path is not None, "download_file returned None"
-    assert isinstance(local_path, str), f"local_path is {type(local_path)}"
+from query_cache import invalidate_doc
+from checkpoint import open_checkpoint
+from metrics import timer, timed_iter
+
+# bounded hand-off queues between ingest stages (items, not bytes)
+PAGE_QUEUE_SIZE = int(os.getenv("PAGE_QUEUE_SIZE", "8"))
+CHUNK_QUEUE_SIZE = int(os.getenv("CHUNK_QUEUE_SIZE", "192"))
+# worker processes extracting page text during ingest, so pypdf does not
+# share the API process's GIL; 0/1 extracts in the parse thread (default),
+# "auto" starts workers only on hosts with cores to spare (see
+# bench_ingest.py --page-workers for the trade-off)
+_page_workers = os.getenv("INGEST_PAGE_WORKERS", "0")
+INGEST_PAGE_WORKERS = auto_page_workers() if _page_workers == "auto" else int(_page_workers)
+
+
+def count_pages(texts, progress):
+    for text in texts:
+        progress.add("pages_parsed", 1)
+        yield text
 
-    chunks = chunk_multiple_pdfs([local_path])
-    print("D: chunk_multiple_pdfs produced", len(chunks), "chunks", flush=True)
-    assert chunks is not None, "chunk_multiple_pdfs returned None"
-    assert len(chunks) > 0, "No chunks produced"
 
+def count_chunks(chunks, stats):
     for c in chunks:
-        assert "metadata" in c, "Chunk missing metadata"
+        stats["chunks"] += 1
+        yield c
+
+
+def iter_parsed_blocks(local_path: str, progress=None, page_workers=None):
+    """
+    page_workers: processes extracting page ranges (defaults to
+                  INGEST_PAGE_WORKERS); pages still arrive in order
+    """
+    if page_workers is None:
+        page_workers = INGEST_PAGE_WORKERS
+    if page_workers > 1:
+        texts = iter_page_texts_parallel(local_path, page_workers)
+    else:
+        texts = iter_page_texts(local_path)
+    pages = bounded(
+        timed_iter(texts, "parse"),
+        maxsize=PAGE_QUEUE_SIZE,
+        name="pages"
+    )
+    if progress is not None:
+        pages = count_pages(pages, progress)
+    return iter_document_blocks(local_path, texts=pages)
+
+
+def iter_document_chunks(
+    local_path: str,
+    doc_id: str,
+    filename: str,
+    stats=None,
+    progress=None,
+    blocks=None,
+    tenant=None
+):
+    """
+    stats: optional dict; "chunks" is incremented for every chunk produced
+    progress: optional reporter with add(counter, n), e.g. jobs.IngestJob
+    blocks: parsed blocks to chunk instead of reading local_path
+    tenant: stored on every chunk; selects the namespace with the
+            tenant and document strategies
+    """
+    if blocks is None:
+        blocks = iter_parsed_blocks(local_path, progress)
+
+    for c in iter_semantic_chunks(blocks):
         c["metadata"]["doc_id"] = doc_id
         c["metadata"]["source"] = filename
-  
-    index_chunks(chunks)
+        if tenant:
+            c["metadata"]["tenant"] = tenant
+        if stats is not None:
+            stats["chunks"] = stats.get("chunks", 0) + 1
+        yield c
+
+
+def ingest_document(
+    doc_id: str,
+    signed_url: str,
+    filename: str,
+    progress=None,
+    tenant=None,
+    job_id=None
+):
+    """
+    progress: optional reporter with set_stage(name) and add(counter, n),
+              e.g. jobs.IngestJob
+    job_id: checkpoint key; None ingests without a checkpoint
+    returns: index_chunks report; re-ingesting a doc_id only embeds the
+             chunks that changed and deletes the ones that are gone
+
+    With checkpoints on, the download, the parsed blocks, the chunks (with
+    their embeddings) and the upserted prefix are kept until the ingest
+    succeeds, so a retry of the same job (jobs.IngestQueue.retry) skips the
+    finished stages and resumes indexing at the first batch that was not
+    written. Another job for the same document never resumes it. The
+    checkpoint also records the job, so a job cut off by a restart is
+    resumed by jobs.IngestQueue.resume_interrupted.
+    """
+    print("B: entered ingest_document", flush=True)
+    ckpt = open_checkpoint(job_id, doc_id, filename, signed_url, tenant)
+    if ckpt is None:
+        return _ingest_document(doc_id, signed_url, filename, progress, tenant, None)
+
+    ckpt.start()
+    if ckpt.resumed:
+        print("B: resuming from checkpoint", ckpt.path, ckpt.state, flush=True)
+    try:
+        report = _ingest_document(doc_id, signed_url, filename, progress, tenant, ckpt)
+    except Exception as e:
+        # kept for IngestQueue.retry, also after a restart; a process that
+        # dies here leaves the job "running" for resume_interrupted
+        ckpt.fail(e)
+        raise
+    ckpt.clear()
+    return report
+
+
+def _ingest_document(doc_id, signed_url, filename, progress, tenant, ckpt):
+    chunks = ckpt.chunks() if ckpt is not None else None
+    blocks = ckpt.blocks() if ckpt is not None and chunks is None else None
+    local_path = ckpt.file_path() if ckpt is not None else None
+
+    if chunks is None and blocks is None and local_path is None:
+        if progress is not None:
+            progress.set_stage("downloading")
+        with timer("download"):
+            local_path = download_file(signed_url, filename)
+        print("C: downloaded file:", local_path, flush=True)
+        assert local_path is not None, "download_file returned None"
+        assert isinstance(local_path, str), f"local_path is {type(local_path)}"
+        if ckpt is not None:
+            local_path = ckpt.keep_file(local_path)
+
+    # page extraction -> blocks + semantic chunking -> embed + upsert,
+    # each stage in its own thread behind a bounded queue
+    if progress is not None:
+        progress.set_stage("indexing")
+    stats = {"chunks": 0}
+    if chunks is None:
+        if ckpt is not None:
+            if blocks is None:
+                blocks = ckpt.record_blocks(iter_parsed_blocks(local_path, progress))
+            chunks = ckpt.record_chunks(iter_document_chunks(
+                local_path, doc_id, filename,
+                stats=stats, progress=progress, blocks=blocks, tenant=tenant
+            ))
+        else:
+            chunks = iter_document_chunks(
+                local_path, doc_id, filename, stats=stats, progress=progress, tenant=tenant
+            )
+    else:
+        chunks = count_chunks(chunks, stats)
+    chunks = bounded(chunks, maxsize=CHUNK_QUEUE_SIZE, name="chunks")
+
+    try:
+        report = index_chunks(
+            chunks,
+            progress=progress,
+            committed=ckpt.committed if ckpt is not None else 0,
+            on_commit=ckpt.commit if ckpt is not None else None
+        )
+    finally:
+        # cached answers over this document are stale, even after a
+        # partial upsert
+        invalidate_doc(doc_id)
+    print("D: produced", stats["chunks"], "chunks, upserted", report["upserted"], flush=True)
+    assert stats["chunks"] > 0, "No chunks produced"
+    return report
@@ -0,0 +1,242 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest import ingest_document
+from checkpoint import checkpoint_states, interrupted, read_state
+from metrics import inc, INGEST_JOBS
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# queued + running jobs accepted before /ingest starts refusing work
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "64"))
+# finished jobs kept for /jobs/{id}
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "1000"))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class NotRetryable(Exception):
+    pass
+
+
+class IngestJob:
+    """
+    Status and progress of one background ingest. Also passed to
+    ingest_document as its progress reporter; its id keys the ingest
+    checkpoint, so a retry of the job resumes where it failed.
+    """
+
+    COUNTERS = (
+        "pages_parsed", "chunks_embedded", "chunks_upserted",
+        "chunks_updated", "chunks_unchanged", "chunks_deleted"
+    )
+
+    def __init__(self, doc_id: str, filename: str, tenant=None, signed_url: str = "", job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.doc_id = doc_id
+        self.filename = filename
+        self.tenant = tenant
+        self.signed_url = signed_url
+        self.attempts = 0
+        self.status = "queued"
+        self.stage = "queued"
+        self.counts = {name: 0 for name in self.COUNTERS}
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_checkpoint(cls, state):
+        """
+        Rebuilds a job that is no longer in memory, e.g. after a restart,
+        from its checkpoint state. A job whose process is gone is failed,
+        so it can be retried.
+        """
+        job = cls(
+            state["doc_id"], state["filename"], state.get("tenant"),
+            state.get("signed_url", ""), job_id=state["job_id"]
+        )
+        job.created_at = state.get("created_at", job.created_at)
+        if interrupted(state):
+            job.status = "failed"
+            job.error = "interrupted: the ingest process stopped"
+        else:
+            job.status = state.get("status", "failed")
+            job.error = state.get("error")
+        job.stage = job.status
+        if job.status != "running":
+            job.finished_at = time.time()
+        return job
+
+    def set_stage(self, stage: str):
+        with self._lock:
+            self.stage = stage
+
+    def requeue(self, signed_url=None):
+        """
+        Resets a failed job for another attempt; signed_url replaces an
+        expired link to the same file.
+        """
+        with self._lock:
+            if signed_url:
+                self.signed_url = signed_url
+            self.status = "queued"
+            self.stage = "queued"
+            self.counts = {name: 0 for name in self.COUNTERS}
+            self.error = None
+            self.started_at = None
+            self.finished_at = None
+
+    def add(self, counter: str, n: int = 1):
+        with self._lock:
+            self.counts[counter] = self.counts.get(counter, 0) + n
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "doc_id": self.doc_id,
+                "filename": self.filename,
+                "tenant": self.tenant,
+                "status": self.status,
+                "stage": self.stage,
+                "attempts": self.attempts,
+                "progress": dict(self.counts),
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class IngestQueue:
+    """
+    Bounded worker pool running ingest_document in the background.
+    """
+
+    def __init__(self, workers=INGEST_WORKERS, max_pending=INGEST_MAX_PENDING):
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._pending = 0
+
+    def submit(self, doc_id: str, signed_url: str, filename: str, tenant=None) -> IngestJob:
+        job = IngestJob(doc_id, filename, tenant, signed_url)
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} ingest jobs already pending")
+            self._pending += 1
+            self._jobs[job.id] = job
+            self._trim()
+
+        self._pool.submit(self._run, job)
+        return job
+
+    def retry(self, job_id: str, signed_url=None):
+        """
+        Runs a failed job again under the same id, resuming its checkpoint.
+        returns: the job, or None for an unknown id
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            if job.status != "failed":
+                raise NotRetryable(f"Job {job_id} is {job.status}, only failed jobs can be retried")
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} ingest jobs already pending")
+            self._pending += 1
+            job.requeue(signed_url)
+            self._jobs.move_to_end(job_id)
+
+        self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str):
+        """
+        returns: the job, rebuilt from its checkpoint when it is no longer in
+                 memory, or None for an unknown id
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        state = read_state(job_id)
+        if state is None:
+            return None
+        job = IngestJob.from_checkpoint(state)
+        if job.status == "running":
+            # owned by another live process; report it without taking it over
+            return job
+        with self._lock:
+            job = self._jobs.setdefault(job_id, job)
+            self._trim()
+        return job
+
+    def resume_interrupted(self) -> int:
+        """
+        Requeues the checkpointed jobs whose process stopped mid-ingest, e.g.
+        on a server restart; they resume where they were cut off. Jobs over
+        max_pending are left failed for a manual retry.
+        returns: number of jobs requeued
+        """
+        resumed = 0
+        for state in checkpoint_states():
+            if not interrupted(state):
+                continue
+            job = IngestJob.from_checkpoint(state)
+            with self._lock:
+                if job.id in self._jobs or self._pending >= self.max_pending:
+                    continue
+                self._pending += 1
+                job.requeue()
+                self._jobs[job.id] = job
+            self._pool.submit(self._run, job)
+            resumed += 1
+        return resumed
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: IngestJob):
+        job.status = "running"
+        job.started_at = time.time()
+        job.attempts += 1
+        try:
+            ingest_document(
+                doc_id=job.doc_id,
+                signed_url=job.signed_url,
+                filename=job.filename,
+                progress=job,
+                tenant=job.tenant,
+                job_id=job.id
+            )
+            job.status = "succeeded"
+            job.set_stage("done")
+        except Exception as e:
+            traceback.print_exc()
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            inc(INGEST_JOBS, status=job.status)
+            with self._lock:
+                self._pending -= 1
+
+    def _trim(self):
+        finished = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None
+        ]
+        for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self._jobs[job_id]
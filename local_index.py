@@ -0,0 +1,613 @@
+import json
+import os
+import sqlite3
+import threading
+from urllib.parse import quote
+
+import numpy as np
+
+# IVF is used once a namespace holds this many vectors (0 disables it)
+IVF_MIN_VECTORS = int(os.getenv("LOCAL_INDEX_IVF_MIN_VECTORS", "50000"))
+IVF_NPROBE = int(os.getenv("LOCAL_INDEX_IVF_NPROBE", "8"))
+IVF_TRAIN_ITERS = 10
+# rows added since the last IVF build, as a share of the namespace, before
+# the lists are rebuilt
+IVF_REBUILD_RATIO = 0.1
+
+
+# =========================
+# METADATA FILTERS
+# =========================
+
+def _match_value(actual, op, expected):
+    values = actual if isinstance(actual, list) else [actual]
+    if op == "$eq":
+        return expected in values
+    if op == "$ne":
+        return expected not in values
+    if op == "$in":
+        return any(v in expected for v in values)
+    if op == "$nin":
+        return not any(v in expected for v in values)
+    if op == "$exists":
+        return (actual is not None) == bool(expected)
+    if actual is None or isinstance(actual, list):
+        return False
+    if op == "$gt":
+        return actual > expected
+    if op == "$gte":
+        return actual >= expected
+    if op == "$lt":
+        return actual < expected
+    if op == "$lte":
+        return actual <= expected
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def matches_filter(metadata: dict, filter_clause) -> bool:
+    """
+    Evaluates the subset of Pinecone's metadata filter language we use:
+    field equality, $eq/$ne/$in/$nin/$gt/$gte/$lt/$lte/$exists, $and, $or.
+    """
+    if not filter_clause:
+        return True
+    for key, cond in filter_clause.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, c) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            for op, expected in cond.items():
+                if not _match_value(metadata.get(key), op, expected):
+                    return False
+        elif not _match_value(metadata.get(key), "$eq", cond):
+            return False
+    return True
+
+
+# =========================
+# NAMESPACE STORE
+# =========================
+
+class _Namespace:
+    """
+    One namespace: a memory-mapped float32 matrix (rows [0, count) are live),
+    row-aligned ids / metadata / sparse vectors, and a sparse inverted index.
+    Deletes swap the last row into the hole so the matrix stays dense.
+
+    The IVF lists are built in a background thread; queries scan brute
+    force until a build matching the current rows is installed.
+    """
+
+    def __init__(self, name, matrix_path, dimension, conn, lock):
+        self.name = name
+        self.matrix_path = matrix_path
+        self.dimension = dimension
+        self.conn = conn
+        # the owning LocalIndex's lock, taken to install a finished IVF build
+        self.lock = lock
+
+        self.ids = []
+        self.metadata = []
+        self.sparse = []
+        self.row_of = {}
+        # sparse index -> {row: value}
+        self.postings = {}
+        self._field_index = {}
+        self._ivf = None
+        # bumped whenever existing rows change, which invalidates the IVF
+        self._version = 0
+        self._ivf_building = False
+
+        rows = conn.execute(
+            "SELECT id, row, metadata, sparse FROM vectors"
+            " WHERE namespace = ? ORDER BY row",
+            (name,)
+        ).fetchall()
+        for vid, row, meta, sparse in rows:
+            self.row_of[vid] = row
+            self.ids.append(vid)
+            self.metadata.append(json.loads(meta))
+            self.sparse.append(json.loads(sparse) if sparse else None)
+            self._post(row, self.sparse[-1])
+
+        if not os.path.exists(matrix_path):
+            open(matrix_path, "wb").close()
+        capacity = os.path.getsize(matrix_path) // (4 * dimension)
+        self._open_matrix(max(capacity, len(self.ids)))
+
+    @property
+    def count(self):
+        return len(self.ids)
+
+    # ---- storage ----
+
+    def _open_matrix(self, capacity):
+        self.capacity = capacity
+        if capacity == 0:
+            self.vectors = np.zeros((0, self.dimension), dtype=np.float32)
+            return
+        with open(self.matrix_path, "r+b") as f:
+            f.truncate(capacity * self.dimension * 4)
+        self.vectors = np.memmap(
+            self.matrix_path, dtype=np.float32, mode="r+",
+            shape=(capacity, self.dimension)
+        )
+
+    def _ensure_capacity(self, n):
+        if n <= self.capacity:
+            return
+        if isinstance(self.vectors, np.memmap):
+            self.vectors.flush()
+        self.vectors = None
+        self._open_matrix(max(n, self.capacity * 2, 1024))
+
+    def _post(self, row, sparse):
+        if not sparse:
+            return
+        for i, v in zip(sparse["indices"], sparse["values"]):
+            self.postings.setdefault(i, {})[row] = v
+
+    def _unpost(self, row, sparse):
+        if not sparse:
+            return
+        for i in sparse["indices"]:
+            p = self.postings.get(i)
+            if p is not None:
+                p.pop(row, None)
+                if not p:
+                    del self.postings[i]
+
+    def _dirty(self):
+        self._field_index.clear()
+
+    # ---- writes ----
+
+    def upsert(self, vectors):
+        self._ensure_capacity(self.count + len(vectors))
+        db_rows = []
+        for v in vectors:
+            vid = str(v["id"])
+            values = np.asarray(v["values"], dtype=np.float32)
+            if values.shape != (self.dimension,):
+                raise ValueError(
+                    f"Vector {vid} has dimension {values.size}, expected {self.dimension}"
+                )
+            sparse = v.get("sparse_values")
+            if sparse:
+                sparse = {"indices": list(sparse["indices"]), "values": list(sparse["values"])}
+            meta = dict(v.get("metadata") or {})
+
+            row = self.row_of.get(vid)
+            if row is None:
+                row = self.count
+                self.row_of[vid] = row
+                self.ids.append(vid)
+                self.metadata.append(meta)
+                self.sparse.append(sparse)
+            else:
+                self._unpost(row, self.sparse[row])
+                self.metadata[row] = meta
+                self.sparse[row] = sparse
+                self._version += 1
+
+            self.vectors[row] = values
+            self._post(row, sparse)
+            db_rows.append((
+                self.name, vid, row, json.dumps(meta),
+                json.dumps(sparse) if sparse else None
+            ))
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO vectors (namespace, id, row, metadata, sparse)"
+            " VALUES (?, ?, ?, ?, ?)",
+            db_rows
+        )
+        self._dirty()
+        return len(vectors)
+
+    def update_metadata(self, vid, set_metadata):
+        row = self.row_of.get(vid)
+        if row is None:
+            return
+        self.metadata[row].update(set_metadata)
+        self.conn.execute(
+            "UPDATE vectors SET metadata = ? WHERE namespace = ? AND id = ?",
+            (json.dumps(self.metadata[row]), self.name, vid)
+        )
+        self._dirty()
+
+    def delete(self, ids):
+        for vid in ids:
+            row = self.row_of.pop(str(vid), None)
+            if row is None:
+                continue
+            self._unpost(row, self.sparse[row])
+            last = self.count - 1
+            if row != last:
+                moved = self.ids[last]
+                self._unpost(last, self.sparse[last])
+                self.vectors[row] = self.vectors[last]
+                self.ids[row] = moved
+                self.metadata[row] = self.metadata[last]
+                self.sparse[row] = self.sparse[last]
+                self.row_of[moved] = row
+                self._post(row, self.sparse[row])
+                self.conn.execute(
+                    "UPDATE vectors SET row = ? WHERE namespace = ? AND id = ?",
+                    (row, self.name, moved)
+                )
+            self.ids.pop()
+            self.metadata.pop()
+            self.sparse.pop()
+            self.conn.execute(
+                "DELETE FROM vectors WHERE namespace = ? AND id = ?",
+                (self.name, str(vid))
+            )
+        self._version += 1
+        self._dirty()
+
+    def flush(self):
+        if isinstance(self.vectors, np.memmap):
+            self.vectors.flush()
+
+    # ---- reads ----
+
+    def rows_matching(self, filter_clause):
+        """
+        returns: np.ndarray of live rows passing the filter, or None for all
+        """
+        if not filter_clause:
+            return None
+
+        # fast path for {"field": value} / {"field": {"$eq" | "$in": ...}}
+        if len(filter_clause) == 1:
+            field, cond = next(iter(filter_clause.items()))
+            if not field.startswith("$"):
+                wanted = None
+                if not isinstance(cond, dict):
+                    wanted = [cond]
+                elif len(cond) == 1 and "$eq" in cond:
+                    wanted = [cond["$eq"]]
+                elif len(cond) == 1 and "$in" in cond:
+                    wanted = cond["$in"]
+                if wanted is not None:
+                    index = self._value_index(field)
+                    rows = set()
+                    for value in wanted:
+                        rows |= index.get(_hashable(value), set())
+                    return np.fromiter(sorted(rows), dtype=np.int64, count=len(rows))
+
+        rows = [r for r, meta in enumerate(self.metadata) if matches_filter(meta, filter_clause)]
+        return np.asarray(rows, dtype=np.int64)
+
+    def _value_index(self, field):
+        index = self._field_index.get(field)
+        if index is None:
+            index = {}
+            for row, meta in enumerate(self.metadata):
+                value = meta.get(field)
+                for v in value if isinstance(value, list) else [value]:
+                    index.setdefault(_hashable(v), set()).add(row)
+            self._field_index[field] = index
+        return index
+
+    def sparse_scores(self, sparse_vector, rows=None):
+        """
+        returns: {row: sparse dot product} for rows sharing a sparse index
+        """
+        scores = {}
+        if not sparse_vector:
+            return scores
+        allowed = None if rows is None else set(rows.tolist())
+        for i, qv in zip(sparse_vector["indices"], sparse_vector["values"]):
+            for row, v in self.postings.get(i, {}).items():
+                if allowed is None or row in allowed:
+                    scores[row] = scores.get(row, 0.0) + qv * v
+        return scores
+
+    def candidate_rows(self, vector, rows):
+        """
+        Narrows the dense search with the IVF lists when the namespace is
+        large enough; returns rows unchanged otherwise.
+        """
+        if not IVF_MIN_VECTORS or self.count < IVF_MIN_VECTORS or vector is None:
+            return rows
+        ivf = self._ivf
+        if ivf is not None and ivf["version"] != self._version:
+            ivf = self._ivf = None
+        if ivf is None or self.count - ivf["built_count"] > IVF_REBUILD_RATIO * ivf["built_count"]:
+            self._schedule_ivf()
+        if ivf is None:
+            return rows
+
+        q = np.asarray(vector, dtype=np.float32)
+        probe = np.argsort(-(ivf["centroids"] @ q))[:IVF_NPROBE]
+        candidates = np.concatenate(
+            [ivf["lists"][c] for c in probe] +
+            [np.arange(ivf["built_count"], self.count, dtype=np.int64)]
+        )
+        if rows is not None:
+            candidates = np.intersect1d(candidates, rows, assume_unique=False)
+        return candidates
+
+    def _schedule_ivf(self):
+        """
+        Starts a background IVF build over the current rows; called with
+        the lock held. The result is dropped if rows changed meanwhile.
+        """
+        if self._ivf_building:
+            return
+        self._ivf_building = True
+        version, vectors = self._version, self.vectors[:self.count]
+
+        def build():
+            try:
+                ivf = build_ivf(vectors)
+            except Exception as e:
+                print(f"IVF build failed for namespace {self.name!r}: {e}", flush=True)
+                ivf = None
+            with self.lock:
+                self._ivf_building = False
+                if ivf is not None and version == self._version:
+                    ivf["version"] = version
+                    self._ivf = ivf
+
+        threading.Thread(target=build, name=f"ivf-{self.name}", daemon=True).start()
+
+    def search_plan(self, vector, sparse_vector, filter_clause):
+        """
+        Everything a query needs from the mutable state, taken under the
+        index lock; score_plan then runs without it.
+        """
+        rows = self.rows_matching(filter_clause)
+        sparse = self.sparse_scores(sparse_vector, rows)
+        return {
+            "count": self.count,
+            "version": self._version,
+            "vectors": self.vectors,
+            "dense_rows": self.candidate_rows(vector, rows) if vector is not None else None,
+            "sparse_rows": np.fromiter(sparse.keys(), dtype=np.int64, count=len(sparse)),
+            "sparse_values": np.fromiter(sparse.values(), dtype=np.float64, count=len(sparse)),
+        }
+
+    @staticmethod
+    def score_plan(plan, vector):
+        """
+        returns: (rows, scores) arrays, dense + sparse dot products for the
+                 dense candidates and every row with a sparse hit
+        """
+        sparse_rows, sparse_values = plan["sparse_rows"], plan["sparse_values"]
+        if vector is None:
+            return sparse_rows, sparse_values
+
+        q = np.asarray(vector, dtype=np.float32)
+        vectors, dense_rows = plan["vectors"], plan["dense_rows"]
+        if dense_rows is None:
+            # unfiltered: one pass over the live slice, no fancy-index copy
+            rows = np.arange(plan["count"], dtype=np.int64)
+            scores = (vectors[:plan["count"]] @ q).astype(np.float64)
+            scores[sparse_rows] += sparse_values
+            return rows, scores
+
+        # lexical hits outside the dense candidates still get a dense score
+        extra = np.setdiff1d(sparse_rows, dense_rows)
+        rows = np.concatenate([dense_rows, extra])
+        scores = np.concatenate([
+            np.asarray(vectors[dense_rows]) @ q if len(dense_rows) else np.zeros(0, dtype=np.float32),
+            np.asarray(vectors[extra]) @ q if len(extra) else np.zeros(0, dtype=np.float32),
+        ]).astype(np.float64)
+        if len(sparse_rows):
+            order = np.argsort(rows, kind="stable")
+            scores[order[np.searchsorted(rows[order], sparse_rows)]] += sparse_values
+        return rows, scores
+
+    def matches(self, namespace, rows, scores, top_k, include_values=False, include_metadata=False):
+        """
+        Query response for the top_k scores; called with the lock held.
+        """
+        k = min(top_k, len(rows))
+        if k <= 0:
+            return {"namespace": namespace, "matches": []}
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        matches = []
+        for i in top:
+            m = self.record(int(rows[i]), include_values, include_metadata)
+            m["score"] = float(scores[i])
+            matches.append(m)
+        return {"namespace": namespace, "matches": matches}
+
+    def record(self, row, include_values=False, include_metadata=True):
+        out = {"id": self.ids[row]}
+        if include_values:
+            out["values"] = self.vectors[row].tolist()
+            if self.sparse[row]:
+                out["sparse_values"] = dict(self.sparse[row])
+        if include_metadata:
+            out["metadata"] = dict(self.metadata[row])
+        return out
+
+
+def _hashable(value):
+    return json.dumps(value, sort_keys=True) if isinstance(value, (dict, list)) else value
+
+
+def build_ivf(vectors, n_lists=None, iters=IVF_TRAIN_ITERS, seed=0):
+    """
+    Spherical k-means over the rows; returns centroids and the row lists
+    assigned to each centroid.
+    """
+    n = len(vectors)
+    n_lists = n_lists or max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(n, size=min(n, n_lists * 64), replace=False)]
+    centroids = np.array(sample[rng.choice(len(sample), size=n_lists, replace=False)])
+
+    for _ in range(iters):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = sample[assign == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.where(norms > 0, norms, 1.0)
+
+    assign = np.empty(n, dtype=np.int64)
+    for start in range(0, n, 65536):
+        block = np.asarray(vectors[start:start + 65536])
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+    order = np.argsort(assign, kind="stable")
+    bounds = np.searchsorted(assign[order], np.arange(n_lists + 1))
+    lists = [order[bounds[c]:bounds[c + 1]] for c in range(n_lists)]
+    return {"centroids": centroids, "lists": lists, "built_count": n}
+
+
+# =========================
+# INDEX
+# =========================
+
+class LocalIndex:
+    """
+    In-process stand-in for the Pinecone index handle, implementing the
+    operations this service uses: upsert, update, query (dense + sparse,
+    metadata filter), delete, fetch, list and describe_index_stats.
+
+    Scores are dot products (dense + sparse), matching the "dotproduct"
+    metric of the hosted index. Dense search is brute force over the
+    memory-mapped matrix, narrowed by an IVF index for large namespaces.
+    """
+
+    def __init__(self, path: str, dimension: int = 1024):
+        self.path = path
+        self.dimension = dimension
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            os.path.join(path, "index.sqlite"), timeout=30, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            " namespace TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " row INTEGER NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " sparse TEXT,"
+            " PRIMARY KEY (namespace, id))"
+        )
+        self._conn.commit()
+        self._namespaces = {}
+        for (name,) in self._conn.execute("SELECT DISTINCT namespace FROM vectors").fetchall():
+            self._namespace(name)
+
+    def _namespace(self, name, create=True):
+        ns = self._namespaces.get(name)
+        if ns is None and create:
+            matrix_path = os.path.join(self.path, f"{quote(name, safe='') or '_default'}.f32")
+            ns = self._namespaces[name] = _Namespace(
+                name, matrix_path, self.dimension, self._conn, self._lock
+            )
+        return ns
+
+    def upsert(self, vectors, namespace: str = "", **kwargs):
+        with self._lock:
+            n = self._namespace(namespace).upsert(vectors)
+            self._namespace(namespace).flush()
+            self._conn.commit()
+        return {"upserted_count": n}
+
+    def update(self, id, set_metadata=None, namespace: str = "", **kwargs):
+        with self._lock:
+            ns = self._namespace(namespace, create=False)
+            if ns is not None and set_metadata:
+                ns.update_metadata(str(id), set_metadata)
+                self._conn.commit()
+        return {}
+
+    def delete(self, ids=None, delete_all=False, namespace: str = "", filter=None, **kwargs):
+        with self._lock:
+            ns = self._namespace(namespace, create=False)
+            if ns is None:
+                return {}
+            if delete_all:
+                ids = list(ns.ids)
+            elif filter:
+                rows = ns.rows_matching(filter)
+                ids = [ns.ids[r] for r in rows.tolist()]
+            ns.delete(ids or [])
+            ns.flush()
+            self._conn.commit()
+        return {}
+
+    def fetch(self, ids, namespace: str = "", **kwargs):
+        with self._lock:
+            ns = self._namespace(namespace, create=False)
+            vectors = {}
+            if ns is not None:
+                for vid in ids:
+                    row = ns.row_of.get(str(vid))
+                    if row is not None:
+                        vectors[str(vid)] = ns.record(row, include_values=True)
+        return {"namespace": namespace, "vectors": vectors}
+
+    def list(self, prefix=None, limit=None, namespace: str = "", **kwargs):
+        """
+        Yields pages of ids starting with prefix, like Index.list.
+        """
+        limit = limit or 100
+        with self._lock:
+            ns = self._namespace(namespace, create=False)
+            ids = sorted(
+                vid for vid in (ns.ids if ns is not None else [])
+                if not prefix or vid.startswith(prefix)
+            )
+        for i in range(0, len(ids), limit):
+            yield {"namespace": namespace, "vectors": [{"id": vid} for vid in ids[i:i + limit]]}
+
+    def query(
+        self,
+        top_k: int,
+        vector=None,
+        sparse_vector=None,
+        namespace: str = "",
+        filter=None,
+        include_values: bool = False,
+        include_metadata: bool = False,
+        **kwargs
+    ):
+        """
+        The dense scan runs outside the index lock, on a snapshot of the
+        namespace; if a delete or overwrite moved rows meanwhile, the query
+        is scored again, the last time under the lock.
+        """
+        for attempt in range(3):
+            with self._lock:
+                ns = self._namespace(namespace, create=False)
+                if ns is None or ns.count == 0:
+                    return {"namespace": namespace, "matches": []}
+                plan = ns.search_plan(vector, sparse_vector, filter)
+                if attempt == 2:
+                    rows, scores = ns.score_plan(plan, vector)
+                    return ns.matches(namespace, rows, scores, top_k, include_values, include_metadata)
+
+            rows, scores = ns.score_plan(plan, vector)
+            with self._lock:
+                if ns._version == plan["version"] and self._namespaces.get(namespace) is ns:
+                    return ns.matches(namespace, rows, scores, top_k, include_values, include_metadata)
+
+    def describe_index_stats(self, namespace=None, **kwargs):
+        with self._lock:
+            namespaces = {
+                name: {"vector_count": ns.count}
+                for name, ns in self._namespaces.items()
+                if ns.count
+            }
+        return {
+            "dimension": self.dimension,
+            "namespaces": namespaces,
+            "total_vector_count": sum(n["vector_count"] for n in namespaces.values()),
+        }
@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv("METRICS", "1") != "0"
+
+# seconds; covers cache hits up to slow LLM generations
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0
+)
+
+
+def _label_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, n=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(v)}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus model. observe() is a
+    bisect and three additions under a lock.
+    """
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label key -> [bucket counts..., +Inf count], sum
+        self._counts = {}
+        self._sums = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[i] += 1
+            self._sums[key] += value
+
+    def snapshot(self, **labels):
+        """
+        returns: (count, sum) for one label set
+        """
+        key = _label_key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            return (sum(counts), self._sums[key]) if counts else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key in sorted(self._counts):
+                counts, total = self._counts[key], self._sums[key]
+                running = 0
+                for bound, c in zip(self.buckets + (float("inf"),), counts):
+                    running += c
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {running}"
+                    )
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {running}")
+        return lines
+
+
+# =========================
+# METRICS
+# =========================
+
+STAGE_SECONDS = Histogram(
+    "contextforge_stage_seconds",
+    "Time spent per pipeline stage (download, parse, block_embed, chunk_embed, "
+    "upsert, query_embed, hybrid_query, rerank, assemble, llm)."
+)
+EMBED_CALLS = Counter("contextforge_embed_calls_total", "Remote embedding requests.")
+EMBED_INPUTS = Counter("contextforge_embed_inputs_total", "Texts sent for embedding.")
+EMBED_TOKENS = Counter("contextforge_embed_tokens_total", "Whitespace tokens sent for embedding.")
+LLM_CALLS = Counter("contextforge_llm_calls_total", "LLM generation requests.")
+LLM_TOKENS = Counter("contextforge_llm_tokens_total", "LLM tokens by kind (prompt, completion).")
+CACHE_HITS = Counter("contextforge_cache_hits_total", "Cache hits by cache.")
+CACHE_MISSES = Counter("contextforge_cache_misses_total", "Cache misses by cache.")
+ERRORS = Counter("contextforge_errors_total", "Errors by stage.")
+INGEST_JOBS = Counter("contextforge_ingest_jobs_total", "Finished ingest jobs by status.")
+
+REGISTRY = [
+    STAGE_SECONDS,
+    EMBED_CALLS,
+    EMBED_INPUTS,
+    EMBED_TOKENS,
+    LLM_CALLS,
+    LLM_TOKENS,
+    CACHE_HITS,
+    CACHE_MISSES,
+    ERRORS,
+    INGEST_JOBS,
+]
+
+
+def observe(stage: str, seconds: float):
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def inc(counter: Counter, n=1, **labels):
+    if METRICS_ENABLED and n:
+        counter.inc(n, **labels)
+
+
+@contextmanager
+def timer(stage: str):
+    """
+    Records the block's duration under stage; an exception is also
+    counted in contextforge_errors_total{stage=...}. Works across awaits.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def timed_iter(iterable, stage: str):
+    """
+    Yields from iterable, recording the time spent producing each item.
+    """
+    it = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        except Exception:
+            inc(ERRORS, stage=stage)
+            raise
+        observe(stage, time.perf_counter() - start)
+        yield item
+
+
+def render() -> str:
+    """
+    Prometheus text exposition (format 0.0.4) of every metric.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
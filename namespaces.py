@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+
+from pinecone_client import get_index
+from bm25 import get_lexical_index
+
+# how vectors are spread over index namespaces:
+#   "shared"   - everything in SHARED_NAMESPACE; documents are told apart
+#                by the doc_id metadata filter and the tenant is ignored
+#   "tenant"   - one namespace per tenant ("<tenant>")
+#   "document" - one namespace per tenant and document ("<tenant>/<doc_id>")
+NAMESPACE_STRATEGY = os.getenv("NAMESPACE_STRATEGY", "shared")
+SHARED_NAMESPACE = os.getenv("SHARED_NAMESPACE", "ns1")
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+# seconds a tenant's list of document namespaces is reused
+NAMESPACE_LIST_TTL = float(os.getenv("NAMESPACE_LIST_TTL", "30"))
+# seconds a namespace written by this process is searched even though
+# describe_index_stats (eventually consistent) does not list it yet
+NAMESPACE_SETTLE_SECONDS = float(os.getenv("NAMESPACE_SETTLE_SECONDS", "300"))
+
+SEPARATOR = "/"
+
+_lock = threading.Lock()
+_known = set()
+# namespace -> when this process wrote it, until the stats list it
+_unconfirmed = {}
+_listed_at = 0.0
+
+
+def tenant_name(tenant=None) -> str:
+    tenant = tenant or DEFAULT_TENANT
+    if SEPARATOR in tenant:
+        raise ValueError(f"Tenant may not contain {SEPARATOR!r}: {tenant}")
+    return tenant
+
+
+def namespace_for(doc_id: str, tenant=None, strategy=None) -> str:
+    """
+    returns: the namespace a document's vectors are written to
+    """
+    strategy = strategy or NAMESPACE_STRATEGY
+    if strategy == "shared":
+        return SHARED_NAMESPACE
+    if strategy == "tenant":
+        return tenant_name(tenant)
+    if strategy == "document":
+        return f"{tenant_name(tenant)}{SEPARATOR}{doc_id}"
+    raise ValueError(f"Unknown namespace strategy: {strategy}")
+
+
+def remember_namespace(namespace: str):
+    """
+    Makes a namespace written by this process visible to queries before
+    the next listing.
+    """
+    with _lock:
+        _known.add(namespace)
+        _unconfirmed[namespace] = time.time()
+
+
+def document_namespaces(tenant=None):
+    """
+    returns: the tenant's document namespaces, from describe_index_stats
+             at most every NAMESPACE_LIST_TTL seconds
+    """
+    global _listed_at
+    prefix = tenant_name(tenant) + SEPARATOR
+    with _lock:
+        if time.time() - _listed_at > NAMESPACE_LIST_TTL:
+            stats = get_index().describe_index_stats()
+            listed = set(stats["namespaces"].keys())
+            now = time.time()
+            # a fresh write the stats do not show yet stays searchable; once
+            # listed, a namespace is dropped only when the stats no longer
+            # list it (empty namespaces are not reported)
+            for ns in list(_unconfirmed):
+                if ns in listed or now - _unconfirmed[ns] > NAMESPACE_SETTLE_SECONDS:
+                    del _unconfirmed[ns]
+            _known.clear()
+            _known.update(listed, _unconfirmed)
+            _listed_at = now
+        return sorted(ns for ns in _known if ns.startswith(prefix))
+
+
+def namespaces_for_query(doc_ids=None, tenant=None, strategy=None):
+    """
+    returns: (namespace, doc_ids) pairs to search; doc_ids is the metadata
+             filter still needed inside that namespace (None for none)
+    """
+    strategy = strategy or NAMESPACE_STRATEGY
+    if strategy != "document":
+        return [(namespace_for(None, tenant, strategy), doc_ids or None)]
+    if doc_ids:
+        return [(namespace_for(d, tenant, strategy), None) for d in dict.fromkeys(doc_ids)]
+    return [(ns, None) for ns in document_namespaces(tenant)]
+
+
+def lexical_index_for(namespace: str):
+    """
+    BM25 index holding one namespace's chunks; the shared namespace keeps
+    the original BM25_INDEX_PATH file.
+    """
+    return get_lexical_index(None if namespace == SHARED_NAMESPACE else namespace)
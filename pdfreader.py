@@ -1,17 +1,146 @@
+import multiprocessing
+import os
 import re
+import threading
 import unicodedata
-from collections import Counter
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, islice
+import numpy as np
 from pypdf import PdfReader
-from utils import cosine_similarity,update_centroid,embed_batch
+from utils import embed_batch
+from metrics import timer
+from pipeline import batched
 HEADER_FOOTER_LINES = 3
 REPEAT_THRESHOLD = 0.6
 
-
-def detect_boilerplate_lines(reader: PdfReader):
+# process pool size for multi-document parsing; 0/1 keeps the sequential loop
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))
+
+# process pool size for splitting one large PDF into page-range shards
+PAGE_WORKERS = int(os.getenv("PAGE_WORKERS", "0"))
+SHARD_MIN_PAGES = int(os.getenv("SHARD_MIN_PAGES", "32"))
+# pages per shard when streaming one document through the page pool; small
+# so the first pages reach chunking early
+STREAM_SHARD_PAGES = int(os.getenv("STREAM_SHARD_PAGES", "8"))
+# below this many cores, extra page workers cost more than they save
+PAGE_WORKERS_MIN_CPUS = int(os.getenv("PAGE_WORKERS_MIN_CPUS", "4"))
+
+# leading pages used by the streaming parser to detect boilerplate and
+# pick a chunking strategy
+BOILERPLATE_WINDOW = int(os.getenv("BOILERPLATE_WINDOW", "24"))
+
+# which block embeddings semantic chunking carries forward to indexing:
+#   "single"   - single-block chunks keep their block embedding (exact)
+#   "centroid" - every chunk gets its normalized block centroid
+#   "off"      - index_chunks embeds every chunk again
+REUSE_EMBEDDINGS = os.getenv("REUSE_EMBEDDINGS", "single")
+
+# blocks whose centroid similarities are computed together (0 = one by one)
+SEMANTIC_LOOKAHEAD = int(os.getenv("SEMANTIC_LOOKAHEAD", "0"))
+
+
+# worker processes are spawned, never forked: the API process runs threads
+# (HTTP clients, ingest workers, index builds) whose locks a fork would copy
+PROCESS_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def process_pool(max_workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=PROCESS_CONTEXT)
+
+
+class PageTexts:
+    """
+    Per-document page-text layer: each page's extract_text() runs at most
+    once and is shared by every chunking strategy.
+    """
+
+    def __init__(self, reader: PdfReader):
+        self.reader = reader
+        self._texts = {}
+
+    def __len__(self):
+        return len(self.reader.pages)
+
+    def __getitem__(self, i):
+        if i not in self._texts:
+            self._texts[i] = self.reader.pages[i].extract_text() or ""
+        return self._texts[i]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def extract_parallel(self, path: str, max_workers: int):
+        """
+        Fills the page cache by extracting page-range shards in worker
+        processes. Results are stored by page number, so everything that
+        reads pages afterwards sees the same text as a sequential parse.
+        """
+        shards = page_shards(len(self), max_workers * 4)
+        with process_pool(max_workers) as pool:
+            futures = [
+                pool.submit(_extract_page_range, path, start, stop)
+                for start, stop in shards
+            ]
+            for (start, _), future in zip(shards, futures):
+                for i, text in enumerate(future.result(), start=start):
+                    self._texts[i] = text
+
+
+def page_shards(num_pages, num_shards, min_pages=SHARD_MIN_PAGES):
+    """
+    Splits [0, num_pages) into contiguous (start, stop) ranges of at least
+    min_pages pages.
+    """
+    size = max(min_pages, -(-num_pages // max(num_shards, 1)))
+    return [
+        (start, min(start + size, num_pages))
+        for start in range(0, num_pages, size)
+    ]
+
+
+def auto_page_workers(cpus=None) -> int:
+    """
+    Page workers worth starting on this host: every worker parses the
+    document's xref and page tree once more, so they only pay off with
+    cores to spare next to the chunking and upsert threads.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    if cpus < PAGE_WORKERS_MIN_CPUS:
+        return 0
+    return min(4, cpus - 2)
+
+
+# per worker process: readers of the documents it extracted from last, so
+# the shards of one document parse its xref and page tree once per worker
+_worker_readers = OrderedDict()
+WORKER_READERS = 2
+
+
+def _worker_reader(path):
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    reader = _worker_readers.get(key)
+    if reader is None:
+        reader = _worker_readers[key] = PdfReader(path)
+        while len(_worker_readers) > WORKER_READERS:
+            _worker_readers.popitem(last=False)
+    else:
+        _worker_readers.move_to_end(key)
+    return reader
+
+
+def _extract_page_range(path, start, stop):
+    reader = _worker_reader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def detect_boilerplate_lines(pages: PageTexts):
     header_lines, footer_lines = [], []
 
-    for page in reader.pages:
-        text = page.extract_text()
+    for text in pages:
         if not text:
             continue
         lines = [l.strip() for l in text.splitlines() if l.strip()]
@@ -19,7 +148,7 @@ def detect_boilerplate_lines(reader: PdfReader):
         footer_lines.extend(lines[-HEADER_FOOTER_LINES:])
 
     counter = Counter(header_lines + footer_lines)
-    total_pages = len(reader.pages)
+    total_pages = len(pages)
 
     return {
         line for line, freq in counter.items()
@@ -54,8 +183,7 @@ def should_merge(prev, curr):
         return False
     return curr and curr[0].islower()
 
-def process_page(page, page_number, source, boilerplate, state):
-    raw = page.extract_text()
+def process_page(raw, page_number, source, boilerplate, state):
     if not raw:
         return []
 
@@ -113,11 +241,11 @@ def process_page(page, page_number, source, boilerplate, state):
         })
 
     return blocks
-def paragraph_blocks_from_pages(reader: PdfReader, source: str):
-    blocks = []
-
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text()
+def iter_paragraph_blocks(pages, source: str):
+    """
+    pages: iterable of (page_number, text)
+    """
+    for page_number, text in pages:
         if not text:
             continue
 
@@ -128,65 +256,69 @@ def paragraph_blocks_from_pages(reader: PdfReader, source: str):
         ]
 
         for p in paragraphs:
-            blocks.append({
+            yield {
                 "text": p,
                 "metadata": {
                     "source": source,
-                    "page": i + 1,
+                    "page": page_number,
                     "chapter": -1,
                     "section": "unknown"
                 }
-            })
+            }
 
-    return blocks
-def fixed_size_blocks(reader: PdfReader, source: str):
-    full_text = []
 
-    for page in reader.pages:
-        t = page.extract_text()
-        if t:
-            full_text.append(t)
+def paragraph_blocks_from_pages(pages: PageTexts, source: str):
+    return list(iter_paragraph_blocks(enumerate(pages, start=1), source))
 
-    text = "\n".join(full_text)
-    words = text.split()
 
-    blocks = []
-    chunk_size = 180
-    overlap = 30
-    start = 0
-
-    while start < len(words):
-        end = start + chunk_size
-        chunk = " ".join(words[start:end])
+def iter_fixed_size_blocks(texts, source: str, chunk_size=180, overlap=30):
+    """
+    texts: iterable of page texts. Windows run across page boundaries, the
+    same as splitting the whole document at once, but only the words of the
+    current window are held in memory.
+    """
+    step = chunk_size - overlap
+    words = []
 
-        blocks.append({
-            "text": chunk,
+    def block(chunk_words):
+        return {
+            "text": " ".join(chunk_words),
             "metadata": {
                 "source": source,
                 "page": -1,
                 "chapter": -1,
                 "section": "unknown"
             }
-        })
+        }
 
-        start += chunk_size - overlap
+    for t in texts:
+        if not t:
+            continue
+        words.extend(t.split())
+        while len(words) > chunk_size:
+            yield block(words[:chunk_size])
+            words = words[step:]
 
-    return blocks
+    while words:
+        yield block(words[:chunk_size])
+        words = words[step:]
 
 
-def process_pdf(path: str):
-    reader = PdfReader(path)
-    boilerplate = detect_boilerplate_lines(reader)
+def fixed_size_blocks(pages: PageTexts, source: str):
+    return list(iter_fixed_size_blocks(pages, source))
+
+
+def process_pdf(path: str, pages: PageTexts | None = None):
+    if pages is None:
+        pages = PageTexts(PdfReader(path))
+    boilerplate = detect_boilerplate_lines(pages)
 
     state = {"chapter": None, "section": None,"found_section":False}
     outputs = []
 
-    for i, page in enumerate(reader.pages):
-        if i>5:
-            break
-
+    for i in range(len(pages)):
         page_blocks = process_page(
-            page=page,
+            raw=pages[i],
             page_number=i + 1,
             source=path,
             boilerplate=boilerplate,
@@ -195,6 +327,145 @@ def process_pdf(path: str):
         outputs.extend(page_blocks)
 
     return outputs,state["found_section"]
+
+
+def iter_page_texts(path: str):
+    reader = PdfReader(path)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+_page_pool = None
+_page_pool_workers = 0
+_page_pool_lock = threading.Lock()
+
+
+def get_page_pool(max_workers: int):
+    """
+    Process pool shared by streaming ingests; replaced when asked for a
+    different size.
+    """
+    global _page_pool, _page_pool_workers
+    with _page_pool_lock:
+        if _page_pool is not None and _page_pool_workers != max_workers:
+            _page_pool.shutdown(wait=False, cancel_futures=True)
+            _page_pool = None
+        if _page_pool is None:
+            _page_pool = process_pool(max_workers)
+            _page_pool_workers = max_workers
+        return _page_pool
+
+
+def reset_page_pool(pool=None):
+    """
+    Drops the shared pool (only if it is still `pool`, when given), e.g.
+    after a worker died; the next get_page_pool starts a fresh one.
+    """
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None or (pool is not None and _page_pool is not pool):
+            return
+        old, _page_pool = _page_pool, None
+    old.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_page_pool():
+    reset_page_pool()
+
+
+def iter_page_texts_parallel(path: str, max_workers: int, shard_pages=None, in_flight=None):
+    """
+    Streaming counterpart of PageTexts.extract_parallel: page-range shards
+    are extracted in worker processes and yielded in page order.
+
+    in_flight: shards submitted ahead of the one being yielded (defaults to
+               twice max_workers), which bounds the pages held in memory
+
+    If a worker dies, the pool is replaced and the outstanding shards are
+    submitted once more.
+    """
+    if shard_pages is None:
+        shard_pages = STREAM_SHARD_PAGES
+    if in_flight is None:
+        in_flight = 2 * max_workers
+    in_flight = max(1, in_flight)
+
+    num_pages = len(PdfReader(path).pages)
+    shards = iter(page_shards(num_pages, -(-num_pages // max(shard_pages, 1)), shard_pages))
+    # [start, stop, future] in page order; a shard is queued before it is
+    # submitted, so a submit that fails does not lose it
+    pending = deque()
+    retried = False
+    pool = None
+    try:
+        while True:
+            try:
+                pool = get_page_pool(max_workers)
+                for start, stop in islice(shards, in_flight - len(pending)):
+                    pending.append([start, stop, None])
+                for shard in pending:
+                    if shard[2] is None:
+                        shard[2] = pool.submit(_extract_page_range, path, shard[0], shard[1])
+                if not pending:
+                    return
+                texts = pending[0][2].result()
+            except BrokenProcessPool:
+                reset_page_pool(pool)
+                if retried:
+                    raise
+                retried = True
+                shards = chain([(start, stop) for start, stop, _ in pending], shards)
+                pending.clear()
+                continue
+            pending.popleft()
+            yield from texts
+    finally:
+        # a consumer that stops early leaves no queued work behind
+        for _, _, future in pending:
+            if future is not None:
+                future.cancel()
+
+
+def iter_document_blocks(pdf_path: str, texts=None):
+    """
+    Streaming counterpart of pdf_to_chunks: yields blocks as pages are read.
+
+    Boilerplate lines and the chunking strategy (sections, paragraphs or
+    fixed-size) are decided on the first BOILERPLATE_WINDOW pages, which
+    are the only pages held in memory at once.
+    """
+    if texts is None:
+        texts = iter_page_texts(pdf_path)
+    texts = iter(texts)
+
+    window = list(islice(texts, BOILERPLATE_WINDOW))
+    if not window:
+        return
+    boilerplate = detect_boilerplate_lines(window)
+    rest_start = len(window) + 1
+
+    state = {"chapter": None, "section": None,"found_section":False}
+    window_blocks = []
+    for page_number, text in enumerate(window, start=1):
+        window_blocks.extend(
+            process_page(text, page_number, pdf_path, boilerplate, state)
+        )
+
+    if state["found_section"]:
+        yield from window_blocks
+        for page_number, text in enumerate(texts, start=rest_start):
+            yield from process_page(text, page_number, pdf_path, boilerplate, state)
+        return
+
+    window_blocks = list(iter_paragraph_blocks(enumerate(window, start=1), pdf_path))
+    if window_blocks:
+        yield from window_blocks
+        yield from iter_paragraph_blocks(enumerate(texts, start=rest_start), pdf_path)
+        return
+
+    yield from iter_fixed_size_blocks(chain(window, texts), pdf_path)
+
+
 def chunk_text(
     text: str,
     chunk_size: int = 180,
@@ -248,56 +519,135 @@ def chunk_section_blocks(section_blocks):
             global_chunk_id+=1
 
     return all_chunks
-def semantic_chunk_blocks(
+def attach_embedding(chunk, block_count, first_embedding, centroid_sum, reuse=REUSE_EMBEDDINGS):
+    """
+    Stores a reusable dense embedding on the chunk (chunk["embedding"],
+    outside metadata) so index_chunks can skip the second embed call.
+    """
+    if reuse == "single" and block_count == 1:
+        chunk["embedding"] = list(first_embedding)
+    elif reuse == "centroid":
+        norm = float(np.linalg.norm(centroid_sum))
+        centroid = centroid_sum / norm if norm else centroid_sum
+        chunk["embedding"] = centroid.tolist()
+    return chunk
+
+
+def embedding_matrix(embeddings):
+    """
+    returns: (E, En, norms) - float32 rows, L2-normalized rows, row norms
+    """
+    E = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(E, axis=1).astype(np.float64)
+    En = E / np.where(norms > 0, norms, 1.0)[:, None].astype(np.float32)
+    return E, En, norms
+
+
+def iter_semantic_chunks(
     blocks,
     max_tokens=800,
     min_tokens=200,
     sim_threshold=0.78,
-    batch_size=16
+    batch_size=16,
+    reuse=REUSE_EMBEDDINGS,
+    lookahead=SEMANTIC_LOOKAHEAD
 ):
-    chunks = []
+    """
+    Streaming semantic chunker: blocks are embedded batch_size at a time and
+    each chunk is yielded as soon as it is closed.
+
+    The centroid is kept as a running float64 sum of the merged block
+    vectors together with its squared norm. cosine(sum, e) == cosine(mean, e),
+    so merge decisions match averaging the vectors, and each similarity is one
+    dot product against the normalized float32 matrix of the batch.
+
+    lookahead: when > 0, the centroid's dot products with the next
+    `lookahead` blocks are computed in one matrix product and then updated
+    from the window's Gram matrix as blocks merge or a new chunk starts.
+    """
     current = []
     current_tokens = 0
-    current_emb = None
-    current_count = 0
+    current_sum = None
+    current_sq = 0.0
+    current_first = None
     global_chunk_id = 0
 
-    # 🔹 NEW: embed everything once
-    texts = [b["text"] for b in blocks]
-    embeddings = embed_batch(texts, batch_size=batch_size)
-
-    for block, emb in zip(blocks, embeddings):
-        tokens = len(block["text"].split())
+    for block_batch in batched(blocks, batch_size):
+        texts = [b["text"] for b in block_batch]
+        with timer("block_embed"):
+            embeddings = embed_batch(texts, batch_size=batch_size)
+        E, En, norms = embedding_matrix(embeddings)
+
+        window_start = window_end = 0
+        window_dots = window_gram = None
+
+        for i, block in enumerate(block_batch):
+            tokens = len(block["text"].split())
+
+            if current:
+                if lookahead > 0:
+                    if i >= window_end:
+                        window_start, window_end = i, min(i + lookahead, len(block_batch))
+                        win = En[window_start:window_end].astype(np.float64)
+                        window_dots = win @ current_sum
+                        window_gram = win @ E[window_start:window_end].astype(np.float64).T
+                    dot = window_dots[i - window_start]
+                else:
+                    dot = float(En[i] @ current_sum)
+
+                sim = dot / np.sqrt(current_sq)
+
+                if not (
+                    (sim < sim_threshold and current_tokens >= min_tokens)
+                    or current_tokens + tokens > max_tokens
+                ):
+                    current.append(block)
+                    current_sum += E[i]
+                    current_sq += 2.0 * dot * norms[i] + norms[i] ** 2
+                    current_tokens += tokens
+                    if lookahead > 0:
+                        window_dots += window_gram[:, i - window_start]
+                    continue
+
+                yield attach_embedding(
+                    build_chunk(current, global_chunk_id),
+                    len(current), current_first, current_sum, reuse
+                )
+                global_chunk_id += 1
 
-        if not current:
             current = [block]
-            current_emb = emb
-            current_count = 1
+            current_sum = E[i].astype(np.float64)
+            current_sq = norms[i] ** 2
+            current_first = embeddings[i]
             current_tokens = tokens
-            continue
-
-        sim = cosine_similarity(current_emb, emb)
-
-        if (
-            sim < sim_threshold and current_tokens >= min_tokens
-        ) or current_tokens + tokens > max_tokens:
-            chunks.append(build_chunk(current, global_chunk_id))
-            global_chunk_id += 1
-
-            current = [block]
-            current_emb = emb
-            current_count = 1
-            current_tokens = tokens
-        else:
-            current.append(block)
-            current_emb = update_centroid(current_emb, emb, current_count)
-            current_count += 1
-            current_tokens += tokens
+            if lookahead > 0 and i < window_end:
+                window_dots = window_gram[:, i - window_start].copy()
 
     if current:
-        chunks.append(build_chunk(current, global_chunk_id))
+        yield attach_embedding(
+            build_chunk(current, global_chunk_id),
+            len(current), current_first, current_sum, reuse
+        )
 
-    return chunks
+
+def semantic_chunk_blocks(
+    blocks,
+    max_tokens=800,
+    min_tokens=200,
+    sim_threshold=0.78,
+    batch_size=16,
+    reuse=REUSE_EMBEDDINGS,
+    lookahead=SEMANTIC_LOOKAHEAD
+):
+    return list(iter_semantic_chunks(
+        blocks,
+        max_tokens=max_tokens,
+        min_tokens=min_tokens,
+        sim_threshold=sim_threshold,
+        batch_size=batch_size,
+        reuse=reuse,
+        lookahead=lookahead
+    ))
 def build_chunk(blocks, global_chunk_id):
     text = "\n\n".join(b["text"] for b in blocks)
     meta = blocks[0]["metadata"]
@@ -329,38 +679,93 @@ def build_chunk(blocks, global_chunk_id):
     }
 
 
-def pdf_to_chunks(pdf_path: str):
-    reader = PdfReader(pdf_path)
-
-    section_blocks, has_sections = process_pdf(pdf_path)
-
-
-
-    paragraph_blocks = paragraph_blocks_from_pages(reader, pdf_path)
-
+def pdf_to_chunks(pdf_path: str, page_workers=None):
+    """
+    page_workers: process pool size for page-range sharding of this one
+                  document (defaults to PAGE_WORKERS)
+    """
+    if page_workers is None:
+        page_workers = PAGE_WORKERS
 
+    pages = PageTexts(PdfReader(pdf_path))
+    if page_workers > 1 and len(pages) >= 2 * SHARD_MIN_PAGES:
+        pages.extract_parallel(pdf_path, page_workers)
 
-    fixed_blocks = fixed_size_blocks(reader, pdf_path)
-    
-    blocks = section_blocks if has_sections else paragraph_blocks or fixed_blocks
+    section_blocks, has_sections = process_pdf(pdf_path, pages=pages)
+    if has_sections:
+        return section_blocks
 
-    return blocks
+    # fallbacks are only built when no section headings were found
+    return (
+        paragraph_blocks_from_pages(pages, pdf_path)
+        or fixed_size_blocks(pages, pdf_path)
+    )
 
 
 """fallback from section based to paragraph chunking or fixed size no regex bs === done
  better preprocessing maybe=
 """
-def chunk_multiple_pdfs(pdf_paths):
-    all_chunks = []
-
-    for pdf_path in pdf_paths:
-        blocks = pdf_to_chunks(pdf_path)
-        chunks = semantic_chunk_blocks(blocks)
+def parse_pdfs_parallel(pdf_paths, max_workers=None):
+    """
+    Parses and block-splits PDFs in a process pool.
+    Yields (position, pdf_path, blocks, error) as each document finishes.
+    """
+    with process_pool(max_workers) as pool:
+        futures = {
+            # one worker per document; no nested page-shard pools
+            pool.submit(pdf_to_chunks, pdf_path, 1): (pos, pdf_path)
+            for pos, pdf_path in enumerate(pdf_paths)
+        }
+        for future in as_completed(futures):
+            pos, pdf_path = futures[future]
+            try:
+                yield pos, pdf_path, future.result(), None
+            except Exception as e:
+                yield pos, pdf_path, None, e
+
+
+def _chunk_document(pdf_path, blocks):
+    chunks = semantic_chunk_blocks(blocks)
+    for c in chunks:
+        c["metadata"]["doc_id"] = pdf_path
+    return chunks
 
 
-        for c in chunks:
-            c["metadata"]["doc_id"] = pdf_path
+def chunk_multiple_pdfs(pdf_paths, workers=None, errors=None):
+    """
+    workers: process pool size for parsing (defaults to PARSE_WORKERS)
+    errors: optional list; when given, a failing document is recorded as
+            {"path", "error"} and skipped instead of aborting the batch
+    """
+    if workers is None:
+        workers = PARSE_WORKERS
+
+    if not workers or workers <= 1 or len(pdf_paths) < 2:
+        parsed = ((pos, p, None, None) for pos, p in enumerate(pdf_paths))
+    else:
+        parsed = parse_pdfs_parallel(pdf_paths, max_workers=workers)
+
+    per_doc = [[] for _ in pdf_paths]
+
+    # documents go to the embedding stage as soon as they are parsed;
+    # output order still follows pdf_paths
+    for pos, pdf_path, blocks, error in parsed:
+        if error is None:
+            try:
+                if blocks is None:
+                    blocks = pdf_to_chunks(pdf_path)
+                per_doc[pos] = _chunk_document(pdf_path, blocks)
+                continue
+            except Exception as e:
+                error = e
+
+        if errors is None:
+            raise error
+        print(f"chunk_multiple_pdfs: skipping {pdf_path}: {error}", flush=True)
+        errors.append({"path": pdf_path, "error": str(error)})
 
+    all_chunks = []
+    for chunks in per_doc:
         all_chunks.extend(chunks)
 
     return all_chunks
\ No newline at end of file
@@ -1,22 +1,149 @@
 import os
-from pinecone import Pinecone,ServerlessSpec
+import threading
+from pinecone import Pinecone,PineconeAsyncio,ServerlessSpec
 from dotenv import load_dotenv
 load_dotenv()
 INDEX_NAME = "contextforge"
+INDEX_DIMENSION = 1024  # llama-text-embed-v2 dim
+
+# "pinecone" (hosted) or "local" (in-process index under LOCAL_INDEX_PATH)
+INDEX_BACKEND = os.getenv("INDEX_BACKEND", "pinecone")
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "local_index")
+
+# Nothing here touches the network at import time: the client and the
+# index handle are created on first use and then shared.
+_lock = threading.RLock()
+_client = None
+_index = None
+# asyncio client and index for the async query path; False once set_client
+# or set_index replaced the sync side without an async twin
+_async_client = None
+_async_index = None
+
+
+def get_client():
+    """
+    Shared Pinecone client (used for inference as well as the index).
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = Pinecone(api_key=os.getenv("pc_key"))
+    return _client
+
+
+def set_client(client, async_client=False):
+    """
+    Replaces the shared client, e.g. with a stub in benchmarks or tests.
+    async_client: its asyncio counterpart; without one the async path runs
+                  the sync client on utils.run_blocking
+    """
+    global _client, _async_client
+    with _lock:
+        _client = client
+        _async_client = async_client
 
-pc = Pinecone(api_key=os.getenv("pc_key"))
 
 def ensure_index():
+    pc = get_client()
     if not pc.has_index(INDEX_NAME):
         pc.create_index(
             name=INDEX_NAME,
-            dimension=1024,              # llama-text-embed-v2 dim
+            dimension=INDEX_DIMENSION,
             metric="dotproduct",         # REQUIRED for sparse + dense
             spec=ServerlessSpec(
                 cloud="aws",
                 region="us-east-1"
             )
         )
+
+
+def get_local_index():
+    from local_index import LocalIndex
+    return LocalIndex(LOCAL_INDEX_PATH, dimension=INDEX_DIMENSION)
+
+
 def get_index():
-    ensure_index()
-    return pc.Index(INDEX_NAME)
+    """
+    Shared index handle for the configured backend; the first call checks
+    (or creates) the hosted index.
+    """
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                if INDEX_BACKEND == "local":
+                    _index = get_local_index()
+                else:
+                    ensure_index()
+                    _index = get_client().Index(INDEX_NAME)
+    return _index
+
+
+def set_index(index, async_index=False):
+    """
+    Replaces the shared index handle, e.g. with a stub or a LocalIndex.
+    async_index: as for set_client
+    """
+    global _index, _async_index
+    with _lock:
+        _index = index
+        _async_index = async_index
+
+
+def get_async_client():
+    """
+    Shared PineconeAsyncio client for inference on the async query path, or
+    None when the sync client was replaced without an async one. Created
+    inside the running event loop, whose connections it keeps.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = PineconeAsyncio(api_key=os.getenv("pc_key"))
+    return _async_client or None
+
+
+async def get_async_index():
+    """
+    asyncio handle of the hosted index, or None for the local backend and a
+    replaced index; callers then use get_index on utils.run_blocking.
+    """
+    global _async_index
+    if _async_index is None:
+        client = get_async_client()
+        if INDEX_BACKEND == "local" or client is None:
+            _async_index = False
+        else:
+            description = await client.describe_index(INDEX_NAME)
+            index = client.IndexAsyncio(host=description.host)
+            if _async_index is None:
+                _async_index = index
+            else:
+                # another request got there first
+                await index.close()
+    return _async_index or None
+
+
+async def close_async_client():
+    """
+    Closes the asyncio index and client, e.g. on server shutdown.
+    """
+    global _async_client, _async_index
+    # stubbed (False) handles stay replaced
+    if _async_index:
+        index, _async_index = _async_index, None
+        await index.close()
+    if _async_client:
+        client, _async_client = _async_client, None
+        await client.close()
+
+
+def warm_up():
+    """
+    Creates the client and index handle and makes one cheap data-plane call
+    so the first request finds a ready connection.
+    """
+    index = get_index()
+    index.describe_index_stats()
+    return index
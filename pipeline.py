@@ -0,0 +1,63 @@
+import queue
+import threading
+from itertools import islice
+
+_ITEM, _ERROR, _DONE = "item", "error", "done"
+
+
+def batched(iterable, n):
+    """
+    Groups an iterable into lists of at most n items.
+    """
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
+
+
+def bounded(iterable, maxsize=8, name="stage"):
+    """
+    Runs `iterable` in a background thread and hands its items over through
+    a bounded queue.
+
+    The producer blocks while the queue is full (backpressure), exceptions
+    are re-raised on the consumer side, and closing the consumer stops the
+    producer at its next item.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(kind, value):
+        while not stop.is_set():
+            try:
+                q.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(_ITEM, item):
+                    return
+        except BaseException as e:
+            put(_ERROR, e)
+            return
+        put(_DONE, None)
+
+    thread = threading.Thread(target=produce, name=f"pipeline-{name}", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            kind, value = q.get()
+            if kind == _DONE:
+                return
+            if kind == _ERROR:
+                raise value
+            yield value
+    finally:
+        stop.set()
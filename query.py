@@ -1,5 +1,26 @@
-from retrieval import hybrid_search,needs_global_context,assemble_chunks,is_answerable
-from answering import rewrite_with_llm,format_citations
+import time
+from contextlib import aclosing
+
+from retrieval import hybrid_search,hybrid_search_async,needs_global_context,select_chunks,is_answerable
+from answering import rewrite_with_llm,rewrite_with_llm_async,stream_llm,format_citations
+from query_cache import get_query_cache, query_cache_key
+from singleflight import SingleFlight, AsyncSingleFlight
+from utils import run_blocking
+
+# identical concurrent questions share one pipeline run
+_query_flight = SingleFlight()
+_async_query_flight = AsyncSingleFlight()
+
+NOT_ANSWERABLE = {
+    "answer": "The uploaded documents do not contain enough information to answer this question.",
+    "citations": [],
+    "context": "",
+}
+NO_CONTEXT = {
+    "answer": "The retrieved documents do not contain enough information to answer this question.",
+    "citations": [],
+}
+
 def is_answerable(results, min_abs_score=0.3):
     """
     Checks whether the top retrieved chunk is sufficiently relevant
@@ -14,30 +35,47 @@ def is_answerable(results, min_abs_score=0.3):
 def answer_query(
     question: str,
     doc_ids: list[str] | None = None,
+    tenant: str | None = None,
 ):
+    cache = get_query_cache()
+    if cache is not None:
+        cached = cache.get(question, doc_ids, tenant)
+        if cached is not None:
+            return cached
+
+    def run():
+        # an ingest that invalidates a covered document while this runs
+        # keeps the answer out of the cache
+        started = time.time()
+        result = _answer_query(question, doc_ids, tenant)
+        if cache is not None:
+            cache.put(question, doc_ids, result, tenant, started_at=started)
+        return result
+
+    return dict(_query_flight.do(query_cache_key(question, doc_ids, tenant), run))
+
+
+def _answer_query(question, doc_ids, tenant=None):
+    stats = {}
     results = hybrid_search(
         query=question,
-        doc_ids=doc_ids
+        doc_ids=doc_ids,
+        stats=stats,
+        tenant=tenant
     )
     if not is_answerable(results):
-        return {
-            "answer": "The uploaded documents do not contain enough information to answer this question.",
-            "citations": [],
-            "context": "",
-        }
+        return dict(NOT_ANSWERABLE)
 
     allow_multi = needs_global_context(question)
 
-    context, sources = assemble_chunks(
+    context, sources = select_chunks(
         results,
-        allow_multi_section=allow_multi
+        allow_multi_section=allow_multi,
+        stats=stats
     )
 
     if not context:
-        return {
-            "answer": "The retrieved documents do not contain enough information to answer this question.",
-            "citations": [],
-        }
+        return dict(NO_CONTEXT)
 
     answer = rewrite_with_llm(context, question)
     citations = format_citations(sources)
@@ -47,3 +85,124 @@ def answer_query(
         "citations": citations,
         "context":context
     }
+
+
+async def answer_query_async(
+    question: str,
+    doc_ids: list[str] | None = None,
+    tenant: str | None = None,
+):
+    cache = get_query_cache()
+    if cache is not None:
+        cached = cache.get(question, doc_ids, tenant)
+        if cached is not None:
+            return cached
+
+    async def run():
+        started = time.time()
+        result = await _answer_query_async(question, doc_ids, tenant)
+        if cache is not None:
+            cache.put(question, doc_ids, result, tenant, started_at=started)
+        return result
+
+    return dict(await _async_query_flight.do(query_cache_key(question, doc_ids, tenant), run))
+
+
+async def _answer_query_async(question, doc_ids, tenant=None):
+    stats = {}
+    results = await hybrid_search_async(
+        query=question,
+        doc_ids=doc_ids,
+        stats=stats,
+        tenant=tenant
+    )
+    if not is_answerable(results):
+        return dict(NOT_ANSWERABLE)
+
+    allow_multi = needs_global_context(question)
+
+    # context compression embeds spans, so it runs off the event loop
+    context, sources = await run_blocking(
+        select_chunks,
+        results,
+        allow_multi_section=allow_multi,
+        stats=stats
+    )
+
+    if not context:
+        return dict(NO_CONTEXT)
+
+    answer = await rewrite_with_llm_async(context, question)
+    citations = format_citations(sources)
+
+    return {
+        "answer": answer,
+        "citations": citations,
+        "context":context
+    }
+
+
+async def stream_answer_query(
+    question: str,
+    doc_ids: list[str] | None = None,
+    tenant: str | None = None,
+):
+    """
+    Yields (event, data) pairs:
+      ("meta", {"citations", "context"}) as soon as retrieval is done,
+      ("token", str) for each piece of the answer,
+      ("done", {"answer"}) once the full answer is known.
+    """
+    started = time.time()
+    cache = get_query_cache()
+    cached = cache.get(question, doc_ids, tenant) if cache is not None else None
+    if cached is not None:
+        yield "meta", {"citations": cached["citations"], "context": cached.get("context", "")}
+        yield "token", cached["answer"]
+        yield "done", {"answer": cached["answer"]}
+        return
+
+    stats = {}
+    results = await hybrid_search_async(
+        query=question,
+        doc_ids=doc_ids,
+        stats=stats,
+        tenant=tenant
+    )
+
+    if not is_answerable(results):
+        result = dict(NOT_ANSWERABLE)
+    else:
+        context, sources = await run_blocking(
+            select_chunks,
+            results,
+            allow_multi_section=needs_global_context(question),
+            stats=stats
+        )
+        result = None if context else dict(NO_CONTEXT)
+
+    if result is not None:
+        if cache is not None:
+            cache.put(question, doc_ids, result, tenant, started_at=started)
+        yield "meta", {"citations": [], "context": ""}
+        yield "token", result["answer"]
+        yield "done", {"answer": result["answer"]}
+        return
+
+    citations = format_citations(sources)
+    yield "meta", {"citations": citations, "context": context}
+
+    parts = []
+    async with aclosing(stream_llm(context, question)) as tokens:
+        async for token in tokens:
+            parts.append(token)
+            yield "token", token
+
+    answer = "".join(parts).strip()
+    if cache is not None:
+        cache.put(question, doc_ids, {
+            "answer": answer,
+            "citations": citations,
+            "context": context
+        }, tenant, started_at=started)
+    yield "done", {"answer": answer}
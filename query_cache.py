@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import inc, CACHE_HITS, CACHE_MISSES
+
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE", "1") != "0"
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "512"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "600"))
+# optional SQLite file shared by every worker process on the host
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "")
+
+# scope of a question asked without doc_ids: it touches every document
+ALL_DOCS = "*"
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def query_scope(doc_ids):
+    return tuple(sorted(set(doc_ids))) if doc_ids else (ALL_DOCS,)
+
+
+def query_cache_key(question: str, doc_ids, tenant=None) -> str:
+    parts = [normalize_question(question), query_scope(doc_ids)]
+    if tenant:
+        parts.append(tenant)
+    raw = json.dumps(parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """
+    LRU + TTL cache of full query results (answer, citations, context),
+    keyed on the normalized question and the sorted doc_ids.
+
+    invalidate_doc(doc_id) drops every entry scoped to that document and
+    every unscoped entry. With a path, entries and invalidations are also
+    written to SQLite so other processes share them; a memory hit is only
+    served if no covered document was invalidated after it was stored.
+
+    put(..., started_at=) is skipped when a covered document was invalidated
+    after the query started, so an answer computed over a revision that an
+    ingest has since replaced is never stored.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, path=QUERY_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (created_at, expires_at, scope, result)
+        self._entries = OrderedDict()
+        # doc_id (or ALL_DOCS) -> keys scoped to it
+        self._by_doc = {}
+        # doc_id -> time of its last invalidation in this process; any
+        # invalidation touches unscoped entries
+        self._invalidated = {}
+        self._any_invalidated = 0.0
+
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache ("
+                " key TEXT PRIMARY KEY,"
+                " created_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " scope TEXT NOT NULL,"
+                " result TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache_docs ("
+                " doc_id TEXT NOT NULL,"
+                " key TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS query_cache_docs_doc"
+                " ON query_cache_docs (doc_id)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache_invalidations ("
+                " doc_id TEXT PRIMARY KEY,"
+                " invalidated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    # ---- memory ----
+
+    def _remember(self, key, created_at, expires_at, scope, result):
+        self._forget(key)
+        self._entries[key] = (created_at, expires_at, scope, result)
+        for doc_id in scope:
+            self._by_doc.setdefault(doc_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._forget(next(iter(self._entries)))
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for doc_id in entry[2]:
+            keys = self._by_doc.get(doc_id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._by_doc[doc_id]
+
+    # ---- shared store ----
+
+    def _invalidated_since(self, scope, created_at) -> bool:
+        if ALL_DOCS in scope:
+            row = self._conn.execute(
+                "SELECT 1 FROM query_cache_invalidations"
+                " WHERE invalidated_at >= ? LIMIT 1",
+                (created_at,)
+            ).fetchone()
+        else:
+            marks = ",".join("?" * len(scope))
+            row = self._conn.execute(
+                "SELECT 1 FROM query_cache_invalidations"
+                f" WHERE invalidated_at >= ? AND doc_id IN ({marks}) LIMIT 1",
+                (created_at, *scope)
+            ).fetchone()
+        return row is not None
+
+    def _load(self, key, now):
+        row = self._conn.execute(
+            "SELECT created_at, expires_at, scope, result FROM query_cache"
+            " WHERE key = ? AND expires_at > ?",
+            (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        created_at, expires_at, scope, result = row
+        return created_at, expires_at, tuple(json.loads(scope)), json.loads(result)
+
+    # ---- API ----
+
+    def get(self, question: str, doc_ids=None, tenant=None):
+        key = query_cache_key(question, doc_ids, tenant)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._conn is not None:
+                entry = self._load(key, now)
+                if entry is not None:
+                    self._remember(key, *entry)
+
+            if entry is None:
+                inc(CACHE_MISSES, cache="query")
+                return None
+
+            created_at, expires_at, scope, result = entry
+            if expires_at <= now or (
+                self._conn is not None and self._invalidated_since(scope, created_at)
+            ):
+                self._forget(key)
+                inc(CACHE_MISSES, cache="query")
+                return None
+
+            self._entries.move_to_end(key)
+            inc(CACHE_HITS, cache="query")
+            return dict(result)
+
+    def _stale_since(self, scope, started_at) -> bool:
+        if ALL_DOCS in scope:
+            stale = self._any_invalidated >= started_at
+        else:
+            stale = any(self._invalidated.get(d, 0.0) >= started_at for d in scope)
+        return stale or (
+            self._conn is not None and self._invalidated_since(scope, started_at)
+        )
+
+    def put(self, question: str, doc_ids, result: dict, tenant=None, started_at=None):
+        """
+        started_at: time.time() when the query began; the result is dropped
+                    if a covered document was invalidated since
+        returns: whether the result was stored
+        """
+        key = query_cache_key(question, doc_ids, tenant)
+        scope = query_scope(doc_ids)
+        now = time.time()
+        expires_at = now + self.ttl
+        created_at = now if started_at is None else started_at
+
+        with self._lock:
+            if started_at is not None and self._stale_since(scope, started_at):
+                return False
+            self._remember(key, created_at, expires_at, scope, dict(result))
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO query_cache"
+                    " (key, created_at, expires_at, scope, result)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, created_at, expires_at, json.dumps(scope), json.dumps(result))
+                )
+                self._conn.execute("DELETE FROM query_cache_docs WHERE key = ?", (key,))
+                self._conn.executemany(
+                    "INSERT INTO query_cache_docs (doc_id, key) VALUES (?, ?)",
+                    [(doc_id, key) for doc_id in scope]
+                )
+                self._conn.execute("DELETE FROM query_cache WHERE expires_at <= ?", (now,))
+                self._conn.commit()
+            return True
+
+    def invalidate_doc(self, doc_id: str) -> int:
+        """
+        Drops every entry that touches doc_id; returns how many were in memory.
+        """
+        with self._lock:
+            now = time.time()
+            self._invalidated[doc_id] = now
+            self._any_invalidated = now
+            keys = self._by_doc.get(doc_id, set()) | self._by_doc.get(ALL_DOCS, set())
+            for key in list(keys):
+                self._forget(key)
+
+            if self._conn is not None:
+                keys_sql = (
+                    "SELECT key FROM query_cache_docs WHERE doc_id IN (?, ?)"
+                )
+                self._conn.execute(
+                    f"DELETE FROM query_cache WHERE key IN ({keys_sql})",
+                    (doc_id, ALL_DOCS)
+                )
+                self._conn.execute(
+                    f"DELETE FROM query_cache_docs WHERE key IN ({keys_sql})",
+                    (doc_id, ALL_DOCS)
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO query_cache_invalidations"
+                    " (doc_id, invalidated_at) VALUES (?, ?)",
+                    (doc_id, now)
+                )
+                self._conn.commit()
+
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_doc.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM query_cache")
+                self._conn.execute("DELETE FROM query_cache_docs")
+                self._conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache():
+    """
+    Shared cache instance, or None when QUERY_CACHE=0.
+    """
+    global _cache
+    if not QUERY_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = QueryCache()
+    return _cache
+
+
+def invalidate_doc(doc_id: str) -> int:
+    cache = get_query_cache()
+    return cache.invalidate_doc(doc_id) if cache else 0
@@ -1,48 +1,487 @@
-from pinecone_client import get_index, pc
+import asyncio
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from pinecone_client import get_index, get_client, get_async_index, get_async_client
+from utils import (
+    embed_texts, embed_texts_async, with_retry, with_retry_async, run_blocking,
+    safe_int, DENSE_MODEL, SPARSE_MODEL
+)
+from bm25 import use_bm25
+from namespaces import namespaces_for_query, lexical_index_for, SHARED_NAMESPACE
+from metrics import timer
+
+RERANK_MODEL = "bge-reranker-v2-m3"
+# reciprocal rank fusion constant for dense + BM25 candidates
+RRF_K = 60
+
+# "fixed" reranks rerank_k candidates; "adaptive" reranks a head of
+# RERANK_HEAD and widens only while the ranking looks ambiguous
+RERANK_MODE = os.getenv("RERANK_MODE", "fixed")
+RERANK_HEAD = int(os.getenv("RERANK_HEAD", "8"))
+RERANK_MIN_GAP = float(os.getenv("RERANK_MIN_GAP", "0.05"))
+# widen while the lowest rerank score in the window is still at least this
+# share of the top rerank score
+RERANK_WIDEN_RATIO = float(os.getenv("RERANK_WIDEN_RATIO", "0.8"))
+
+# "assemble" keeps assemble_chunks; "pack" fills CONTEXT_TOKEN_BUDGET with
+# deduplicated, merged passages
+CONTEXT_MODE = os.getenv("CONTEXT_MODE", "assemble")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# passages whose word shingles overlap a kept passage this much are dropped
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.8"))
+SHINGLE_SIZE = 5
+# longest chunk overlap trimmed when adjacent chunks are merged
+MAX_OVERLAP_WORDS = 60
+
+# extractive compression of the selected context (CONTEXT_COMPRESSION=1)
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "0") == "1"
+# share of context tokens kept
+COMPRESS_RATIO = float(os.getenv("COMPRESS_RATIO", "0.5"))
+# contexts shorter than this are passed through untouched
+COMPRESS_MIN_TOKENS = int(os.getenv("COMPRESS_MIN_TOKENS", "200"))
+COMPRESS_MIN_SENTENCES = 3
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+
+# namespaces one query searches at the same time
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "8"))
+_fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+
+
+def embed_query(query: str):
+    with timer("query_embed"):
+        dense_q = embed_texts(DENSE_MODEL, [query], "query")[0]
+
+        # the BM25 backend scores the lexical side locally
+        if use_bm25():
+            return dense_q, None
+
+        sparse_q = embed_texts(SPARSE_MODEL, [query], "query")[0]
+
+    return dense_q, sparse_q
+
+
+async def embed_query_async(query: str):
+    """
+    Issues the dense and sparse query embeddings concurrently.
+    """
+    with timer("query_embed"):
+        if use_bm25():
+            dense = await embed_texts_async(DENSE_MODEL, [query], "query")
+            return dense[0], None
+
+        dense, sparse = await asyncio.gather(
+            embed_texts_async(DENSE_MODEL, [query], "query"),
+            embed_texts_async(SPARSE_MODEL, [query], "query"),
+        )
+    return dense[0], sparse[0]
 
-index = get_index()
 
+def fuse_rrf(*rankings, k=RRF_K):
+    """
+    rankings: lists of ids, best first
+    returns: (id, reciprocal rank fusion score) pairs, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
 
-def hybrid_search(
+
+def rerank_matches(query: str, matches, top_n):
+    """
+    Reranks index matches on chunk_text; returns them best first with the
+    rerank score as "score".
+    """
+    if not matches:
+        return []
+    with timer("rerank"):
+        res = with_retry(
+            get_client().inference.rerank,
+            model=RERANK_MODEL,
+            query=query,
+            documents=rerank_documents(matches),
+            rank_fields=["chunk_text"],
+            top_n=min(top_n, len(matches)),
+            return_documents=False
+        )
+    return [{**matches[r.index], "score": r.score} for r in res.data]
+
+
+def rerank_documents(matches):
+    return [{"id": m["id"], "chunk_text": m["metadata"]["chunk_text"]} for m in matches]
+
+
+async def rerank_matches_async(query: str, matches, top_n):
+    """
+    rerank_matches over the asyncio client.
+    """
+    if not matches:
+        return []
+    client = get_async_client()
+    if client is None:
+        return await run_blocking(rerank_matches, query, matches, top_n)
+    with timer("rerank"):
+        res = await with_retry_async(
+            client.inference.rerank,
+            model=RERANK_MODEL,
+            query=query,
+            documents=rerank_documents(matches),
+            rank_fields=["chunk_text"],
+            top_n=min(top_n, len(matches)),
+            return_documents=False
+        )
+    return [{**matches[r.index], "score": r.score} for r in res.data]
+
+
+def bm25_candidates(query: str, dense_q, doc_ids=None, dense_k=50, limit=50, namespace=SHARED_NAMESPACE):
+    """
+    Dense candidates from the index and BM25 candidates from the local
+    lexical index, fused with RRF; "score" is the fused score.
+    """
+    filter_clause = {"doc_id": {"$in": doc_ids}} if doc_ids else None
+
+    index = get_index()
+    with timer("hybrid_query"):
+        dense = index.query(
+            namespace=namespace,
+            top_k=dense_k,
+            vector=dense_q["values"],
+            filter=filter_clause,
+            include_metadata=True
+        )
+        lexical = lexical_index_for(namespace).search(query, top_k=dense_k, doc_ids=doc_ids)
+
+        by_id, fused = fuse_candidates(dense, lexical, limit)
+        # lexical-only hits still need their metadata for rerank and citations
+        missing = [i for i, _ in fused if i not in by_id]
+        if missing:
+            add_fetched(by_id, index.fetch(ids=missing, namespace=namespace))
+
+    return [{**by_id[i], "score": score} for i, score in fused if i in by_id]
+
+
+async def bm25_candidates_async(index, query: str, dense_q, doc_ids=None, dense_k=50, limit=50, namespace=SHARED_NAMESPACE):
+    """
+    bm25_candidates over an asyncio index; BM25 scoring runs on the
+    blocking pool while the dense query is in flight.
+    """
+    filter_clause = {"doc_id": {"$in": doc_ids}} if doc_ids else None
+
+    with timer("hybrid_query"):
+        dense, lexical = await asyncio.gather(
+            index.query(
+                namespace=namespace,
+                top_k=dense_k,
+                vector=dense_q["values"],
+                filter=filter_clause,
+                include_metadata=True
+            ),
+            run_blocking(
+                lambda: lexical_index_for(namespace).search(query, top_k=dense_k, doc_ids=doc_ids)
+            )
+        )
+
+        by_id, fused = fuse_candidates(dense, lexical, limit)
+        missing = [i for i, _ in fused if i not in by_id]
+        if missing:
+            add_fetched(by_id, await index.fetch(ids=missing, namespace=namespace))
+
+    return [{**by_id[i], "score": score} for i, score in fused if i in by_id]
+
+
+def fuse_candidates(dense, lexical, limit):
+    """
+    returns: (dense matches by id, RRF-fused (id, score) pairs)
+    """
+    by_id = {m["id"]: m for m in dense["matches"]}
+    fused = fuse_rrf(
+        [m["id"] for m in dense["matches"]],
+        [chunk_id for chunk_id, _ in lexical]
+    )[:limit]
+    return by_id, fused
+
+
+def add_fetched(by_id, fetched):
+    for vid, v in fetched["vectors"].items():
+        by_id[vid] = {"id": vid, "metadata": v["metadata"]}
+
+
+def first_stage_candidates(
     query: str,
-    doc_ids: list[str] | None = None,
-    dense_k: int = 50,
-    rerank_k: int = 50,
-    final_k: int = 5
+    dense_q,
+    sparse_q,
+    doc_ids=None,
+    dense_k=50,
+    limit=50,
+    namespace=SHARED_NAMESPACE
 ):
-    # ---- Embed query (dense + sparse) ----
-    dense_q = pc.inference.embed(
-        model="llama-text-embed-v2",
-        inputs=query,
-        parameters={"input_type": "query", "truncate": "END"}
-    )[0]
-
-    sparse_q = pc.inference.embed(
-        model="pinecone-sparse-english-v0",
-        inputs=query,
-        parameters={"input_type": "query", "truncate": "END"}
-    )[0]
+    """
+    Hybrid candidates in first-stage order, before any rerank.
+    """
+    if sparse_q is None:
+        return bm25_candidates(query, dense_q, doc_ids, dense_k, limit, namespace)
 
     filter_clause = {"doc_id": {"$in": doc_ids}} if doc_ids else None
+    with timer("hybrid_query"):
+        results = get_index().query(
+            namespace=namespace,
+            top_k=dense_k,
+            vector=dense_q["values"],
+            sparse_vector={
+                "indices": sparse_q["sparse_indices"],
+                "values": sparse_q["sparse_values"]
+            },
+            filter=filter_clause,
+            include_metadata=True
+        )
+    return list(results["matches"])[:limit]
 
-    # ---- Hybrid search ----
-    results = index.query(
-        namespace="ns1",  # no fixed namespace
-        top_k=dense_k,
-        vector=dense_q["values"],
-        sparse_vector={
-            "indices": sparse_q["sparse_indices"],
-            "values": sparse_q["sparse_values"]
-        },
-        filter=filter_clause,
-        rerank={
-            "model": "bge-reranker-v2-m3",
-            "top_n": rerank_k,
-            "rank_fields": ["chunk_text"]
-        },
-        include_metadata=True
+
+async def first_stage_candidates_async(
+    query: str,
+    dense_q,
+    sparse_q,
+    doc_ids=None,
+    dense_k=50,
+    limit=50,
+    namespace=SHARED_NAMESPACE
+):
+    """
+    first_stage_candidates over the asyncio index handle.
+    """
+    index = await get_async_index()
+    if index is None:
+        return await run_blocking(
+            first_stage_candidates, query, dense_q, sparse_q, doc_ids, dense_k, limit, namespace
+        )
+    if sparse_q is None:
+        return await bm25_candidates_async(index, query, dense_q, doc_ids, dense_k, limit, namespace)
+
+    filter_clause = {"doc_id": {"$in": doc_ids}} if doc_ids else None
+    with timer("hybrid_query"):
+        results = await index.query(
+            namespace=namespace,
+            top_k=dense_k,
+            vector=dense_q["values"],
+            sparse_vector={
+                "indices": sparse_q["sparse_indices"],
+                "values": sparse_q["sparse_values"]
+            },
+            filter=filter_clause,
+            include_metadata=True
+        )
+    return list(results["matches"])[:limit]
+
+
+def head_is_ambiguous(reranked, candidates, depth):
+    """
+    reranked: rerank results so far, best first
+    candidates: first-stage candidates, best first
+    depth: how many candidates have been reranked
+
+    Ambiguous when the reranked leaders are within RERANK_MIN_GAP of each
+    other, or when rerank scores have not dropped off by the edge of the
+    window (the next candidates could still be relevant). Only rerank
+    scores are compared; first-stage scores (RRF or dot products) are not
+    on a comparable scale.
+    """
+    if depth >= len(candidates) or not reranked:
+        return False
+    if not rerank_gap([(m["score"], None, None) for m in reranked], RERANK_MIN_GAP):
+        return True
+    top = reranked[0]["score"]
+    return top > 0 and reranked[-1]["score"] >= RERANK_WIDEN_RATIO * top
+
+
+def adaptive_rerank(query: str, candidates, rerank_k=50, min_depth=5, stats=None):
+    """
+    Reranks a head of the candidates and doubles the window, reranking
+    only the new candidates, while head_is_ambiguous says so.
+    """
+    limit = min(rerank_k, len(candidates))
+    depth = min(max(RERANK_HEAD, min_depth), limit)
+    reranked = rerank_matches(query, candidates[:depth], depth)
+    calls = 1
+
+    while depth < limit and head_is_ambiguous(reranked, candidates, depth):
+        wider = min(depth * 2, limit)
+        reranked = sorted(
+            reranked + rerank_matches(query, candidates[depth:wider], wider - depth),
+            key=lambda m: m["score"],
+            reverse=True
+        )
+        depth = wider
+        calls += 1
+
+    if stats is not None:
+        stats.update(
+            rerank_mode="adaptive",
+            candidates=len(candidates),
+            rerank_depth=depth,
+            rerank_calls=calls,
+            widened=calls > 1
+        )
+    return reranked
+
+
+async def adaptive_rerank_async(query: str, candidates, rerank_k=50, min_depth=5, stats=None):
+    limit = min(rerank_k, len(candidates))
+    depth = min(max(RERANK_HEAD, min_depth), limit)
+    reranked = await rerank_matches_async(query, candidates[:depth], depth)
+    calls = 1
+
+    while depth < limit and head_is_ambiguous(reranked, candidates, depth):
+        wider = min(depth * 2, limit)
+        reranked = sorted(
+            reranked + await rerank_matches_async(query, candidates[depth:wider], wider - depth),
+            key=lambda m: m["score"],
+            reverse=True
+        )
+        depth = wider
+        calls += 1
+
+    if stats is not None:
+        stats.update(
+            rerank_mode="adaptive",
+            candidates=len(candidates),
+            rerank_depth=depth,
+            rerank_calls=calls,
+            widened=calls > 1
+        )
+    return reranked
+
+
+def search_index(
+    query: str,
+    dense_q,
+    sparse_q,
+    doc_ids=None,
+    dense_k=50,
+    rerank_k=50,
+    final_k=5,
+    stats=None,
+    namespace=SHARED_NAMESPACE
+):
+    """
+    First-stage candidates from one namespace, reranked through the
+    inference API (rerank_candidates). Index.query has no rerank option,
+    so every backend reranks the same way.
+    """
+    candidates = first_stage_candidates(
+        query, dense_q, sparse_q, doc_ids, dense_k, rerank_k, namespace
     )
+    return {"matches": rerank_candidates(query, candidates, rerank_k, final_k, stats)}
+
+
+def rerank_candidates(query: str, candidates, rerank_k=50, final_k=5, stats=None):
+    """
+    Second stage over merged first-stage candidates: adaptive_rerank, or
+    one rerank of the top rerank_k in fixed mode.
+    """
+    if RERANK_MODE == "adaptive":
+        return adaptive_rerank(query, candidates, rerank_k, final_k, stats)
+    head = candidates[:rerank_k]
+    matches = rerank_matches(query, head, rerank_k)
+    if stats is not None:
+        stats.update(
+            rerank_mode="fixed",
+            rerank_depth=len(head),
+            rerank_calls=1 if head else 0,
+            widened=False
+        )
+    return matches
+
+
+async def rerank_candidates_async(query: str, candidates, rerank_k=50, final_k=5, stats=None):
+    if RERANK_MODE == "adaptive":
+        return await adaptive_rerank_async(query, candidates, rerank_k, final_k, stats)
+    head = candidates[:rerank_k]
+    matches = await rerank_matches_async(query, head, rerank_k)
+    if stats is not None:
+        stats.update(
+            rerank_mode="fixed",
+            rerank_depth=len(head),
+            rerank_calls=1 if head else 0,
+            widened=False
+        )
+    return matches
+
+
+def search_namespaces(
+    query: str,
+    dense_q,
+    sparse_q,
+    targets,
+    dense_k=50,
+    rerank_k=50,
+    final_k=5,
+    stats=None
+):
+    """
+    targets: (namespace, doc_ids) pairs from namespaces_for_query
+
+    Fetches first-stage candidates from the target namespaces concurrently,
+    merges them by first-stage score and reranks the merged top rerank_k
+    once, so the rerank cost does not grow with the number of namespaces.
+    """
+    if not targets:
+        return {"matches": []}
+    if len(targets) == 1:
+        namespace, ids = targets[0]
+        return search_index(
+            query, dense_q, sparse_q, ids, dense_k, rerank_k, final_k, stats, namespace
+        )
+
+    futures = [
+        _fanout_pool.submit(
+            first_stage_candidates, query, dense_q, sparse_q, ids, dense_k, rerank_k, namespace
+        )
+        for namespace, ids in targets
+    ]
+    candidates = []
+    for f in futures:
+        candidates.extend(f.result())
+    candidates.sort(key=lambda m: m["score"], reverse=True)
+
+    if stats is not None:
+        stats["namespaces"] = len(targets)
+    return {"matches": rerank_candidates(query, candidates, rerank_k, final_k, stats)}
 
+
+async def search_namespaces_async(
+    query: str,
+    dense_q,
+    sparse_q,
+    targets,
+    dense_k=50,
+    rerank_k=50,
+    final_k=5,
+    stats=None
+):
+    """
+    search_namespaces with the first-stage queries awaited together.
+    """
+    if not targets:
+        return {"matches": []}
+
+    results = await asyncio.gather(*(
+        first_stage_candidates_async(query, dense_q, sparse_q, ids, dense_k, rerank_k, namespace)
+        for namespace, ids in targets
+    ))
+    candidates = [m for matches in results for m in matches]
+    if len(targets) > 1:
+        candidates.sort(key=lambda m: m["score"], reverse=True)
+        if stats is not None:
+            stats["namespaces"] = len(targets)
+    return {"matches": await rerank_candidates_async(query, candidates, rerank_k, final_k, stats)}
+
+
+def format_matches(results, final_k=5):
     matches = results["matches"]
 
     formatted = [
@@ -57,6 +496,57 @@ def hybrid_search(
     return formatted
 
 
+def hybrid_search(
+    query: str,
+    doc_ids: list[str] | None = None,
+    dense_k: int = 50,
+    rerank_k: int = 50,
+    final_k: int = 5,
+    stats: dict | None = None,
+    tenant: str | None = None
+):
+    """
+    stats: optional dict filled with per-query rerank details
+           (rerank_mode, rerank_depth, rerank_calls, widened) and the
+           dense query_vector
+    tenant: selects the namespaces searched, see namespaces.py
+    """
+    # ---- Embed query (dense + sparse) ----
+    dense_q, sparse_q = embed_query(query)
+    if stats is not None:
+        stats["query_vector"] = dense_q["values"]
+
+    # ---- Hybrid search, fanned out over the target namespaces ----
+    results = search_namespaces(
+        query, dense_q, sparse_q, namespaces_for_query(doc_ids, tenant),
+        dense_k, rerank_k, final_k, stats
+    )
+
+    return format_matches(results, final_k)
+
+
+async def hybrid_search_async(
+    query: str,
+    doc_ids: list[str] | None = None,
+    dense_k: int = 50,
+    rerank_k: int = 50,
+    final_k: int = 5,
+    stats: dict | None = None,
+    tenant: str | None = None
+):
+    dense_q, sparse_q = await embed_query_async(query)
+    if stats is not None:
+        stats["query_vector"] = dense_q["values"]
+
+    # served from the namespace list cache, refreshed through the sync index
+    targets = await run_blocking(namespaces_for_query, doc_ids, tenant)
+    results = await search_namespaces_async(
+        query, dense_q, sparse_q, targets, dense_k, rerank_k, final_k, stats
+    )
+
+    return format_matches(results, final_k)
+
+
 # =========================
 # 🔴 ADDED: RETRIEVAL SIGNAL ANALYSIS
 # =========================
@@ -152,6 +642,281 @@ def assemble_chunks(
     return assembled_text.strip(), used_sources
 
 
+# =========================
+# CONTEXT PACKING
+# =========================
+
+def shingles(words, size=SHINGLE_SIZE):
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def shingle_similarity(a, b) -> float:
+    """
+    Share of the smaller passage's shingles found in the other one, so a
+    passage contained in a longer one counts as a duplicate.
+    """
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def overlap_length(prev_words, next_words, max_words=MAX_OVERLAP_WORDS) -> int:
+    """
+    Longest suffix of prev_words that is also a prefix of next_words.
+    """
+    for n in range(min(max_words, len(prev_words), len(next_words)), 0, -1):
+        if prev_words[-n:] == next_words[:n]:
+            return n
+    return 0
+
+
+def chunk_position(meta):
+    return meta.get("doc_id") or meta.get("source"), meta.get("global_chunk_id")
+
+
+def pack_passages(
+    results,
+    token_budget=CONTEXT_TOKEN_BUDGET,
+    allow_multi_section=False,
+    min_score_ratio=0.6,
+    duplicate_threshold=DUPLICATE_THRESHOLD,
+    stats=None
+):
+    """
+    results: list of (score, text, metadata), sorted desc
+    returns: list of spans {"score", "pieces": [(text, metadata)]}, best first
+
+    Passages are taken by score until token_budget (whitespace tokens) is
+    spent. Near-duplicates of a kept passage are dropped, and chunks with
+    consecutive global_chunk_ids from the same document are merged into one
+    span with their shared overlap removed.
+    """
+    if not results:
+        return []
+
+    top_score = results[0][0]
+    kept = []
+    kept_shingles = []
+    kept_at = {}
+    tokens_in = 0
+    duplicates = 0
+    used = 0
+
+    for score, text, meta in results:
+        if score < top_score * min_score_ratio:
+            break
+        words = text.split()
+        tokens_in += len(words)
+
+        sh = shingles([w.lower() for w in words])
+        if any(shingle_similarity(sh, other) >= duplicate_threshold for other in kept_shingles):
+            duplicates += 1
+            continue
+
+        # words shared with an already kept neighbour are merged away
+        doc, chunk_id = chunk_position(meta)
+        cost = len(words)
+        if chunk_id is not None:
+            before = kept_at.get((doc, safe_int(chunk_id) - 1))
+            after = kept_at.get((doc, safe_int(chunk_id) + 1))
+            if before is not None:
+                cost -= overlap_length(before, words)
+            if after is not None:
+                cost -= overlap_length(words, after)
+
+        remaining = token_budget - used
+        if cost > remaining:
+            if kept:
+                continue
+            # the best passage alone is over budget: keep its head
+            words = words[:remaining]
+
+        kept.append((score, words, meta))
+        kept_shingles.append(sh)
+        if chunk_id is not None:
+            kept_at[(doc, safe_int(chunk_id))] = words
+        used += min(cost, len(words))
+
+        if not allow_multi_section or used >= token_budget:
+            break
+
+    # ---- merge consecutive chunks of a document ----
+    by_position = sorted(
+        kept,
+        key=lambda k: (str(chunk_position(k[2])[0]), safe_int(chunk_position(k[2])[1]))
+    )
+    spans = []
+    prev = None
+    for score, words, meta in by_position:
+        doc, chunk_id = chunk_position(meta)
+        if (
+            prev is not None
+            and chunk_id is not None
+            and prev[0] == doc
+            and safe_int(prev[1]) + 1 == safe_int(chunk_id)
+        ):
+            span = spans[-1]
+            words = words[overlap_length(span["words"][-1], words):]
+            span["score"] = max(span["score"], score)
+        else:
+            span = {"score": score, "words": [], "metas": []}
+            spans.append(span)
+        span["words"].append(words)
+        span["metas"].append(meta)
+        prev = (doc, chunk_id)
+
+    spans.sort(key=lambda sp: sp["score"], reverse=True)
+    packed = [
+        {
+            "score": sp["score"],
+            "pieces": [(" ".join(w), m) for w, m in zip(sp["words"], sp["metas"]) if w]
+        }
+        for sp in spans
+    ]
+
+    if stats is not None:
+        tokens_out = sum(len(t.split()) for sp in packed for t, _ in sp["pieces"])
+        stats.update(
+            passages_in=len(results),
+            passages_kept=len(kept),
+            duplicates_dropped=duplicates,
+            spans=len(packed),
+            tokens_in=tokens_in,
+            tokens_packed=tokens_out,
+            tokens_saved=tokens_in - tokens_out
+        )
+    return packed
+
+
+def spans_to_context(spans):
+    """
+    returns: (context text, source metadata in span order)
+    """
+    text = "\n".join(" ".join(t for t, _ in sp["pieces"]) for sp in spans)
+    sources = [m for sp in spans for _, m in sp["pieces"]]
+    return text.strip(), sources
+
+
+def pack_context(results, allow_multi_section=False, token_budget=CONTEXT_TOKEN_BUDGET, stats=None):
+    """
+    Drop-in alternative to assemble_chunks returning (context, sources).
+    """
+    spans = pack_passages(
+        results,
+        token_budget=token_budget,
+        allow_multi_section=allow_multi_section,
+        stats=stats
+    )
+    return spans_to_context(spans)
+
+
+def assembled_spans(results, allow_multi_section=False):
+    """
+    The chunks assemble_chunks would pick, as single-piece spans.
+    """
+    _, sources = assemble_chunks(results, allow_multi_section=allow_multi_section)
+    picked = {id(meta) for meta in sources}
+    return [
+        {"score": score, "pieces": [(text.strip(), meta)]}
+        for score, text, meta in results
+        if id(meta) in picked
+    ]
+
+
+def split_sentences(text: str):
+    return [s.strip() for s in SENTENCE_RE.split(text) if s.strip()]
+
+
+def compress_passages(spans, query_vector, ratio=COMPRESS_RATIO, stats=None):
+    """
+    Query-focused extractive compression.
+
+    Splits every piece into sentences, scores each sentence by dot product
+    with the query embedding and keeps the best ones, in original order,
+    until ratio of the context tokens is reached. Pieces that lose all of
+    their sentences are dropped, so sources only cite chunks that still
+    contribute text.
+    """
+    sentences = []  # (span index, piece index, text)
+    for si, span in enumerate(spans):
+        for pi, (text, _) in enumerate(span["pieces"]):
+            sentences.extend((si, pi, sent) for sent in split_sentences(text))
+
+    lengths = [len(sent.split()) for _, _, sent in sentences]
+    total = sum(lengths)
+    if total < COMPRESS_MIN_TOKENS or len(sentences) <= COMPRESS_MIN_SENTENCES:
+        return spans
+
+    vectors = np.asarray(
+        [e["values"] for e in embed_texts(DENSE_MODEL, [s for _, _, s in sentences], "passage")],
+        dtype=np.float32
+    )
+    scores = vectors @ np.asarray(query_vector, dtype=np.float32)
+
+    target = ratio * total
+    keep, kept_tokens = set(), 0
+    for i in np.argsort(-scores, kind="stable"):
+        if kept_tokens >= target and len(keep) >= COMPRESS_MIN_SENTENCES:
+            break
+        keep.add(int(i))
+        kept_tokens += lengths[i]
+
+    kept_text = {}
+    for i, (si, pi, sent) in enumerate(sentences):
+        if i in keep:
+            kept_text.setdefault((si, pi), []).append(sent)
+
+    compressed = []
+    for si, span in enumerate(spans):
+        pieces = [
+            (" ".join(kept_text[(si, pi)]), meta)
+            for pi, (_, meta) in enumerate(span["pieces"])
+            if (si, pi) in kept_text
+        ]
+        if pieces:
+            compressed.append({"score": span["score"], "pieces": pieces})
+
+    if stats is not None:
+        stats.update(
+            sentences_in=len(sentences),
+            sentences_kept=len(keep),
+            compression_tokens_in=total,
+            compression_tokens_out=kept_tokens
+        )
+    return compressed
+
+
+def select_chunks(results, allow_multi_section=False, stats=None):
+    """
+    Builds the LLM context with the configured CONTEXT_MODE, then applies
+    extractive compression when CONTEXT_COMPRESSION is on.
+
+    stats: the dict passed to hybrid_search; its query_vector is reused
+           for compression, and packing/compression figures are added
+    """
+    with timer("assemble"):
+        return _select_chunks(results, allow_multi_section, {} if stats is None else stats)
+
+
+def _select_chunks(results, allow_multi_section, stats):
+
+    if CONTEXT_MODE == "pack":
+        spans = pack_passages(results, allow_multi_section=allow_multi_section, stats=stats)
+    elif CONTEXT_COMPRESSION:
+        spans = assembled_spans(results, allow_multi_section)
+    else:
+        return assemble_chunks(results, allow_multi_section=allow_multi_section)
+
+    if CONTEXT_COMPRESSION and spans:
+        query_vector = stats.get("query_vector")
+        if query_vector is not None:
+            spans = compress_passages(spans, query_vector, stats=stats)
+
+    return spans_to_context(spans)
+
+
 def needs_global_context(query: str) -> bool:
     q = query.lower()
 
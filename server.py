@@ -1,11 +1,58 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+import traceback
+from contextlib import asynccontextmanager, aclosing
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 
-from ingest import ingest_document
-from query import answer_query
+from jobs import IngestQueue, QueueFull, NotRetryable
+from query import answer_query_async, stream_answer_query
+from answering import close_async_client, get_async_client
+from bm25 import use_bm25, get_lexical_index
+import metrics
+import pinecone_client
+from pdfreader import shutdown_page_pool
 
-app = FastAPI(title="RAG Engine")
+ingest_queue = IngestQueue()
+
+# set by warm_up(); /ready reports it
+readiness = {"ready": False, "error": None}
+
+
+def warm_up():
+    """
+    Opens the index connection and loads local indexes off the request path.
+    """
+    try:
+        pinecone_client.warm_up()
+        if use_bm25():
+            get_lexical_index()
+        readiness["ready"] = True
+        readiness["error"] = None
+    except Exception as e:
+        traceback.print_exc()
+        readiness["error"] = str(e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # start serving immediately; requests before warm-up completes
+    # initialize the backends lazily themselves
+    get_async_client()
+    warm = asyncio.create_task(asyncio.to_thread(warm_up))
+    # jobs cut off by the previous process resume from their checkpoints
+    await asyncio.to_thread(ingest_queue.resume_interrupted)
+    yield
+    warm.cancel()
+    ingest_queue.shutdown()
+    shutdown_page_pool()
+    await close_async_client()
+    await pinecone_client.close_async_client()
+
+
+app = FastAPI(title="RAG Engine", lifespan=lifespan)
 
 # -------- Request Models --------
 
@@ -13,35 +60,113 @@ class IngestRequest(BaseModel):
     doc_id: str
     signed_url: str   # path in R2 / Supabase Storage
     filename: str
+    tenant: Optional[str] = None   # routes to the tenant's namespace(s)
+
+class RetryRequest(BaseModel):
+    signed_url: Optional[str] = None   # fresh link if the old one expired
 
 class QueryRequest(BaseModel):
     question: str
     doc_ids: Optional[List[str]] = None
+    tenant: Optional[str] = None
 
 
 # -------- Routes --------
 
-@app.post("/ingest")
+@app.post("/ingest", status_code=202)
 def ingest(req: IngestRequest):
     print("A: entered /ingest route", flush=True)
     try:
-        ingest_document(
+        job = ingest_queue.submit(
             doc_id=req.doc_id,
             signed_url=req.signed_url,
-            filename=req.filename
+            filename=req.filename,
+            tenant=req.tenant
         )
-        return {"status": "indexed"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "queued", "job_id": job.id}
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job.to_dict()
+
+
+@app.post("/jobs/{job_id}/retry", status_code=202)
+def retry_job(job_id: str, req: Optional[RetryRequest] = None):
+    try:
+        job = ingest_queue.retry(job_id, signed_url=req.signed_url if req else None)
+    except NotRetryable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return {"status": "queued", "job_id": job.id}
 
 
 @app.post("/query")
-def query(req: QueryRequest):
+async def query(req: QueryRequest):
     try:
-        result = answer_query(
+        result = await answer_query_async(
             question=req.question,
-            doc_ids=req.doc_ids
+            doc_ids=req.doc_ids,
+            tenant=req.tenant
         )
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/ready")
+def ready():
+    if not readiness["ready"]:
+        raise HTTPException(
+            status_code=503,
+            detail=readiness["error"] or "warming up"
+        )
+    return {"status": "ready"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/query/stream")
+async def query_stream(req: QueryRequest, request: Request):
+    """
+    Server-Sent Events: "meta" (citations, context) first, then "token"
+    events as the LLM generates, then "done" (or "error").
+    """
+    async def events():
+        try:
+            async with aclosing(stream_answer_query(
+                question=req.question,
+                doc_ids=req.doc_ids,
+                tenant=req.tenant
+            )) as stream:
+                async for event, data in stream:
+                    # closing the stream cancels the upstream LLM request
+                    if await request.is_disconnected():
+                        break
+                    yield sse(event, data)
+        except Exception as e:
+            yield sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+
+# how long a duplicate caller waits on the in-flight call before running
+# its own computation
+COALESCE_TIMEOUT = float(os.getenv("COALESCE_TIMEOUT", "60"))
+
+
+def flight_key(*parts) -> str:
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls across threads: the first caller
+    for a key runs fn, later callers with the same key wait for its result
+    (or its exception) instead of repeating the work.
+
+    Waiting is bounded by timeout; a caller that times out runs fn itself.
+    """
+
+    def __init__(self, timeout=COALESCE_TIMEOUT):
+        self.timeout = timeout
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            if call.event.wait(self.timeout):
+                with self._lock:
+                    self.shared += 1
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            return fn(*args, **kwargs)
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight. fn is a zero-argument callable
+    returning an awaitable.
+
+    If the leading task is cancelled, waiting callers run fn themselves
+    rather than inheriting the cancellation.
+    """
+
+    def __init__(self, timeout=COALESCE_TIMEOUT):
+        self.timeout = timeout
+        self.shared = 0
+        self._calls = {}
+
+    async def do(self, key, fn):
+        future = self._calls.get(key)
+
+        if future is not None:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                return await fn()
+            except asyncio.CancelledError:
+                task = asyncio.current_task()
+                if future.cancelled() and not (task and task.cancelling()):
+                    return await fn()
+                raise
+            self.shared += 1
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark retrieved so an unshared failure is not logged twice
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
@@ -1,7 +1,5 @@
 from pinecone_client import get_index
 
-index = get_index()
-
 
 # for cid in missing:
 #     fetched = index.fetch(ids=[cid], namespace="ns1")
@@ -27,6 +25,7 @@ index = get_index()
 #     )
 
 def copy_namespace(src_ns, dst_ns, batch_size=100):
+    index = get_index()
     # Get all vector IDs from src namespace
     stats = index.describe_index_stats(namespace=src_ns)
     total = stats["namespaces"][src_ns]["vector_count"]
@@ -67,15 +66,19 @@ def copy_namespace(src_ns, dst_ns, batch_size=100):
 
 
 
-index.delete(
-    delete_all=True,
-    namespace="ns2"
-    
-)
+def clear_namespaces(namespaces=("ns2", "ns1")):
+    """
+    Deletes every vector in the given namespaces. Destructive: only runs
+    when this script is executed directly.
+    """
+    index = get_index()
+    for namespace in namespaces:
+        index.delete(
+            delete_all=True,
+            namespace=namespace
+        )
+    print(index.describe_index_stats())
+
 
-index.delete(
-    delete_all=True,
-    namespace="ns1"
-    
-)
-print(index.describe_index_stats())
+if __name__ == "__main__":
+    clear_namespaces()
@@ -0,0 +1,68 @@
+"""
+Shared fixtures: the service modules run against bench_stubs (stub
+inference, a throwaway LocalIndex) with checkpoints in a scratch directory.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# must precede the service imports, which read these at import time
+import bench_stubs  # noqa: E402
+
+os.environ["CHECKPOINT_DIR"] = os.path.join(bench_stubs.BENCH_DIR, "checkpoints")
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def inference():
+    stub = bench_stubs.StubInference()
+    bench_stubs.install(stub)
+    return stub
+
+
+@pytest.fixture
+def local_index(tmp_path, inference):
+    import pinecone_client
+    from local_index import LocalIndex
+
+    index = LocalIndex(str(tmp_path / "index"), dimension=bench_stubs.DIMENSION)
+    pinecone_client.set_index(index)
+    yield index
+    pinecone_client.set_index(None)
+
+
+@pytest.fixture
+def checkpoint_dir():
+    import checkpoint
+
+    shutil.rmtree(checkpoint.CHECKPOINT_DIR, ignore_errors=True)
+    yield checkpoint.CHECKPOINT_DIR
+    shutil.rmtree(checkpoint.CHECKPOINT_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def sample_pdf():
+    import bench_ingest
+
+    path = os.path.join(tempfile.mkdtemp(dir=bench_stubs.BENCH_DIR), "sample.pdf")
+    bench_ingest.write_pdf(path, bench_ingest.synthetic_pages(60))
+    return path
+
+
+@pytest.fixture
+def query_cache(monkeypatch):
+    """
+    An in-memory QueryCache as the shared instance (bench_stubs turns the
+    cache off).
+    """
+    import query_cache as module
+
+    cache = module.QueryCache(path="")
+    monkeypatch.setattr(module, "QUERY_CACHE_ENABLED", True)
+    monkeypatch.setattr(module, "_cache", cache)
+    return cache
@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+import bm25
+from bm25 import BM25Index
+
+WORDS = "router packet bgp tcp window loss route table peer session latency queue".split()
+
+
+def corpus(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        (f"c{i}", f"d{i % 4}", " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 30))))
+        for i in range(n)
+    ]
+
+
+def rebuilt(index, texts):
+    """
+    A fresh index over the live chunks, added in the same order.
+    """
+    fresh = BM25Index(path=index.path)
+    for chunk_id in sorted(index.ordinal_of, key=index.ordinal_of.get):
+        fresh.add(chunk_id, index.doc_ids[index.ordinal_of[chunk_id]], texts[chunk_id])
+    return fresh
+
+
+def assert_same_search(index, fresh):
+    for query in ("packet loss", "bgp peer session", "queue latency router", "unknown"):
+        for doc_ids in (None, ["d1"], ["d0", "d3"]):
+            got = index.search(query, top_k=20, doc_ids=doc_ids)
+            expected = fresh.search(query, top_k=20, doc_ids=doc_ids)
+            assert [c for c, _ in got] == [c for c, _ in expected]
+            assert [s for _, s in got] == pytest.approx([s for _, s in expected])
+
+
+@pytest.mark.parametrize("compact_ratio", [2.0, 0.25, 0.0])
+def test_deletes_score_like_a_rebuilt_index(tmp_path, monkeypatch, compact_ratio):
+    monkeypatch.setattr(bm25, "COMPACT_RATIO", compact_ratio)
+    chunks = corpus(80)
+    texts = {c: t for c, _, t in chunks}
+    index = BM25Index(path=str(tmp_path / "bm25.npz"))
+    index.add_many(chunks)
+
+    assert index.delete(["c1", "c5", "c9", "missing"]) == 3
+    assert index.delete_doc("d2") == 20
+    # re-adding an id tombstones its previous text
+    texts["c3"] = "bgp bgp bgp peer"
+    index.add("c3", "d3", texts["c3"])
+
+    assert len(index) == 80 - 3 - 20
+    dead = len(index.chunk_ids) - len(index)
+    if compact_ratio > 1:
+        assert dead == 3 + 20 + 1
+    elif compact_ratio == 0:
+        assert dead == 1
+    assert_same_search(index, rebuilt(index, texts))
+
+
+def test_compaction_waits_for_the_dead_ratio(tmp_path):
+    index = BM25Index(path=str(tmp_path / "bm25.npz"))
+    index.add_many(corpus(100))
+    index.delete([f"c{i}" for i in range(24)])
+    assert len(index.chunk_ids) == 100
+    index.delete(["c24"])
+    assert len(index.chunk_ids) == len(index) == 75
+    assert set(index.ordinal_of.values()) == set(range(75))
+
+
+def test_save_and_load_after_deletes(tmp_path):
+    chunks = corpus(50, seed=3)
+    texts = {c: t for c, _, t in chunks}
+    index = BM25Index(path=str(tmp_path / "bm25.npz"))
+    index.add_many(chunks)
+    index.delete(["c0", "c10"])
+    index.save()
+
+    loaded = BM25Index.load(index.path)
+    assert len(loaded) == 48
+    assert_same_search(loaded, rebuilt(index, texts))
+    assert loaded.delete_doc("d1") == 13
+    assert all(c not in {"c0", "c10"} for c, _ in loaded.search("packet router tcp", top_k=50))
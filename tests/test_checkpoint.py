@@ -0,0 +1,189 @@
+import functools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+import pytest
+
+import bench_stubs
+import checkpoint
+import embeddings
+import ingest
+import jobs
+from conftest import ROOT
+
+BATCH = 4
+KILL_AFTER = 2
+
+# ingests one document in a fresh process and dies mid-upsert, after
+# KILL_AFTER committed batches, without any cleanup
+CHILD = textwrap.dedent("""
+    import functools, os, shutil, sys, tempfile
+    sys.path.insert(0, {root!r})
+    import bench_stubs
+    from local_index import LocalIndex
+    index = LocalIndex({index!r}, dimension=bench_stubs.DIMENSION)
+    bench_stubs.install(bench_stubs.StubInference(), index=index)
+    import embeddings, ingest, jobs
+
+    def download(url, filename):
+        return shutil.copy({pdf!r}, os.path.join(tempfile.mkdtemp(), filename))
+
+    ingest.download_file = download
+    ingest.index_chunks = functools.partial(embeddings.index_chunks, batch_size={batch}, workers=1)
+    upsert, calls = index.upsert, [0]
+
+    def killed_upsert(vectors, namespace="", **kwargs):
+        if calls[0] == {kill_after}:
+            os._exit(9)
+        calls[0] += 1
+        return upsert(vectors, namespace=namespace, **kwargs)
+
+    index.upsert = killed_upsert
+    job = jobs.IngestQueue(workers=1).submit("doc-1", "https://files/sample.pdf?sig=1", "sample.pdf")
+    print(job.id, flush=True)
+    while job.status in ("queued", "running"):
+        __import__("time").sleep(0.02)
+""")
+
+
+def _download_from(pdf, calls):
+    def download(url, filename):
+        calls.append(url)
+        return shutil.copy(pdf, os.path.join(tempfile.mkdtemp(), filename))
+    return download
+
+
+def _wait(job, timeout=60):
+    deadline = time.time() + timeout
+    while job.status in ("queued", "running"):
+        assert time.time() < deadline, job.to_dict()
+        time.sleep(0.02)
+    return job
+
+
+def _vector_count(index):
+    return index.describe_index_stats()["total_vector_count"]
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    monkeypatch.setattr(
+        ingest, "index_chunks",
+        functools.partial(embeddings.index_chunks, batch_size=BATCH, workers=1)
+    )
+
+
+def test_killed_ingest_resumes_in_fresh_queue(tmp_path, local_index, checkpoint_dir, sample_pdf, small_batches, monkeypatch):
+    env = dict(os.environ, CHECKPOINT_DIR=checkpoint_dir)
+    script = CHILD.format(root=ROOT, index=local_index.path, pdf=sample_pdf, batch=BATCH, kill_after=KILL_AFTER)
+    child = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, timeout=120)
+    assert child.returncode == 9, child.stderr
+    job_id = next(line for line in child.stdout.splitlines() if checkpoint.valid_job_id(line.strip()))
+
+    state = checkpoint.read_state(job_id)
+    assert state["status"] == "running"
+    assert state["committed"] == KILL_AFTER * BATCH
+    assert state["signed_url"] == "https://files/sample.pdf?sig=1"
+    assert checkpoint.interrupted(state)
+
+    # the child wrote to the same files; reopen them
+    from local_index import LocalIndex
+    index = LocalIndex(local_index.path, dimension=bench_stubs.DIMENSION)
+    bench_stubs.install(bench_stubs.StubInference(), index=index)
+    assert _vector_count(index) == KILL_AFTER * BATCH
+
+    upserted = []
+    upsert = index.upsert
+
+    def counted_upsert(vectors, namespace="", **kwargs):
+        upserted.extend(v["id"] for v in vectors)
+        return upsert(vectors, namespace=namespace, **kwargs)
+
+    index.upsert = counted_upsert
+    downloads = []
+    monkeypatch.setattr(ingest, "download_file", _download_from(sample_pdf, downloads))
+
+    queue = jobs.IngestQueue(workers=1)
+    try:
+        assert queue.resume_interrupted() == 1
+        job = _wait(queue.get(job_id))
+    finally:
+        queue.shutdown()
+
+    assert job.status == "succeeded", job.error
+    assert downloads == []
+    total = _vector_count(index)
+    assert len(upserted) == total - KILL_AFTER * BATCH
+    assert checkpoint.read_state(job_id) is None
+
+    # the same document ingested in one go gives the same vectors
+    fresh = LocalIndex(str(tmp_path / "fresh"), dimension=bench_stubs.DIMENSION)
+    bench_stubs.install(bench_stubs.StubInference(), index=fresh)
+    report = ingest.ingest_document("doc-1", "https://files/sample.pdf", "sample.pdf")
+    assert report["chunks"] == total == _vector_count(fresh)
+
+
+def test_failed_job_is_retryable_after_restart(local_index, checkpoint_dir, sample_pdf, small_batches, monkeypatch):
+    downloads = []
+    monkeypatch.setattr(ingest, "download_file", _download_from(sample_pdf, downloads))
+    upsert, calls = local_index.upsert, []
+
+    def failing_upsert(vectors, namespace="", **kwargs):
+        calls.append(len(vectors))
+        if len(calls) == 2:
+            raise RuntimeError("index unavailable")
+        return upsert(vectors, namespace=namespace, **kwargs)
+
+    monkeypatch.setattr(local_index, "upsert", failing_upsert)
+    first = jobs.IngestQueue(workers=1)
+    job = _wait(first.submit("doc-2", "https://files/sample.pdf?sig=1", "sample.pdf", tenant="acme"))
+    first.shutdown()
+    assert job.status == "failed"
+
+    state = checkpoint.read_state(job.id)
+    assert (state["status"], state["tenant"], state["committed"]) == ("failed", "acme", BATCH)
+
+    # a new process knows nothing of the job but its checkpoint
+    second = jobs.IngestQueue(workers=1)
+    try:
+        assert second.resume_interrupted() == 0
+        restored = second.get(job.id)
+        assert restored.to_dict()["status"] == "failed"
+        assert restored.tenant == "acme"
+        assert "index unavailable" in restored.error
+        retried = _wait(second.retry(job.id, signed_url="https://files/sample.pdf?sig=2"))
+    finally:
+        second.shutdown()
+
+    assert retried.status == "succeeded", retried.error
+    assert len(downloads) == 1
+    assert second.get("0" * 32) is None
+    assert second.get("../../etc") is None
+
+
+def test_live_owner_blocks_a_second_claim(checkpoint_dir):
+    ckpt = checkpoint.Checkpoint("a" * 32, "doc", "f.pdf", root=checkpoint_dir)
+    ckpt.start()
+    state = checkpoint.read_state("a" * 32, checkpoint_dir)
+    assert state["status"] == "running"
+
+    # the parent of this process is alive and on the same host
+    state["owner"]["pid"] = os.getppid()
+    with open(os.path.join(ckpt.path, checkpoint.STATE_FILE), "w") as f:
+        json.dump(state, f)
+    assert not checkpoint.interrupted(checkpoint.read_state("a" * 32, checkpoint_dir))
+    with pytest.raises(checkpoint.CheckpointBusy):
+        checkpoint.Checkpoint("a" * 32, "doc", "f.pdf", root=checkpoint_dir).start()
+
+    # once that process is gone the job can be taken over
+    state["owner"]["pid"] = 2 ** 22 + 1
+    with open(os.path.join(ckpt.path, checkpoint.STATE_FILE), "w") as f:
+        json.dump(state, f)
+    assert checkpoint.interrupted(checkpoint.read_state("a" * 32, checkpoint_dir))
+    checkpoint.Checkpoint("a" * 32, "doc", "f.pdf", root=checkpoint_dir).start()
@@ -0,0 +1,60 @@
+import pytest
+
+from pdfreader import iter_document_blocks, semantic_chunk_blocks, build_chunk
+from utils import embed_batch, cosine_similarity, update_centroid
+
+
+def baseline_chunks(blocks, max_tokens=800, min_tokens=200, sim_threshold=0.78, batch_size=16):
+    """
+    semantic_chunk_blocks as it was before vectorization: a running mean
+    centroid compared by cosine similarity, one block at a time.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    current_emb = None
+    current_count = 0
+    embeddings = embed_batch([b["text"] for b in blocks], batch_size=batch_size)
+
+    for block, emb in zip(blocks, embeddings):
+        tokens = len(block["text"].split())
+        if not current:
+            current, current_emb, current_count, current_tokens = [block], emb, 1, tokens
+            continue
+        sim = cosine_similarity(current_emb, emb)
+        if (sim < sim_threshold and current_tokens >= min_tokens) or current_tokens + tokens > max_tokens:
+            chunks.append(build_chunk(current, len(chunks)))
+            current, current_emb, current_count, current_tokens = [block], emb, 1, tokens
+        else:
+            current.append(block)
+            current_emb = update_centroid(current_emb, emb, current_count)
+            current_count += 1
+            current_tokens += tokens
+
+    if current:
+        chunks.append(build_chunk(current, len(chunks)))
+    return chunks
+
+
+@pytest.fixture(scope="module")
+def blocks(sample_pdf):
+    return list(iter_document_blocks(sample_pdf))
+
+
+@pytest.mark.parametrize("sim_threshold", [0.2, 0.5, 0.78, 0.95])
+@pytest.mark.parametrize("min_tokens", [0, 60, 200])
+@pytest.mark.parametrize("lookahead", [0, 1, 4, 16])
+def test_matches_baseline(inference, blocks, sim_threshold, min_tokens, lookahead):
+    expected = baseline_chunks(blocks, min_tokens=min_tokens, sim_threshold=sim_threshold)
+    chunks = semantic_chunk_blocks(
+        blocks, min_tokens=min_tokens, sim_threshold=sim_threshold, lookahead=lookahead
+    )
+    for chunk in chunks:
+        chunk.pop("embedding", None)
+    assert chunks == expected
+
+
+def test_thresholds_change_the_chunking(inference, blocks):
+    # guards the comparison above against a corpus where every block merges
+    counts = {len(semantic_chunk_blocks(blocks, min_tokens=0, sim_threshold=t)) for t in (0.2, 0.95)}
+    assert len(counts) == 2
@@ -0,0 +1,188 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import local_index
+from local_index import LocalIndex
+
+DIM = 8
+
+
+def make_vectors(n, seed=0, prefix="v"):
+    rng = np.random.default_rng(seed)
+    vectors = []
+    for i in range(n):
+        indices = sorted(rng.choice(50, size=3, replace=False).tolist())
+        vectors.append({
+            "id": f"{prefix}{i}",
+            "values": rng.standard_normal(DIM).astype(np.float32).tolist(),
+            "sparse_values": {"indices": indices, "values": rng.random(3).tolist()},
+            "metadata": {"doc_id": f"d{i % 3}", "n": i},
+        })
+    return vectors
+
+
+def brute_force(vectors, vector, sparse=None, doc_ids=None, top_k=10):
+    """
+    Reference scores: dense dot product plus sparse dot product.
+    """
+    scored = []
+    for v in vectors:
+        if doc_ids and v["metadata"]["doc_id"] not in doc_ids:
+            continue
+        score = float(np.asarray(v["values"], dtype=np.float32) @ np.asarray(vector, dtype=np.float32))
+        if sparse:
+            weights = dict(zip(v["sparse_values"]["indices"], v["sparse_values"]["values"]))
+            score += sum(weights.get(i, 0.0) * q for i, q in zip(sparse["indices"], sparse["values"]))
+        scored.append((score, v["id"]))
+    scored.sort(key=lambda s: -s[0])
+    return scored[:top_k]
+
+
+def query(index, vector, sparse=None, doc_ids=None, top_k=10, namespace="ns"):
+    res = index.query(
+        top_k=top_k, vector=vector, sparse_vector=sparse, namespace=namespace,
+        filter={"doc_id": {"$in": doc_ids}} if doc_ids else None, include_metadata=True
+    )
+    return [(m["score"], m["id"]) for m in res["matches"]]
+
+
+def assert_same(got, expected):
+    assert [i for _, i in got] == [i for _, i in expected]
+    np.testing.assert_allclose([s for s, _ in got], [s for s, _ in expected], rtol=1e-5, atol=1e-5)
+
+
+QUERIES = [
+    (np.linspace(-1, 1, DIM).tolist(), None, None),
+    (np.linspace(1, -1, DIM).tolist(), {"indices": [1, 7, 19], "values": [0.5, 2.0, 1.0]}, None),
+    (np.ones(DIM).tolist(), {"indices": [3, 4], "values": [1.0, 1.0]}, ["d1"]),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    return LocalIndex(str(tmp_path / "index"), dimension=DIM)
+
+
+def check_queries(index, live):
+    for vector, sparse, doc_ids in QUERIES:
+        assert_same(query(index, vector, sparse, doc_ids), brute_force(live, vector, sparse, doc_ids))
+
+
+def test_queries_match_brute_force(index):
+    vectors = make_vectors(60)
+    index.upsert(vectors, namespace="ns")
+    check_queries(index, vectors)
+    assert index.query(top_k=5, vector=QUERIES[0][0], namespace="other")["matches"] == []
+
+
+def test_delete_swaps_rows_and_keeps_results_exact(index, tmp_path):
+    vectors = make_vectors(40)
+    index.upsert(vectors, namespace="ns")
+    gone = {"v0", "v7", "v39", "v20", "v38"}
+    index.delete(ids=sorted(gone), namespace="ns")
+    live = [v for v in vectors if v["id"] not in gone]
+
+    ns = index._namespaces["ns"]
+    assert ns.count == len(live)
+    assert sorted(ns.row_of.values()) == list(range(len(live)))
+    fetched = index.fetch(ids=[v["id"] for v in live] + ["v0"], namespace="ns")["vectors"]
+    assert set(fetched) == {v["id"] for v in live}
+    for v in live:
+        np.testing.assert_allclose(fetched[v["id"]]["values"], v["values"], rtol=1e-6)
+        assert fetched[v["id"]]["metadata"] == v["metadata"]
+        assert fetched[v["id"]]["sparse_values"] == v["sparse_values"]
+    # no posting points at a deleted or moved-away row
+    for postings in ns.postings.values():
+        for row in postings:
+            assert row < ns.count
+    check_queries(index, live)
+
+    # the swapped rows survive a reopen
+    check_queries(LocalIndex(index.path, dimension=DIM), live)
+
+
+def test_overwrite_replaces_values_and_postings(index):
+    vectors = make_vectors(20)
+    index.upsert(vectors, namespace="ns")
+    version = index._namespaces["ns"]._version
+    changed = make_vectors(5, seed=9)
+    index.upsert(changed, namespace="ns")
+    assert index._namespaces["ns"]._version > version
+
+    live = changed + vectors[5:]
+    check_queries(index, live)
+    index.delete(filter={"doc_id": "d2"}, namespace="ns")
+    check_queries(index, [v for v in live if v["metadata"]["doc_id"] != "d2"])
+
+
+def test_query_rescored_when_rows_move_during_the_scan(index, monkeypatch):
+    vectors = make_vectors(30)
+    index.upsert(vectors, namespace="ns")
+    score_plan = local_index._Namespace.score_plan
+    calls = []
+
+    def racing_score_plan(plan, vector):
+        calls.append(1)
+        if len(calls) == 1:
+            # runs without the lock: a delete moves the last row into v3
+            index.delete(ids=["v3"], namespace="ns")
+        return score_plan(plan, vector)
+
+    monkeypatch.setattr(local_index._Namespace, "score_plan", staticmethod(racing_score_plan))
+    vector = QUERIES[0][0]
+    got = query(index, vector, top_k=30)
+    assert len(calls) == 2
+    assert_same(got, brute_force([v for v in vectors if v["id"] != "v3"], vector, top_k=30))
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_ivf_is_dropped_when_rows_change(index, monkeypatch):
+    monkeypatch.setattr(local_index, "IVF_MIN_VECTORS", 100)
+    monkeypatch.setattr(local_index, "IVF_NPROBE", 1000)
+    vectors = make_vectors(200)
+    index.upsert(vectors, namespace="ns")
+    ns = index._namespaces["ns"]
+
+    # the first query scans brute force and starts the build
+    check_queries(index, vectors)
+    wait_for(lambda: ns._ivf is not None)
+    # probing every list is exact
+    check_queries(index, vectors)
+
+    index.delete(ids=["v1", "v2"], namespace="ns")
+    live = vectors[:1] + vectors[3:]
+    check_queries(index, live)
+    assert ns._ivf is None or ns._ivf["version"] == ns._version
+
+
+def test_stale_ivf_build_is_not_installed(index, monkeypatch):
+    monkeypatch.setattr(local_index, "IVF_MIN_VECTORS", 100)
+    started, release = threading.Event(), threading.Event()
+    build_ivf = local_index.build_ivf
+
+    def slow_build(vectors):
+        started.set()
+        assert release.wait(10)
+        return build_ivf(vectors)
+
+    monkeypatch.setattr(local_index, "build_ivf", slow_build)
+    vectors = make_vectors(150)
+    index.upsert(vectors, namespace="ns")
+    ns = index._namespaces["ns"]
+    query(index, QUERIES[0][0])
+    assert started.wait(10)
+
+    index.delete(ids=["v0"], namespace="ns")
+    release.set()
+    wait_for(lambda: not ns._ivf_building)
+    assert ns._ivf is None
+    check_queries(index, vectors[1:])
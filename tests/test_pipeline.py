@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from pipeline import batched, bounded
+
+
+def producer_thread(name):
+    return next(t for t in threading.enumerate() if t.name == f"pipeline-{name}")
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_batched():
+    assert list(batched(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(batched([], 3)) == []
+
+
+def test_items_pass_through_in_order():
+    assert list(bounded(iter(range(100)), maxsize=3, name="order")) == list(range(100))
+
+
+def test_producer_error_reaches_consumer():
+    def source():
+        yield 1
+        raise ValueError("parse failed")
+
+    it = bounded(source(), name="error")
+    assert next(it) == 1
+    with pytest.raises(ValueError, match="parse failed"):
+        next(it)
+
+
+def test_full_queue_holds_back_the_producer():
+    pulled = []
+
+    def source():
+        for i in range(100):
+            pulled.append(i)
+            yield i
+
+    it = bounded(source(), maxsize=4, name="backpressure")
+    assert next(it) == 0
+    time.sleep(0.3)
+    # the queue, the item being put and the one handed out
+    assert len(pulled) <= 4 + 2
+    it.close()
+
+
+def test_closing_the_consumer_stops_the_producer():
+    pulled = []
+    closed = threading.Event()
+
+    def source():
+        try:
+            for i in range(10 ** 6):
+                pulled.append(i)
+                yield i
+        finally:
+            closed.set()
+
+    it = bounded(source(), maxsize=2, name="shutdown")
+    assert [next(it) for _ in range(3)] == [0, 1, 2]
+    thread = producer_thread("shutdown")
+    it.close()
+
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert closed.wait(5)
+    assert len(pulled) < 10
+
+
+def test_consumer_error_stops_the_producer():
+    def consume():
+        for i in bounded(iter(range(10 ** 6)), maxsize=2, name="consumer-error"):
+            if i == 5:
+                raise RuntimeError("upsert failed")
+
+    with pytest.raises(RuntimeError, match="upsert failed"):
+        consume()
+    wait_until(lambda: not any(t.name == "pipeline-consumer-error" for t in threading.enumerate()))
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import query
+from query_cache import QueryCache
+
+RESULT = {"answer": "42", "citations": [], "context": "ctx"}
+
+
+def test_hit_on_normalized_question_and_scope():
+    cache = QueryCache(path="")
+    cache.put("What  is BGP?", ["b", "a"], RESULT)
+    assert cache.get("what is bgp?", ["a", "b", "a"]) == RESULT
+    assert cache.get("what is bgp?", ["a"]) is None
+    assert cache.get("what is bgp?", ["a", "b"], tenant="acme") is None
+
+
+def test_invalidation_drops_scoped_and_unscoped_entries():
+    cache = QueryCache(path="")
+    cache.put("q", ["a"], RESULT)
+    cache.put("q", ["b"], RESULT)
+    cache.put("q", None, RESULT)
+    assert cache.invalidate_doc("a") == 2
+    assert cache.get("q", ["a"]) is None
+    assert cache.get("q", None) is None
+    assert cache.get("q", ["b"]) == RESULT
+
+
+def test_ttl_and_lru_eviction():
+    cache = QueryCache(max_entries=2, ttl=0.05, path="")
+    cache.put("one", None, RESULT)
+    cache.put("two", None, RESULT)
+    cache.get("one", None)
+    cache.put("three", None, RESULT)
+    assert cache.get("two", None) is None
+    assert cache.get("one", None) == RESULT
+    time.sleep(0.06)
+    assert cache.get("one", None) is None
+
+
+def test_result_started_before_invalidation_is_not_stored():
+    cache = QueryCache(path="")
+    started = time.time()
+    cache.invalidate_doc("a")
+    assert not cache.put("q", ["a"], RESULT, started_at=started)
+    assert not cache.put("q", None, RESULT, started_at=started)
+    assert cache.put("q", ["b"], RESULT, started_at=started)
+    assert cache.get("q", ["a"]) is None
+
+    # a query that starts after the invalidation is stored again
+    assert cache.put("q", ["a"], RESULT, started_at=time.time())
+    assert cache.get("q", ["a"]) == RESULT
+
+
+def test_invalidation_in_another_process_wins(tmp_path):
+    path = str(tmp_path / "query_cache.sqlite")
+    worker_a, worker_b = QueryCache(path=path), QueryCache(path=path)
+
+    started = time.time()
+    worker_a.put("q", ["a"], RESULT)
+    assert worker_b.get("q", ["a"]) == RESULT
+
+    worker_b.invalidate_doc("a")
+    # worker_a still holds the entry in memory
+    assert worker_a.get("q", ["a"]) is None
+    assert not worker_a.put("q", ["a"], RESULT, started_at=started)
+    assert worker_b.get("q", ["a"]) is None
+
+
+def test_ingest_during_a_query_keeps_its_answer_out(query_cache, monkeypatch):
+    entered, release = threading.Event(), threading.Event()
+    runs = []
+
+    def slow_answer(question, doc_ids, tenant=None):
+        runs.append(question)
+        entered.set()
+        assert release.wait(5)
+        return dict(RESULT)
+
+    monkeypatch.setattr(query, "_answer_query", slow_answer)
+    results = []
+    worker = threading.Thread(target=lambda: results.append(query.answer_query("q", ["a"])))
+    worker.start()
+    assert entered.wait(5)
+    query_cache.invalidate_doc("a")
+    release.set()
+    worker.join(5)
+
+    assert results == [RESULT]
+    assert query_cache.get("q", ["a"]) is None
+
+    # the next run is cached and then served without recomputing
+    query.answer_query("q", ["a"])
+    assert query.answer_query("q", ["a"]) == RESULT
+    assert len(runs) == 2
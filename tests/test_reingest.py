@@ -0,0 +1,75 @@
+from embeddings import index_chunks
+from namespaces import SHARED_NAMESPACE
+from utils import DENSE_MODEL
+
+TEXTS = [
+    "Routers forward packets using a forwarding table.",
+    "BGP sessions exchange routes between peers.",
+    "TCP grows its congestion window on every ack.",
+    "Packet loss shrinks the congestion window.",
+    "Queues add latency under load.",
+    "BGP sessions exchange routes between peers.",
+]
+
+
+def chunks(texts, pages=None, doc_id="doc"):
+    return [
+        {
+            "text": text,
+            "metadata": {
+                "doc_id": doc_id, "source": doc_id + ".pdf", "section": "1",
+                "page": pages[i] if pages else i + 1, "global_chunk_id": i
+            }
+        }
+        for i, text in enumerate(texts)
+    ]
+
+
+def embedded(inference):
+    return inference.stats.to_dict()["items"].get(f"embed:{DENSE_MODEL}", 0)
+
+
+def doc_vectors(index):
+    pages = index.list(prefix="doc#", namespace=SHARED_NAMESPACE)
+    ids = [v["id"] for page in pages for v in page["vectors"]]
+    return index.fetch(ids=ids, namespace=SHARED_NAMESPACE)["vectors"]
+
+
+def test_reingest_only_writes_what_changed(local_index, inference):
+    first = index_chunks(chunks(TEXTS), batch_size=2)
+    assert first == {"chunks": 6, "upserted": 6, "updated": 0, "unchanged": 0, "deleted": 0}
+    assert embedded(inference) == 6
+    ids = set(doc_vectors(local_index))
+    # the repeated text gets its own id
+    assert len(ids) == 6
+
+    same = index_chunks(chunks(TEXTS), batch_size=2)
+    assert same == {"chunks": 6, "upserted": 0, "updated": 0, "unchanged": 6, "deleted": 0}
+    assert embedded(inference) == 6
+    assert set(doc_vectors(local_index)) == ids
+
+    # edit chunk 2, drop chunk 4, add one at the end, and move chunk 0 to
+    # another page
+    edited = list(TEXTS)
+    edited[2] = "TCP halves its congestion window on loss."
+    del edited[4]
+    edited.append("Shaping smooths bursts.")
+    pages = [9] + list(range(2, len(edited) + 1))
+    report = index_chunks(chunks(edited, pages), batch_size=2)
+
+    # chunk 5 (the repeated text) shifted to position 4: its metadata changed
+    assert report == {"chunks": 6, "upserted": 2, "updated": 2, "unchanged": 2, "deleted": 2}
+    assert embedded(inference) == 8
+    vectors = doc_vectors(local_index)
+    assert len(vectors) == 6
+    assert sorted(v["metadata"]["chunk_text"] for v in vectors.values()) == sorted(edited)
+    moved = next(v for v in vectors.values() if v["metadata"]["chunk_text"] == TEXTS[0])
+    assert moved["metadata"]["page"] == 9
+
+
+def test_other_documents_are_untouched(local_index, inference):
+    index_chunks(chunks(TEXTS[:3], doc_id="doc-a"))
+    index_chunks(chunks(TEXTS[3:], doc_id="doc-b"))
+    report = index_chunks(chunks(TEXTS[:1], doc_id="doc-a"))
+    assert report["deleted"] == 2
+    assert local_index.describe_index_stats()["total_vector_count"] == 1 + 3
@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bench_stubs
+import bm25
+import namespaces
+import pinecone_client
+import retrieval
+from embeddings import index_chunks
+
+
+class AsyncInference:
+    """
+    pc.inference of PineconeAsyncio over a stub.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def embed(self, model, inputs, parameters=None):
+        return self.inner.embed(model, inputs, parameters)
+
+    async def rerank(self, model, query, documents, rank_fields=("text",), return_documents=True, top_n=None, parameters=None):
+        return self.inner.rerank(model, query, documents, rank_fields, return_documents, top_n, parameters)
+
+
+class AsyncIndex:
+    def __init__(self, inner):
+        self.inner = inner
+        self.queries = 0
+
+    async def query(self, **kwargs):
+        self.queries += 1
+        return self.inner.query(**kwargs)
+
+    async def fetch(self, **kwargs):
+        return self.inner.fetch(**kwargs)
+
+
+def chunks(doc_id, texts, tenant):
+    return [
+        {
+            "text": text,
+            "metadata": {
+                "doc_id": doc_id, "tenant": tenant, "source": doc_id + ".pdf",
+                "page": i + 1, "global_chunk_id": i, "section": "1"
+            }
+        }
+        for i, text in enumerate(texts)
+    ]
+
+
+@pytest.fixture(params=["sparse", "bm25"])
+def corpus(request, local_index, monkeypatch):
+    monkeypatch.setattr(bm25, "LEXICAL_BACKEND", request.param)
+    monkeypatch.setattr(namespaces, "NAMESPACE_STRATEGY", "document")
+    index_chunks(chunks("net-a", [
+        "router packet forwarding table", "bgp session peers", "unrelated cooking recipe"
+    ], "acme"))
+    index_chunks(chunks("net-b", ["packet loss and retransmission", "tcp congestion window"], "acme"))
+    return local_index
+
+
+def test_async_search_uses_async_clients(corpus):
+    expected_stats = {}
+    expected = retrieval.hybrid_search("packet loss", final_k=4, stats=expected_stats, tenant="acme")
+
+    sync_stub, async_stub = bench_stubs.StubInference(), bench_stubs.StubInference()
+    async_index = AsyncIndex(corpus)
+    pinecone_client.set_client(
+        SimpleNamespace(inference=sync_stub),
+        async_client=SimpleNamespace(inference=AsyncInference(async_stub))
+    )
+    pinecone_client.set_index(corpus, async_index=async_index)
+
+    stats = {}
+    results = asyncio.run(retrieval.hybrid_search_async("packet loss", final_k=4, stats=stats, tenant="acme"))
+
+    assert results == expected
+    assert stats["namespaces"] == expected_stats["namespaces"] == 2
+    assert async_index.queries == 2
+    assert sync_stub.stats.to_dict()["calls"] == {}
+    assert async_stub.stats.to_dict()["calls"]["rerank:" + retrieval.RERANK_MODEL] == 1
+
+
+def test_async_search_falls_back_to_blocking_pool(corpus):
+    expected = retrieval.hybrid_search("tcp window", final_k=3, tenant="acme")
+
+    # bench_stubs.install replaces only the sync client
+    assert pinecone_client.get_async_client() is None
+    assert asyncio.run(pinecone_client.get_async_index()) is None
+    assert asyncio.run(retrieval.hybrid_search_async("tcp window", final_k=3, tenant="acme")) == expected
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight, AsyncSingleFlight, flight_key
+
+
+def test_flight_key_is_stable():
+    assert flight_key("embed", ["a", "b"]) == flight_key("embed", ["a", "b"])
+    assert flight_key("embed", ["a", "b"]) != flight_key("embed", ["b", "a"])
+
+
+# ---- threads ----
+
+def run_concurrently(n, target):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(target())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return results, errors
+
+
+def test_identical_calls_share_one_run():
+    flight = SingleFlight()
+    runs = []
+
+    def fn():
+        runs.append(1)
+        time.sleep(0.2)
+        return "value"
+
+    results, errors = run_concurrently(5, lambda: flight.do("k", fn))
+    assert results == ["value"] * 5 and not errors
+    assert len(runs) == 1
+    assert flight.shared == 4
+    # the finished call is forgotten
+    flight.do("k", fn)
+    assert len(runs) == 2
+
+
+def test_leader_error_reaches_waiters():
+    flight = SingleFlight()
+
+    def fn():
+        time.sleep(0.2)
+        raise ValueError("rate limited")
+
+    results, errors = run_concurrently(3, lambda: flight.do("k", fn))
+    assert results == []
+    assert len(errors) == 3 and all(isinstance(e, ValueError) for e in errors)
+
+
+def test_waiter_past_timeout_runs_its_own_call():
+    flight = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flight.do("k", release.wait, 5))
+    leader.start()
+    time.sleep(0.02)
+
+    assert flight.do("k", lambda: "own") == "own"
+    assert flight.shared == 0
+    release.set()
+    leader.join(5)
+
+
+# ---- asyncio ----
+
+def test_async_identical_calls_share_one_run():
+    flight = AsyncSingleFlight()
+    runs = []
+
+    async def fn():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", fn) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["value"] * 5
+    assert len(runs) == 1 and flight.shared == 4
+
+
+def test_async_leader_error_reaches_waiters():
+    flight = AsyncSingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.05)
+        raise ValueError("rate limited")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", fn) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert len(errors) == 3 and all(isinstance(e, ValueError) for e in errors)
+
+
+def test_async_cancelled_leader_does_not_cancel_waiters():
+    flight = AsyncSingleFlight()
+    runs = []
+
+    async def fn():
+        runs.append(1)
+        await asyncio.sleep(0.1)
+        return len(runs)
+
+    async def main():
+        leader = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(flight.do("k", fn)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*waiters)
+
+    results = asyncio.run(main())
+    # each waiter ran fn itself instead of inheriting the cancellation
+    assert len(runs) == 3
+    assert sorted(results) == [3, 3]
+    assert flight.shared == 0
+
+
+def test_async_cancelled_waiter_leaves_the_leader_running():
+    flight = AsyncSingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        leader = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(main()) == "value"
+    assert not flight._calls
+
+
+def test_async_waiter_past_timeout_runs_its_own_call():
+    flight = AsyncSingleFlight(timeout=0.02)
+
+    async def slow():
+        await asyncio.sleep(0.2)
+        return "leader"
+
+    async def own():
+        return "own"
+
+    async def main():
+        leader = asyncio.create_task(flight.do("k", slow))
+        await asyncio.sleep(0)
+        result = await flight.do("k", own)
+        return result, await leader
+
+    assert asyncio.run(main()) == ("own", "leader")
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import query
+import server
+
+CACHED = {"answer": "BGP exchanges routes.", "citations": ["1.2 (page 3)"], "context": "BGP ..."}
+RESULTS = [
+    (0.9, "BGP peers exchange routes over TCP.", {"doc_id": "net", "section": "1.2", "page": 3, "global_chunk_id": 0}),
+]
+
+
+def events(response):
+    parsed = []
+    for frame in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in frame.splitlines())
+        parsed.append((lines["event"], json.loads(lines["data"])))
+    return parsed
+
+
+@pytest.fixture
+def client():
+    # no lifespan: nothing to warm up or resume
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def retrieval_calls(monkeypatch):
+    calls = []
+
+    async def hybrid_search_async(query, doc_ids=None, stats=None, tenant=None, **kwargs):
+        calls.append(query)
+        return list(RESULTS)
+
+    async def stream_llm(context, question):
+        for token in ("BGP ", "peers ", "exchange routes."):
+            yield token
+
+    monkeypatch.setattr(query, "hybrid_search_async", hybrid_search_async)
+    monkeypatch.setattr(query, "stream_llm", stream_llm)
+    return calls
+
+
+def test_stream_serves_a_cache_hit(client, query_cache, retrieval_calls):
+    query_cache.put("What does BGP do?", ["net"], CACHED)
+
+    response = client.post("/query/stream", json={"question": "what does  BGP do?", "doc_ids": ["net"]})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert events(response) == [
+        ("meta", {"citations": CACHED["citations"], "context": CACHED["context"]}),
+        ("token", CACHED["answer"]),
+        ("done", {"answer": CACHED["answer"]}),
+    ]
+    assert retrieval_calls == []
+
+
+def test_streamed_answer_is_cached_for_both_endpoints(client, query_cache, retrieval_calls):
+    body = {"question": "What does BGP do?", "doc_ids": ["net"]}
+    streamed = events(client.post("/query/stream", json=body))
+    assert [e for e, _ in streamed] == ["meta", "token", "token", "token", "done"]
+    assert streamed[-1][1] == {"answer": "BGP peers exchange routes."}
+
+    again = events(client.post("/query/stream", json=body))
+    assert again[1:] == [("token", "BGP peers exchange routes."), ("done", {"answer": "BGP peers exchange routes."})]
+    assert client.post("/query", json=body).json()["answer"] == "BGP peers exchange routes."
+    assert retrieval_calls == ["What does BGP do?"]
@@ -1,18 +1,193 @@
-from pinecone_client import pc
+from pinecone_client import get_client, get_async_client
+from embed_cache import get_embedding_cache
+from singleflight import SingleFlight, AsyncSingleFlight, flight_key
+from metrics import inc, EMBED_CALLS, EMBED_INPUTS, EMBED_TOKENS, CACHE_HITS, CACHE_MISSES
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
 import numpy as np
-def pinecone_embed(texts):
+import os
+import random
+import time
+
+DENSE_MODEL = "llama-text-embed-v2"
+SPARSE_MODEL = "pinecone-sparse-english-v0"
+
+# identical concurrent embed requests (e.g. the same question arriving
+# twice) share one remote call
+_embed_flight = SingleFlight()
+_async_embed_flight = AsyncSingleFlight()
+
+# threads for the blocking calls left on the async path (embedding cache,
+# BM25 scoring, the local index, stub clients). Kept apart from the event
+# loop's default executor, which has only cpu_count + 4 threads and is
+# shared with everything else calling asyncio.to_thread.
+ASYNC_BLOCKING_WORKERS = int(os.getenv("ASYNC_BLOCKING_WORKERS", "32"))
+_blocking_pool = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Awaits fn(*args, **kwargs) run on the blocking pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_pool, functools.partial(fn, *args, **kwargs))
+
+
+def _as_plain(model, r):
+    if model == SPARSE_MODEL:
+        return {
+            "sparse_indices": list(r["sparse_indices"]),
+            "sparse_values": list(r["sparse_values"])
+        }
+    return {"values": list(r["values"])}
+
+
+def is_rate_limited(e) -> bool:
+    status = getattr(e, "status", None) or getattr(e, "status_code", None)
+    if status == 429:
+        return True
+    msg = str(e).lower()
+    return "429" in msg or "rate limit" in msg or "too many requests" in msg
+
+
+def with_retry(fn, *args, retries=5, base_delay=1.0, max_delay=30.0, **kwargs):
+    """
+    Calls fn, retrying rate-limit errors with exponential backoff and jitter.
+    Any other error is raised immediately.
     """
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries or not is_rate_limited(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            time.sleep(delay * (0.5 + random.random() / 2))
+
+
+async def with_retry_async(fn, *args, retries=5, base_delay=1.0, max_delay=30.0, **kwargs):
+    """
+    with_retry for a coroutine function.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries or not is_rate_limited(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            await asyncio.sleep(delay * (0.5 + random.random() / 2))
+
+
+def _embed_remote(model, texts, input_type, cache):
+    inc(EMBED_CALLS, model=model)
+    inc(EMBED_INPUTS, len(texts), model=model)
+    inc(EMBED_TOKENS, sum(len(t.split()) for t in texts), model=model)
+    res = with_retry(
+        get_client().inference.embed,
+        model=model,
+        inputs=texts,
+        parameters={
+            "input_type": input_type,
+            "truncate": "END"
+        }
+    )
+    fresh = [_as_plain(model, r) for r in res]
+    if cache:
+        fresh = cache.put_many(model, input_type, texts, fresh)
+    return fresh
+
+
+def embed_texts(model, texts, input_type):
+    """
+    Single entry point for pc.inference.embed.
     texts: List[str]
-    returns: List[List[float]]
+    returns: list of {"values"} (dense) or {"sparse_indices", "sparse_values"}
+             (sparse) dicts; only cache misses go to the network
     """
-    res = pc.inference.embed(
-        model="llama-text-embed-v2",
+    if not texts:
+        return []
+
+    cache = get_embedding_cache()
+    results = cache.get_many(model, input_type, texts) if cache else [None] * len(texts)
+    if cache:
+        hits = sum(r is not None for r in results)
+        inc(CACHE_HITS, hits, cache="embedding")
+        inc(CACHE_MISSES, len(texts) - hits, cache="embedding")
+
+    # each distinct missing text is embedded once
+    missing = list(dict.fromkeys(t for t, r in zip(texts, results) if r is None))
+    if missing:
+        fresh = _embed_flight.do(
+            flight_key("embed", model, input_type, missing),
+            _embed_remote, model, missing, input_type, cache
+        )
+
+        by_text = dict(zip(missing, fresh))
+        results = [r if r is not None else by_text[t] for t, r in zip(texts, results)]
+
+    return results
+
+
+async def _embed_remote_async(model, texts, input_type, cache):
+    client = get_async_client()
+    if client is None:
+        return await run_blocking(_embed_remote, model, texts, input_type, cache)
+    inc(EMBED_CALLS, model=model)
+    inc(EMBED_INPUTS, len(texts), model=model)
+    inc(EMBED_TOKENS, sum(len(t.split()) for t in texts), model=model)
+    res = await with_retry_async(
+        client.inference.embed,
+        model=model,
         inputs=texts,
         parameters={
-            "input_type": "passage",
+            "input_type": input_type,
             "truncate": "END"
         }
     )
+    fresh = [_as_plain(model, r) for r in res]
+    if cache:
+        fresh = await run_blocking(cache.put_many, model, input_type, texts, fresh)
+    return fresh
+
+
+async def embed_texts_async(model, texts, input_type):
+    """
+    embed_texts over the asyncio Pinecone client; the SQLite embedding
+    cache is read and written on the blocking pool.
+    """
+    if not texts:
+        return []
+
+    cache = get_embedding_cache()
+    if cache:
+        results = await run_blocking(cache.get_many, model, input_type, texts)
+        hits = sum(r is not None for r in results)
+        inc(CACHE_HITS, hits, cache="embedding")
+        inc(CACHE_MISSES, len(texts) - hits, cache="embedding")
+    else:
+        results = [None] * len(texts)
+
+    missing = list(dict.fromkeys(t for t, r in zip(texts, results) if r is None))
+    if missing:
+        fresh = await _async_embed_flight.do(
+            flight_key("embed", model, input_type, missing),
+            lambda: _embed_remote_async(model, missing, input_type, cache)
+        )
+
+        by_text = dict(zip(missing, fresh))
+        results = [r if r is not None else by_text[t] for t, r in zip(texts, results)]
+
+    return results
+
+
+def pinecone_embed(texts):
+    """
+    texts: List[str]
+    returns: List[List[float]]
+    """
+    res = embed_texts(DENSE_MODEL, texts, "passage")
     return [r["values"] for r in res]
 def embed_one(text):
     return pinecone_embed([text])[0]
@@ -37,14 +212,7 @@ def embed_batch(texts, batch_size=16):
 
     for i in range(0, len(texts), batch_size):
         batch = texts[i:i + batch_size]
-        res = pc.inference.embed(
-            model="llama-text-embed-v2",
-            inputs=batch,
-            parameters={
-                "input_type": "passage",
-                "truncate": "END"
-            }
-        )
+        res = embed_texts(DENSE_MODEL, batch, "passage")
         all_embeddings.extend([r["values"] for r in res])
 
     return all_embeddings